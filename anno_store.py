@@ -0,0 +1,211 @@
+"""A single-file annotation store with memory-mapped random access
+
+`gen_anno` writes one JSON file per mono segment. With hundreds of thousands of segments, a store
+keeps all of them in one file (or one file per corpus shard) instead:
+
+    MAGIC | header length (uint64) | header (JSON) | notes | names | offsets
+
+* names: the segment names (`{track_title}_{i}`, i.e., the JSON file names without extension), UTF-8
+* offsets: int64, the notes of segment k are notes[offsets[k] : offsets[k + 1]]
+* notes: one note table (see `note_table.NOTE_DTYPE`) for all segments
+
+Every section is memory-mapped when the store is opened, so looking up the notes of a segment is a
+dict lookup plus an array slice, without parsing any JSON.
+
+    store = AnnoStore("clean_single_track_annotations.annos")
+    notes = store["Aerosmith - Dream On (ver 3)_Guitar 1 (dist)_0"]
+"""
+import glob
+import json
+import os
+
+import numpy as np
+
+from note_table import NOTE_DTYPE, json_to_note_table, note_table_to_json
+
+MAGIC = b"GPANNO\0\0"
+# the format version, in the header
+VERSION = 2
+# the sections start on 64-byte boundaries
+ALIGNMENT = 64
+# the room for the header, which is written last
+HEADER_SIZE = 4096
+
+
+def _align(position):
+    return (position + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class AnnoStoreWriter:
+    """Write an annotation store one segment at a time, without keeping the note tables in memory
+
+    The notes are appended to the file as the segments come in, the names and offsets are written
+    after them on `close`, and the header last, in the room reserved for it at the start.
+
+        with AnnoStoreWriter("annotations.annos") as writer:
+            writer.add("Aerosmith - Dream On (ver 3)_Guitar 1 (dist)_0", notes)
+
+    Args:
+        path (str): The path of the store file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.names = []
+        self.seen = set()
+        self.offsets = [0]
+        self.outfile = open(path, "wb")
+        self.outfile.write(MAGIC)
+        self.outfile.write(np.uint64(HEADER_SIZE).tobytes())
+        self.notes_offset = _align(len(MAGIC) + 8 + HEADER_SIZE)
+        self.outfile.seek(self.notes_offset)
+
+    def add(self, name, table):
+        """Append the note table of one segment
+
+        Raises:
+            ValueError: If a segment of the same name was already added
+        """
+        if name in self.seen:
+            raise ValueError(f"duplicate segment name {name!r}")
+        table = np.asarray(table, dtype=NOTE_DTYPE)
+        self.seen.add(name)
+        # UTF-8 rather than numpy's UTF-32 strings: a quarter of the size for the mostly ASCII titles
+        self.names.append(name.encode())
+        self.offsets.append(self.offsets[-1] + len(table))
+        self.outfile.write(table.tobytes())
+
+    def close(self):
+        """Write the names, the offsets and the header"""
+        name_width = max([len(name) for name in self.names] + [1])
+        names = np.array(self.names, dtype=f"S{name_width}")
+        offsets = np.array(self.offsets, dtype=np.int64)
+        header = {
+            "version": VERSION,
+            "segments": len(names),
+            "notes": int(offsets[-1]),
+            "name_dtype": names.dtype.str,
+            "note_dtype": np.lib.format.dtype_to_descr(NOTE_DTYPE),
+            "notes_offset": self.notes_offset,
+        }
+        position = _align(self.notes_offset + int(offsets[-1]) * NOTE_DTYPE.itemsize)
+        for section, array in (("names", names), ("offsets", offsets)):
+            header[f"{section}_offset"] = position
+            self.outfile.seek(position)
+            self.outfile.write(array.tobytes())
+            position = _align(position + array.nbytes)
+        header_bytes = json.dumps(header).encode()
+        if len(header_bytes) > HEADER_SIZE:
+            raise ValueError(f"the header of {self.path} does not fit in {HEADER_SIZE} bytes")
+        self.outfile.seek(len(MAGIC) + 8)
+        self.outfile.write(header_bytes.ljust(HEADER_SIZE))
+        self.outfile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # no half-written store behind
+            self.outfile.close()
+            os.remove(self.path)
+
+
+def write_anno_store(path, segments):
+    """Write annotation segments into one store file
+
+    Args:
+        path (str): The path of the store file
+        segments (iterable): (name, note table) pairs, one for each mono segment
+
+    Raises:
+        ValueError: If two segments have the same name
+    """
+    with AnnoStoreWriter(path) as writer:
+        for name, table in segments:
+            writer.add(name, table)
+
+
+class AnnoStore:
+    """Read-only, memory-mapped access to an annotation store written by `write_anno_store`
+
+    Args:
+        path (str): The path of the store file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as infile:
+            if infile.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not an annotation store")
+            header_size = int(np.frombuffer(infile.read(8), dtype=np.uint64)[0])
+            self.header = json.loads(infile.read(header_size))
+        if self.header.get("version") != VERSION:
+            raise ValueError(f"{path} is an annotation store of version {self.header.get('version')}, not {VERSION}")
+        note_dtype = np.dtype([tuple(field) for field in self.header["note_dtype"]])
+        self.names = self._map("names", np.dtype(self.header["name_dtype"]), self.header["segments"])
+        self.offsets = self._map("offsets", np.int64, self.header["segments"] + 1)
+        self.notes = self._map("notes", note_dtype, self.header["notes"])
+        # building the index is the only pass over the names, every lookup after that is O(1)
+        self.index = {name.decode(): i for i, name in enumerate(self.names)}
+
+    def _map(self, section, dtype, count):
+        if count == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(
+            self.path,
+            dtype=dtype,
+            mode="r",
+            offset=self.header[f"{section}_offset"],
+            shape=(count,),
+        )
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __getitem__(self, name):
+        """The note table of one segment, as a read-only view into the file"""
+        i = self.index[name]
+        return self.notes[self.offsets[i] : self.offsets[i + 1]]
+
+    def get_note_infos(self, name):
+        """The notes of one segment in the JSON schema of `operations.gen_anno`"""
+        return note_table_to_json(self[name])
+
+
+def import_json(anno_dir, path):
+    """Pack a directory of per-segment annotation JSON files into one store file
+
+    Args:
+        anno_dir (str): The directory with `{track_title}_{i}.json` files
+        path (str): The path of the store file
+    """
+
+    def segments():
+        for anno_file in sorted(glob.glob(os.path.join(anno_dir, "*.json"))):
+            name, _ = os.path.splitext(anno_file.split("/")[-1])
+            with open(anno_file) as anno:
+                yield name, json_to_note_table(json.load(anno))
+
+    write_anno_store(path, segments())
+
+
+def export_json(path, anno_dir):
+    """Unpack a store file into the per-segment annotation JSON layout of `operations.gen_anno`
+
+    Args:
+        path (str): The path of the store file
+        anno_dir (str): The directory to put the `{track_title}_{i}.json` files
+    """
+    store = AnnoStore(path)
+    for name in store:
+        with open(os.path.join(anno_dir, f"{name}.json"), "w") as outfile:
+            json.dump(store.get_note_infos(name), outfile, indent=4)
@@ -0,0 +1,188 @@
+"""Poly / mono segments of rendered single-track audio, as views instead of files
+
+`poly_detect.ipynb` cuts every rendered track into one .wav file per segment. `SegmentedAudio`
+opens the track once (a PCM or float WAV file is memory-mapped, nothing is read until a segment is
+used) and serves each segment of the `poly_vs_mono` lists as a view into it:
+
+    poly, mono = poly_vs_mono(song)
+    audio = SegmentedAudio.from_file(os.path.join(SINGLE_TRACK_AUDIO_DIR, track_title + ".wav"), poly, mono)
+    for name, y in audio.iter_segments("mono"):
+        ...  # y as from `librosa.load(segment_file, sr=None, mono=True)`
+
+The segment boundaries are those of the notebook, `y[int(start_sec * sr) : int(end_sec * sr)]`, and
+the names are the segment file names without extension, `{track_title}_{j}_{int(start_sec)}s`.
+`write_segments` still writes the per-segment files, from a single read of the track.
+"""
+import os
+import struct
+
+import numpy as np
+import soundfile
+
+MONO = 0
+POLY = 1
+KINDS = {"mono": MONO, "poly": POLY}
+
+SEGMENT_DTYPE = np.dtype(
+    [
+        ("kind", np.uint8),  # MONO or POLY
+        ("number", np.int32),  # j, the index of the segment among the segments of its kind
+        ("start", np.int64),  # the first sample
+        ("end", np.int64),  # the sample after the last one
+        ("start_sec", np.float64),
+    ]
+)
+
+# the WAV subtypes that can be memory-mapped, and the dtype of their samples
+_MMAP_SUBTYPES = {"PCM_16": np.int16, "PCM_32": np.int32, "FLOAT": np.float32}
+
+
+def _find_wav_data(path):
+    """Return the byte offset of the sample data of a WAV file, or None if it has no plain data chunk"""
+    with open(path, "rb") as infile:
+        riff = infile.read(12)
+        if len(riff) < 12 or riff[:4] != b"RIFF" or riff[8:12] != b"WAVE":
+            return None
+        while True:
+            chunk = infile.read(8)
+            if len(chunk) < 8:
+                return None
+            chunk_id, chunk_size = chunk[:4], struct.unpack("<I", chunk[4:])[0]
+            if chunk_id == b"data":
+                return infile.tell()
+            # chunks are padded to an even size
+            infile.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+
+
+def open_audio(path, mmap=True):
+    """Open an audio file without decoding all of it, if possible
+
+    Args:
+        path (str): The path to the audio file
+        mmap (bool, optional): Whether to memory-map WAV files. Defaults to True.
+
+    Returns:
+        np.ndarray, int: The samples, (frames,) or (frames, channels), in the dtype of the file
+        (a read-only memmap for WAV files), and the sampling rate
+    """
+    info = soundfile.info(path)
+    dtype = _MMAP_SUBTYPES.get(info.subtype)
+    offset = _find_wav_data(path) if mmap and info.format == "WAV" and dtype else None
+    if offset is None:
+        samples, sr = soundfile.read(path, dtype="float32", always_2d=False)
+        return samples, sr
+    shape = (info.frames, info.channels) if info.channels > 1 else (info.frames,)
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape), info.samplerate
+
+
+def to_mono_float(samples):
+    """Convert raw samples to float32 mono, as `librosa.load(..., mono=True)` does"""
+    if samples.dtype == np.int16:
+        samples = samples.astype(np.float32) / 32768
+    elif samples.dtype == np.int32:
+        samples = samples.astype(np.float32) / 2147483648
+    else:
+        samples = np.asarray(samples, dtype=np.float32)
+    if samples.ndim > 1:
+        samples = samples.mean(axis=1)
+    return samples
+
+
+def get_segment_index(poly, mono, sr, n_samples=None):
+    """Convert `poly_vs_mono` segment lists to sample ranges
+
+    Args:
+        poly (list): The [start_sec, end_sec] of the poly segments
+        mono (list): The [start_sec, end_sec] of the mono segments
+        sr (int): The sampling rate
+        n_samples (int, optional): Clip the ranges to the length of the audio. Defaults to None.
+
+    Returns:
+        np.ndarray: One row (`SEGMENT_DTYPE`) per segment, poly segments first
+    """
+    index = np.zeros(len(poly) + len(mono), dtype=SEGMENT_DTYPE)
+    bounds = np.asarray(list(poly) + list(mono), dtype=np.float64).reshape(-1, 2)
+    index["kind"][len(poly) :] = MONO
+    index["kind"][: len(poly)] = POLY
+    index["number"] = np.concatenate((np.arange(len(poly)), np.arange(len(mono))))
+    index["start_sec"] = bounds[:, 0]
+    # `int()` truncates toward zero, like the slicing in the notebook
+    index["start"] = np.trunc(bounds[:, 0] * sr)
+    index["end"] = np.trunc(bounds[:, 1] * sr)
+    if n_samples is not None:
+        np.clip(index["start"], 0, n_samples, out=index["start"])
+        np.clip(index["end"], 0, n_samples, out=index["end"])
+    return index
+
+
+class SegmentedAudio:
+    """The audio of one rendered track, with its poly / mono segments
+
+    Args:
+        samples (np.ndarray): The samples of the track, see `open_audio`
+        sr (int): The sampling rate
+        poly (list): The [start_sec, end_sec] of the poly segments, see `operations.poly_vs_mono`
+        mono (list): The [start_sec, end_sec] of the mono segments
+        title (str, optional): The track title, for the segment names. Defaults to "".
+    """
+
+    def __init__(self, samples, sr, poly, mono, title=""):
+        self.samples = samples
+        self.sr = sr
+        self.title = title
+        self.index = get_segment_index(poly, mono, sr, n_samples=len(samples))
+
+    @classmethod
+    def from_file(cls, path, poly, mono, mmap=True):
+        """Open a rendered track, the title is the file name without extension"""
+        samples, sr = open_audio(path, mmap=mmap)
+        title, _ = os.path.splitext(path.split("/")[-1])
+        return cls(samples, sr, poly, mono, title=title)
+
+    def __len__(self):
+        return len(self.index)
+
+    def name(self, i):
+        """The name of segment i, i.e., its file name in the notebook without extension"""
+        row = self.index[i]
+        return f"{self.title}_{row['number']}_{int(row['start_sec'])}s"
+
+    def view(self, i):
+        """Segment i as a zero-copy view of the raw samples"""
+        row = self.index[i]
+        return self.samples[row["start"] : row["end"]]
+
+    def __getitem__(self, i):
+        """Segment i as float32 mono samples (only this segment is read and converted)"""
+        return to_mono_float(self.view(i))
+
+    def iter_segments(self, kind=None):
+        """Yield (name, float32 mono samples) for the segments of one kind ("mono" or "poly"), or all segments"""
+        for i in self.select(kind):
+            yield self.name(i), self[i]
+
+    def select(self, kind=None):
+        """The indices of the segments of one kind ("mono" or "poly"), or of all segments"""
+        if kind is None:
+            return np.arange(len(self.index))
+        return np.flatnonzero(self.index["kind"] == KINDS[kind])
+
+    def write_segments(self, mono_dir=None, poly_dir=None):
+        """Write each segment as `{name}.wav` into the directory of its kind, like the notebook
+
+        Args:
+            mono_dir (str, optional): The directory for the mono segments. Defaults to None (not written).
+            poly_dir (str, optional): The directory for the poly segments. Defaults to None (not written).
+
+        Returns:
+            list: The paths of the written files
+        """
+        written = []
+        for kind, output_dir in (("poly", poly_dir), ("mono", mono_dir)):
+            if not output_dir:
+                continue
+            for name, y in self.iter_segments(kind):
+                path = os.path.join(output_dir, name + ".wav")
+                soundfile.write(path, y, self.sr)
+                written.append(path)
+        return written
@@ -0,0 +1,861 @@
+"""Batch entry points for running the GuitarPro processing steps over a whole corpus
+
+The per-file work is fanned out over a process pool. A GPException in one file is recorded
+in the returned summary (and optionally in a JSON-lines error log) instead of stopping the run.
+
+From Python:
+    summary = split_corpus(glob.glob(os.path.join(MULTI_TRACK_DIR, "*.gp*")), CLEAN_SINGLE_TRACK_DIR, anno_dir=ANNO_DIR)
+
+The annotations can also be packed into one store file (see `anno_store`) instead of one JSON file per segment:
+    python batch.py split MULTI_TRACK_DIR CLEAN_SINGLE_TRACK_DIR --anno-store annotations.annos -j 32
+
+With a manifest (see `manifest`), only the new and changed inputs are processed, and the outputs of removed inputs are deleted:
+    python batch.py split MULTI_TRACK_DIR CLEAN_SINGLE_TRACK_DIR --anno-dir ANNO_DIR --manifest split_manifest.json
+
+From the command line:
+    python batch.py split MULTI_TRACK_DIR CLEAN_SINGLE_TRACK_DIR --anno-dir ANNO_DIR -j 32
+    python batch.py anno CLEAN_SINGLE_TRACK_DIR ANNO_DIR -j 32
+    python batch.py f0 FILTERED_AUDIO_DIR F0_DIR -j 32
+    python batch.py render CLEAN_SINGLE_TRACK_DIR SINGLE_TRACK_AUDIO_DIR --soundfont FluidR3_GM.sf2 -j 32
+    python batch.py poly SINGLE_TRACK_AUDIO_DIR poly_detector.joblib -o segments.jsonl -j 32
+"""
+import argparse
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+
+import numpy as np
+
+from anno_store import AnnoStoreWriter
+from config import config
+from guitarpro.models import GPException
+from header_scan import ACCEPTED, NO_GUITAR, scan_guitar_tracks
+from manifest import Manifest
+from metrics import Metrics, instrumented, metrics, write_metrics
+from operations import gen_anno, get_single_tracks, process_song
+
+
+def split_file(file, output_dir, anno_dir=None, anno_store=False, prefilter=True, **options):
+    """Split one multi-track GuitarPro file, and optionally annotate the resulting one-track files
+
+    This is the per-file worker of `split_corpus`. GPExceptions are recorded in the returned dict.
+    With `anno_dir`, the file is parsed only once (see `process_song`).
+    With `prefilter`, files without guitar tracks are rejected from their header (see `header_scan`),
+    before the full parse. The outcome is recorded under "stage": one of the `header_scan` outcomes,
+    or "parse" when the full parse fails.
+
+    Args:
+        file (str): The path to the multi-track GuitarPro file
+        output_dir (str): The directory for the one-track GuitarPro files
+        anno_dir (str, optional): The directory for the annotation JSON files. Defaults to None (no annotation).
+        anno_store (bool, optional): Whether to return the annotations as (name, note table) pairs
+            under the key "segments", for `anno_store.AnnoStoreWriter`. Defaults to False.
+        prefilter (bool, optional): Whether to scan the header first. Defaults to True.
+        **options: Passed on to `get_single_tracks`
+
+    Returns:
+        dict: The file, the produced outputs and annotations, and the errors met on the way
+    """
+    record = {"file": file, "outputs": [], "annos": [], "errors": [], "stage": ACCEPTED}
+    if prefilter:
+        with metrics.timer("scan"):
+            record["stage"], _ = scan_guitar_tracks(file)
+        if record["stage"] != ACCEPTED:
+            if record["stage"] != NO_GUITAR:
+                record["errors"].append({"stage": "scan", "file": file, "error": record["stage"]})
+            return record
+    try:
+        if anno_dir or anno_store:
+            tracks = process_song(
+                file,
+                output_dir=output_dir,
+                anno_dir=anno_dir,
+                note_table=anno_store,
+                **options,
+            )
+            written = [track["file"] for track in tracks if track["file"]]
+            failed = [track["name"] for track in tracks if track["error"]]
+            for track in tracks:
+                record["annos"].extend(track["anno_files"])
+            if anno_store:
+                record["segments"] = [
+                    (f"{track['name']}_{i}", track["notes"][start:end])
+                    for track in tracks
+                    if not track["error"]
+                    for i, (start, end) in enumerate(
+                        zip(track["offsets"][:-1], track["offsets"][1:])
+                    )
+                ]
+        else:
+            written, failed = get_single_tracks(file, output_dir, verbose=False, **options)
+    except GPException as e:
+        record["errors"].append({"stage": "split", "file": file, "error": str(e)})
+        record["stage"] = "parse"
+        return record
+    record["outputs"] = written
+    for file_name in failed:
+        record["errors"].append(
+            {"stage": "write", "file": file_name, "error": "GPException"}
+        )
+    return record
+
+
+def annotate_file(file, anno_dir, record=None):
+    """Generate the annotations for one single-track GuitarPro file, recording GPExceptions
+
+    Args:
+        file (str): The path to the single-track GuitarPro file
+        anno_dir (str): The directory for the annotation JSON files
+        record (dict, optional): The record to add errors to. Defaults to None (a new record is returned).
+
+    Returns:
+        list or dict: The annotation files if `record` is given, otherwise a new record for this file
+    """
+    own_record = record is None
+    if own_record:
+        record = {"file": file, "outputs": [], "annos": [], "errors": []}
+    try:
+        annos = gen_anno(file, anno_dir)
+    except GPException as e:
+        record["errors"].append({"stage": "anno", "file": file, "error": str(e)})
+        annos = []
+    if own_record:
+        record["annos"] = annos
+        return record
+    return annos
+
+
+def extract_f0_file(file, f0_dir, use_cache=True):
+    """Extract the F0 of one audio file (see `f0_analysis_utils.load_audio_file`) into `f0_dir`
+
+    The result is saved as `{audio name}.npz` with the arrays "times" and "notes". It is written to a
+    temporary file first, so an interrupted run never leaves a half-written output behind.
+
+    Args:
+        file (str): The path to the audio file
+        f0_dir (str): The directory for the F0 files
+        use_cache (bool, optional): Whether to go through the pYIN cache. Defaults to True.
+
+    Returns:
+        dict: The file, the produced output, the extraction time in seconds, and the errors met on the way
+    """
+    # librosa is slow to import, and only needed by this worker
+    from f0_analysis_utils import load_audio_file
+
+    record = {"file": file, "outputs": [], "annos": [], "errors": []}
+    start_time = time.perf_counter()
+    try:
+        # an absolute path overrides FILTERED_AUDIO_DIR in `load_audio_file`
+        times, notes = load_audio_file(os.path.abspath(file), use_cache=use_cache)
+    except Exception as e:
+        record["errors"].append({"stage": "f0", "file": file, "error": f"{type(e).__name__}: {e}"})
+        return record
+    output = get_f0_file(file, f0_dir)
+    tmp_output = f"{output}.{os.getpid()}.tmp"
+    with open(tmp_output, "wb") as outfile:
+        np.savez(outfile, times=times, notes=notes)
+    os.replace(tmp_output, output)
+    record["outputs"].append(output)
+    record["seconds"] = round(time.perf_counter() - start_time, 3)
+    return record
+
+
+def get_f0_file(file, f0_dir):
+    """The path of the F0 file of an audio file"""
+    name, _ = os.path.splitext(file.split("/")[-1])
+    return os.path.join(f0_dir, name + ".npz")
+
+
+def render_file(file, wav_dir, soundfont, midi_dir=None, sr=44100, fluidsynth="fluidsynth"):
+    """Render one one-track GuitarPro file to `{wav_dir}/{track title}.wav`, see `render`
+
+    The WAV file is written to a temporary file first, so an interrupted run never leaves a half-written output behind.
+
+    Args:
+        file (str): The path to the one-track GuitarPro file
+        wav_dir (str): The directory for the WAV files
+        soundfont (str): The path to the SoundFont
+        midi_dir (str, optional): Keep the MIDI files here. Defaults to None (deleted after rendering).
+        sr (int, optional): The sampling rate. Defaults to 44100.
+        fluidsynth (str, optional): The FluidSynth executable. Defaults to "fluidsynth".
+
+    Returns:
+        dict: The file, the produced output, the rendering time in seconds, and the errors met on the way
+    """
+    from render import render_midi, write_track_midi
+
+    record = {"file": file, "outputs": [], "annos": [], "errors": []}
+    start_time = time.perf_counter()
+    output = get_render_file(file, wav_dir)
+    title, _ = os.path.splitext(output.split("/")[-1])
+    midi_path = os.path.join(midi_dir or wav_dir, f"{title}.{os.getpid()}.mid")
+    tmp_output = f"{output}.{os.getpid()}.tmp"
+    try:
+        record["notes"] = write_track_midi(file, midi_path)
+        render_midi(midi_path, tmp_output, soundfont, sr=sr, fluidsynth=fluidsynth)
+        os.replace(tmp_output, output)
+    except GPException as e:
+        record["errors"].append({"stage": "parse", "file": file, "error": str(e)})
+    except RuntimeError as e:
+        record["errors"].append({"stage": "render", "file": file, "error": str(e)})
+    finally:
+        if os.path.exists(tmp_output):
+            os.remove(tmp_output)
+        if os.path.exists(midi_path):
+            if midi_dir:
+                os.replace(midi_path, os.path.join(midi_dir, title + ".mid"))
+            else:
+                os.remove(midi_path)
+    if record["errors"]:
+        return record
+    record["outputs"].append(output)
+    record["seconds"] = round(time.perf_counter() - start_time, 3)
+    return record
+
+
+def get_render_file(file, wav_dir):
+    """The path of the rendered audio of a one-track GuitarPro file"""
+    name, _ = os.path.splitext(file.split("/")[-1])
+    return os.path.join(wav_dir, name + ".wav")
+
+
+def run_batch(
+    files,
+    worker,
+    workers=None,
+    error_log=None,
+    progress_every=100,
+    timing_log=None,
+    on_record=None,
+    metrics_log=None,
+    profile_dir=None,
+    profile_min_seconds=0.0,
+):
+    """Run `worker` on every file over a process pool and summarize the results
+
+    The files are submitted in the given order.
+
+    Args:
+        files (list): The input files
+        worker (callable): A picklable function taking one file and returning a record dict
+        workers (int, optional): The number of worker processes. Defaults to None (one per core).
+        error_log (str, optional): Append one JSON line per error to this file. Defaults to None.
+        progress_every (int, optional): Print the progress every `progress_every` files. Defaults to 100.
+        timing_log (str, optional): Append one JSON line per finished file with its "seconds",
+            as soon as it finishes. Defaults to None.
+        on_record (callable, optional): Called with the record of each file as soon as it finishes, before it is
+            summarized, so it can add errors to it. Defaults to None.
+        metrics_log (str, optional): Write the step timers and counters (see `metrics`) of the run and of each
+            worker process to this file, in the Prometheus text format if it ends with ".prom",
+            as JSON lines otherwise. Defaults to None.
+        profile_dir (str, optional): Profile every file with cProfile, and keep the profiles of the files that
+            took at least `profile_min_seconds` in this directory. Defaults to None (no profiling).
+        profile_min_seconds (float, optional): See `profile_dir`. Defaults to 0.0.
+
+    Returns:
+        dict: The summary of the run, with counts, timing, files/sec and all errors,
+        the number of files per "stage" for workers that record one, the summed step timers
+        and counters under "metrics", and the slowest files under "slowest"
+    """
+    start_time = time.perf_counter()
+    summary = {"files": len(files), "outputs": 0, "annos": 0, "errors": []}
+    timing = open(timing_log, "a") if timing_log else None
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+    worker = partial(
+        instrumented, worker, profile_dir=profile_dir, profile_min_seconds=profile_min_seconds
+    )
+    total_metrics = Metrics()
+    worker_metrics = {}
+    file_seconds = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(worker, file): file for file in files}
+        for done, future in enumerate(as_completed(futures), start=1):
+            try:
+                record = future.result()
+            except Exception as e:
+                # anything other than a GPException is unexpected, but one broken file should not stop the run
+                record = {
+                    "file": futures[future],
+                    "outputs": [],
+                    "annos": [],
+                    "errors": [
+                        {
+                            "stage": "worker",
+                            "file": futures[future],
+                            "error": f"{type(e).__name__}: {e}",
+                        }
+                    ],
+                }
+            if on_record:
+                on_record(record)
+            summary["outputs"] += len(record["outputs"])
+            summary["annos"] += len(record["annos"])
+            summary["errors"].extend(record["errors"])
+            if "stage" in record:
+                stages = summary.setdefault("stages", {})
+                stages[record["stage"]] = stages.get(record["stage"], 0) + 1
+            if "metrics" in record:
+                total_metrics.merge(record["metrics"])
+                worker_metrics.setdefault(record["pid"], Metrics()).merge(record["metrics"])
+                file_seconds.append((record["seconds"], record["file"]))
+            if timing and "seconds" in record:
+                timing.write(json.dumps({"file": record["file"], "seconds": record["seconds"]}) + "\n")
+                timing.flush()
+            if progress_every and done % progress_every == 0:
+                elapsed = time.perf_counter() - start_time
+                print(f"{done} / {len(files)} files, {done / elapsed:.1f} files/sec")
+    if timing:
+        timing.close()
+    summary["seconds"] = round(time.perf_counter() - start_time, 3)
+    summary["files_per_sec"] = (
+        round(len(files) / summary["seconds"], 3) if summary["seconds"] else 0.0
+    )
+    summary["metrics"] = total_metrics.snapshot()
+    # the outliers, to look into (or to profile with `profile_dir`)
+    summary["slowest"] = [
+        {"file": file, "seconds": seconds} for seconds, file in sorted(file_seconds, reverse=True)[:10]
+    ]
+    if metrics_log:
+        snapshots = {"total": summary["metrics"]}
+        snapshots.update((pid, worker.snapshot()) for pid, worker in sorted(worker_metrics.items()))
+        write_metrics(metrics_log, snapshots)
+    if error_log and summary["errors"]:
+        with open(error_log, "a") as log:
+            for error in summary["errors"]:
+                log.write(json.dumps(error) + "\n")
+    return summary
+
+
+def run_incremental(files, worker, manifest_path, options, save_every=100, **kwargs):
+    """Run `worker` (see `run_batch`) only on the new and changed files, as recorded in a manifest
+
+    The outputs of removed and changed files are deleted first. The manifest is saved every
+    `save_every` files, so an interrupted run can be resumed.
+
+    Args:
+        files (list): The input files
+        worker (callable): A picklable function taking one file and returning a record dict
+        manifest_path (str): The path of the manifest file
+        options (dict): The options of the run, every file is processed again when they change
+        save_every (int, optional): Save the manifest every `save_every` files. Defaults to 100.
+        **kwargs: Passed on to `run_batch`
+
+    Returns:
+        dict: The summary of the run, see `run_batch`, plus the numbers of skipped and removed files
+    """
+    manifest = Manifest(manifest_path, options)
+    todo, removed = manifest.plan(files)
+    for file in removed + todo:
+        manifest.remove_outputs(file)
+
+    done = []
+
+    def on_record(record):
+        # unexpected worker failures are not recorded, so that they are tried again next time
+        if not any(error["stage"] == "worker" for error in record["errors"]):
+            manifest.update(record)
+        done.append(record["file"])
+        if len(done) % save_every == 0:
+            manifest.save()
+
+    summary = run_batch(todo, worker, on_record=on_record, **kwargs)
+    manifest.save()
+    summary["skipped"] = len(files) - len(todo)
+    summary["removed"] = len(removed)
+    return summary
+
+
+def split_corpus(
+    files,
+    output_dir,
+    anno_dir=None,
+    anno_store=None,
+    workers=None,
+    error_log=None,
+    manifest=None,
+    metrics_log=None,
+    profile_dir=None,
+    profile_min_seconds=0.0,
+    **options,
+):
+    """Split (and optionally annotate) many multi-track GuitarPro files in parallel
+
+    Args:
+        files (list): The paths to the multi-track GuitarPro files
+        output_dir (str): The directory for the one-track GuitarPro files
+        anno_dir (str, optional): The directory for the annotation JSON files. Defaults to None (no annotation).
+        anno_store (str, optional): Write all annotations into this store file, as the files finish.
+            Defaults to None.
+        workers (int, optional): The number of worker processes. Defaults to None (one per core).
+        error_log (str, optional): Append one JSON line per error to this file. Defaults to None.
+        manifest (str, optional): Only process new and changed files, as recorded in this manifest file,
+            see `run_incremental`. Can not be used with `anno_store`. Defaults to None.
+        metrics_log (str, optional): Write the step timers and counters here, see `run_batch`. Defaults to None.
+        profile_dir (str, optional): Keep cProfile profiles of the slow files here, see `run_batch`. Defaults to None.
+        profile_min_seconds (float, optional): See `run_batch`. Defaults to 0.0.
+        **options: Passed on to `split_file` (`prefilter`) and `get_single_tracks`
+
+    Returns:
+        dict: The summary of the run, see `run_batch`
+    """
+    if manifest:
+        if anno_store:
+            # the store is written from the segments of one run, the skipped files would be missing
+            raise ValueError("an annotation store can not be built incrementally, use anno_dir")
+        output_dir = os.path.abspath(output_dir)
+        anno_dir = os.path.abspath(anno_dir) if anno_dir else None
+    os.makedirs(output_dir, exist_ok=True)
+    if anno_dir:
+        os.makedirs(anno_dir, exist_ok=True)
+    worker = partial(
+        split_file,
+        output_dir=output_dir,
+        anno_dir=anno_dir,
+        anno_store=bool(anno_store),
+        **options,
+    )
+    batch_options = dict(
+        workers=workers,
+        error_log=error_log,
+        metrics_log=metrics_log,
+        profile_dir=profile_dir,
+        profile_min_seconds=profile_min_seconds,
+    )
+    if manifest:
+        run_options = dict(step="split", output_dir=output_dir, anno_dir=anno_dir, **options)
+        return run_incremental(files, worker, manifest, run_options, **batch_options)
+    if not anno_store:
+        return run_batch(files, worker, **batch_options)
+    with AnnoStoreWriter(anno_store) as writer:
+
+        def on_record(record):
+            # the note tables of a file go to disk as soon as it is done, the parent does not keep them
+            for name, table in record.pop("segments", []):
+                if name in writer.seen:
+                    record["errors"].append({"stage": "store", "file": record["file"], "error": f"duplicate segment {name}"})
+                else:
+                    writer.add(name, table)
+
+        summary = run_batch(files, worker, on_record=on_record, **batch_options)
+    summary["annos"] += len(writer.names)
+    return summary
+
+
+def annotate_corpus(
+    files,
+    anno_dir,
+    workers=None,
+    error_log=None,
+    manifest=None,
+    metrics_log=None,
+    profile_dir=None,
+    profile_min_seconds=0.0,
+):
+    """Generate the annotations for many single-track GuitarPro files in parallel
+
+    Args:
+        files (list): The paths to the single-track GuitarPro files
+        anno_dir (str): The directory for the annotation JSON files
+        workers (int, optional): The number of worker processes. Defaults to None (one per core).
+        error_log (str, optional): Append one JSON line per error to this file. Defaults to None.
+        manifest (str, optional): Only process new and changed files, as recorded in this manifest file,
+            see `run_incremental`. Defaults to None.
+        metrics_log (str, optional): Write the step timers and counters here, see `run_batch`. Defaults to None.
+        profile_dir (str, optional): Keep cProfile profiles of the slow files here, see `run_batch`. Defaults to None.
+        profile_min_seconds (float, optional): See `run_batch`. Defaults to 0.0.
+
+    Returns:
+        dict: The summary of the run, see `run_batch`
+    """
+    if manifest:
+        anno_dir = os.path.abspath(anno_dir)
+    os.makedirs(anno_dir, exist_ok=True)
+    worker = partial(annotate_file, anno_dir=anno_dir)
+    batch_options = dict(
+        workers=workers,
+        error_log=error_log,
+        metrics_log=metrics_log,
+        profile_dir=profile_dir,
+        profile_min_seconds=profile_min_seconds,
+    )
+    if manifest:
+        return run_incremental(
+            files, worker, manifest, {"step": "anno", "anno_dir": anno_dir}, **batch_options
+        )
+    return run_batch(files, worker, **batch_options)
+
+
+def extract_f0_corpus(
+    files,
+    f0_dir,
+    workers=None,
+    error_log=None,
+    use_cache=True,
+    redo=False,
+    metrics_log=None,
+    profile_dir=None,
+    profile_min_seconds=0.0,
+):
+    """Extract the F0 of many audio files in parallel
+
+    The largest files are scheduled first, so that a long file started last does not keep
+    the whole pool waiting. Files that already have an F0 file in `f0_dir` are skipped, so an
+    interrupted run can be resumed by running it again. The per-file timing is appended to
+    `f0_dir/timing.jsonl`.
+
+    Args:
+        files (list): The paths to the audio files, e.g., the .wav files in FILTERED_AUDIO_DIR
+        f0_dir (str): The directory for the F0 files
+        workers (int, optional): The number of worker processes. Defaults to None (one per core).
+        error_log (str, optional): Append one JSON line per error to this file. Defaults to None.
+        use_cache (bool, optional): Whether to go through the pYIN cache. Defaults to True.
+        redo (bool, optional): Extract the files that are already done again. Defaults to False.
+        metrics_log (str, optional): Write the step timers and counters here, see `run_batch`. Defaults to None.
+        profile_dir (str, optional): Keep cProfile profiles of the slow files here, see `run_batch`. Defaults to None.
+        profile_min_seconds (float, optional): See `run_batch`. Defaults to 0.0.
+
+    Returns:
+        dict: The summary of the run, see `run_batch`, plus the number of skipped files
+    """
+    os.makedirs(f0_dir, exist_ok=True)
+    todo = [file for file in files if redo or not os.path.exists(get_f0_file(file, f0_dir))]
+    todo.sort(key=os.path.getsize, reverse=True)
+    worker = partial(extract_f0_file, f0_dir=f0_dir, use_cache=use_cache)
+    summary = run_batch(
+        todo,
+        worker,
+        workers=workers,
+        error_log=error_log,
+        timing_log=os.path.join(f0_dir, "timing.jsonl"),
+        metrics_log=metrics_log,
+        profile_dir=profile_dir,
+        profile_min_seconds=profile_min_seconds,
+    )
+    summary["skipped"] = len(files) - len(todo)
+    return summary
+
+
+def render_corpus(
+    files,
+    wav_dir,
+    soundfont=None,
+    midi_dir=None,
+    workers=None,
+    error_log=None,
+    redo=False,
+    sr=44100,
+    fluidsynth=None,
+    metrics_log=None,
+    profile_dir=None,
+    profile_min_seconds=0.0,
+):
+    """Render many one-track GuitarPro files to audio in parallel, without the Guitar Pro GUI
+
+    Like `extract_f0_corpus`, the largest files are scheduled first, the files that already have
+    a WAV file in `wav_dir` are skipped, and the per-file timing is appended to `wav_dir/timing.jsonl`.
+
+    Args:
+        files (list): The paths to the one-track GuitarPro files, e.g., the .gp5 files in CLEAN_SINGLE_TRACK_DIR
+        wav_dir (str): The directory for the WAV files
+        soundfont (str, optional): The path to the SoundFont. Defaults to None (`config.soundfont`).
+        midi_dir (str, optional): Keep the MIDI files here. Defaults to None (not kept).
+        workers (int, optional): The number of worker processes. Defaults to None (one per core).
+        error_log (str, optional): Append one JSON line per error to this file. Defaults to None.
+        redo (bool, optional): Render the files that are already done again. Defaults to False.
+        sr (int, optional): The sampling rate. Defaults to 44100.
+        fluidsynth (str, optional): The FluidSynth executable. Defaults to None (`config.fluidsynth`).
+        metrics_log (str, optional): Write the step timers and counters here, see `run_batch`. Defaults to None.
+        profile_dir (str, optional): Keep cProfile profiles of the slow files here, see `run_batch`. Defaults to None.
+        profile_min_seconds (float, optional): See `run_batch`. Defaults to 0.0.
+
+    Returns:
+        dict: The summary of the run, see `run_batch`, plus the number of skipped files
+    """
+    soundfont = soundfont or config.soundfont
+    if not soundfont or not os.path.isfile(soundfont):
+        raise ValueError(f"no SoundFont at {soundfont!r}, pass one or set GP_SOUNDFONT")
+    os.makedirs(wav_dir, exist_ok=True)
+    if midi_dir:
+        os.makedirs(midi_dir, exist_ok=True)
+    todo = [file for file in files if redo or not os.path.exists(get_render_file(file, wav_dir))]
+    todo.sort(key=os.path.getsize, reverse=True)
+    worker = partial(
+        render_file,
+        wav_dir=wav_dir,
+        soundfont=os.path.abspath(soundfont),
+        midi_dir=midi_dir,
+        sr=sr,
+        fluidsynth=fluidsynth or config.fluidsynth,
+    )
+    summary = run_batch(
+        todo,
+        worker,
+        workers=workers,
+        error_log=error_log,
+        timing_log=os.path.join(wav_dir, "timing.jsonl"),
+        metrics_log=metrics_log,
+        profile_dir=profile_dir,
+        profile_min_seconds=profile_min_seconds,
+    )
+    summary["skipped"] = len(files) - len(todo)
+    return summary
+
+
+# the poly / mono detectors loaded by this (worker) process, by path
+_detectors = {}
+
+
+def detect_poly_file(file, model_path, smooth_frames=None):
+    """Detect the poly / mono segments of one audio file, see `poly_detector.detect_file`
+
+    The detector is loaded once per worker process. Any error (e.g., an unreadable or empty file) is recorded.
+
+    Args:
+        file (str): The path to the audio file
+        model_path (str): The saved frame classifier
+        smooth_frames (int, optional): See `poly_detector.smooth_labels`. Defaults to None (`poly_detector.SMOOTH_FRAMES`).
+
+    Returns:
+        dict: The file, the errors met on the way, and the result of `poly_detector.detect_file` under "detection"
+    """
+    from poly_detector import SMOOTH_FRAMES, detect_file, load_detector
+
+    record = {"file": file, "outputs": [], "annos": [], "errors": []}
+    try:
+        if model_path not in _detectors:
+            _detectors[model_path] = load_detector(model_path)
+        record["detection"] = detect_file(
+            file, _detectors[model_path], smooth_frames=SMOOTH_FRAMES if smooth_frames is None else smooth_frames
+        )
+    except Exception as e:
+        record["errors"].append({"stage": "detect", "file": file, "error": f"{type(e).__name__}: {e}"})
+    return record
+
+
+def read_detections(output):
+    """The detections written so far to a `detect_poly_corpus` output, skipping a line cut off by a crash"""
+    detections = []
+    if not os.path.exists(output):
+        return detections
+    with open(output) as infile:
+        for line in infile:
+            try:
+                detections.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return detections
+
+
+def detect_poly_corpus(
+    files,
+    model_path,
+    output,
+    workers=None,
+    error_log=None,
+    redo=False,
+    smooth_frames=None,
+    metrics_log=None,
+    profile_dir=None,
+    profile_min_seconds=0.0,
+):
+    """Detect the poly / mono segments of many audio files in parallel, see `poly_detector`
+
+    The segments of each file are appended to `output` (one JSON line per file) as soon as it is done.
+    Like `extract_f0_corpus`, the largest files are scheduled first, and the files already in
+    `output` are skipped, so an interrupted run can be resumed by running it again. The per-file timing
+    is appended to `{output without extension}.timing.jsonl`.
+
+    Args:
+        files (list): The paths to the audio files
+        model_path (str): The saved frame classifier, see `poly_detector.train_detector`
+        output (str): The JSON-lines file of the detections
+        workers (int, optional): The number of worker processes. Defaults to None (one per core).
+        error_log (str, optional): Append one JSON line per error to this file. Defaults to None.
+        redo (bool, optional): Start `output` over. Defaults to False.
+        smooth_frames (int, optional): See `poly_detector.smooth_labels`. Defaults to None (`poly_detector.SMOOTH_FRAMES`).
+        metrics_log (str, optional): Write the step timers and counters here, see `run_batch`. Defaults to None.
+        profile_dir (str, optional): Keep cProfile profiles of the slow files here, see `run_batch`. Defaults to None.
+        profile_min_seconds (float, optional): See `run_batch`. Defaults to 0.0.
+
+    Returns:
+        dict: The summary of the run, see `run_batch`, plus the number of skipped files
+    """
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    done = set() if redo else {detection["file"] for detection in read_detections(output)}
+    todo = [file for file in files if file not in done]
+    todo.sort(key=os.path.getsize, reverse=True)
+    worker = partial(detect_poly_file, model_path=os.path.abspath(model_path), smooth_frames=smooth_frames)
+    if not redo and os.path.exists(output) and os.path.getsize(output):
+        # end a line cut off by a crash
+        with open(output, "rb+") as outfile:
+            outfile.seek(-1, os.SEEK_END)
+            if outfile.read(1) != b"\n":
+                outfile.write(b"\n")
+    with open(output, "w" if redo else "a") as outfile:
+
+        def on_record(record):
+            if "detection" in record:
+                outfile.write(json.dumps(record["detection"]) + "\n")
+                outfile.flush()
+
+        summary = run_batch(
+            todo,
+            worker,
+            workers=workers,
+            error_log=error_log,
+            timing_log=os.path.splitext(output)[0] + ".timing.jsonl",
+            on_record=on_record,
+            metrics_log=metrics_log,
+            profile_dir=profile_dir,
+            profile_min_seconds=profile_min_seconds,
+        )
+    summary["skipped"] = len(files) - len(todo)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    split_parser = subparsers.add_parser("split", help="split multi-track files into one-track files")
+    split_parser.add_argument("input_dir")
+    split_parser.add_argument("output_dir")
+    split_parser.add_argument("--anno-dir", default=None, help="also annotate the one-track files")
+    split_parser.add_argument("--anno-store", default=None, help="also annotate, into one store file")
+    split_parser.add_argument("--pattern", default="*.gp*")
+    split_parser.add_argument("--keep-volume", action="store_true", help="do not unify the volume")
+    split_parser.add_argument("--keep-tone", action="store_true", help="do not force the clean tone")
+    split_parser.add_argument("--keep-repeats", action="store_true")
+    split_parser.add_argument("--keep-mix-table", action="store_true")
+    split_parser.add_argument(
+        "--strip-tempo", action="store_true", help="also remove the tempo changes of the mix table changes"
+    )
+    split_parser.add_argument(
+        "--no-prefilter", action="store_true", help="do not reject files without guitar tracks from their header"
+    )
+
+    anno_parser = subparsers.add_parser("anno", help="annotate one-track files")
+    anno_parser.add_argument("input_dir")
+    anno_parser.add_argument("anno_dir")
+    anno_parser.add_argument("--pattern", default="*.gp5")
+
+    f0_parser = subparsers.add_parser("f0", help="extract the F0 of audio files")
+    f0_parser.add_argument("input_dir")
+    f0_parser.add_argument("f0_dir")
+    f0_parser.add_argument("--pattern", default="*.wav")
+    f0_parser.add_argument("--no-cache", action="store_true", help="bypass the pYIN cache")
+    f0_parser.add_argument("--redo", action="store_true", help="do not skip the files that are already done")
+
+    render_parser = subparsers.add_parser("render", help="render one-track files to audio with FluidSynth")
+    render_parser.add_argument("input_dir")
+    render_parser.add_argument("wav_dir")
+    render_parser.add_argument("--pattern", default="*.gp5")
+    render_parser.add_argument("--soundfont", default=None, help="the SoundFont (default: GP_SOUNDFONT)")
+    render_parser.add_argument("--midi-dir", default=None, help="keep the MIDI files here")
+    render_parser.add_argument("--sr", type=int, default=44100)
+    render_parser.add_argument("--redo", action="store_true", help="do not skip the files that are already done")
+
+    poly_parser = subparsers.add_parser("poly", help="detect the poly / mono segments of audio files")
+    poly_parser.add_argument("input_dir")
+    poly_parser.add_argument("model_file", help="a frame classifier, see poly_detector.py train")
+    poly_parser.add_argument("-o", "--output", default="segments.jsonl")
+    poly_parser.add_argument("--pattern", default="*.wav")
+    poly_parser.add_argument("--smooth-frames", type=int, default=None)
+    poly_parser.add_argument("--redo", action="store_true", help="start the output over")
+
+    for sub in (split_parser, anno_parser, f0_parser, render_parser, poly_parser):
+        sub.add_argument("-j", "--workers", type=int, default=None)
+        sub.add_argument("--error-log", default=None, help="JSON-lines file for per-file errors")
+        sub.add_argument(
+            "--metrics", default=None, help="write the step timers here (Prometheus text if it ends with .prom, else JSON lines)"
+        )
+        sub.add_argument("--profile-dir", default=None, help="profile every file, and keep the profiles of slow files here")
+        sub.add_argument(
+            "--profile-min-seconds", type=float, default=10.0, help="keep the profiles of the files slower than this"
+        )
+    for sub in (split_parser, anno_parser):
+        sub.add_argument("--manifest", default=None, help="only process new and changed files, as recorded in this file")
+
+    args = parser.parse_args(argv)
+    files = sorted(glob.glob(os.path.join(args.input_dir, args.pattern)))
+    batch_options = dict(
+        workers=args.workers,
+        error_log=args.error_log,
+        metrics_log=args.metrics,
+        profile_dir=args.profile_dir,
+        profile_min_seconds=args.profile_min_seconds,
+    )
+    if args.command == "split":
+        summary = split_corpus(
+            files,
+            args.output_dir,
+            anno_dir=args.anno_dir,
+            anno_store=args.anno_store,
+            manifest=args.manifest,
+            prefilter=not args.no_prefilter,
+            unify_volume=not args.keep_volume,
+            force_clean=not args.keep_tone,
+            disable_repeats=not args.keep_repeats,
+            disable_mixTableChange=not args.keep_mix_table,
+            keep_tempo=not args.strip_tempo,
+            **batch_options,
+        )
+    elif args.command == "anno":
+        summary = annotate_corpus(
+            files,
+            args.anno_dir,
+            manifest=args.manifest,
+            **batch_options,
+        )
+    elif args.command == "render":
+        summary = render_corpus(
+            files,
+            args.wav_dir,
+            soundfont=args.soundfont,
+            midi_dir=args.midi_dir,
+            redo=args.redo,
+            sr=args.sr,
+            **batch_options,
+        )
+    elif args.command == "poly":
+        summary = detect_poly_corpus(
+            files,
+            args.model_file,
+            args.output,
+            redo=args.redo,
+            smooth_frames=args.smooth_frames,
+            **batch_options,
+        )
+    else:
+        summary = extract_f0_corpus(
+            files,
+            args.f0_dir,
+            use_cache=not args.no_cache,
+            redo=args.redo,
+            **batch_options,
+        )
+    if "skipped" in summary:
+        print(f"{summary['skipped']} files already done")
+    if "removed" in summary:
+        print(f"{summary['removed']} removed files cleaned up")
+    if "stages" in summary:
+        print(", ".join(f"{count} {stage}" for stage, count in sorted(summary["stages"].items())))
+    timers = summary["metrics"]["timers"]
+    if timers:
+        # the steps that dominate first, the whole-file timer is the reference
+        steps = sorted(timers.items(), key=lambda item: item[1]["seconds"], reverse=True)
+        print(", ".join(f"{name} {timer['seconds']:.1f}s" for name, timer in steps))
+    print(
+        f"{summary['files']} files in {summary['seconds']}s ({summary['files_per_sec']} files/sec), "
+        f"{summary['outputs']} tracks, {summary['annos']} annotations, {len(summary['errors'])} errors"
+    )
+    return summary
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,488 @@
+"""Throughput benchmarks of the annotation and F0 pipelines, on synthetic inputs
+
+The inputs are generated first, so the benchmark runs offline and needs no corpus:
+multi-track GuitarPro songs (pyguitarpro, with configurable measure / beat / note counts and tempo
+changes), and audio files (sine tones following a sweep, vibrato or bend pitch curve).
+Each stage then runs in a fresh process, so that its peak RSS is its own (the untimed setup of a stage,
+e.g. training the poly_detect model, is excluded on Linux, where the peak can be reset):
+
+    split         `get_single_tracks` on the songs                      files/s, notes/s
+    poly_vs_mono  `poly_vs_mono` on the parsed one-track files          files/s, notes/s
+    anno          `gen_anno` on the one-track files                     files/s, notes/s
+    pyin          `load_audio_file` (uncached) on the audio files       files/s, frames/s
+    candidates    F0 segmentation + `detect_candidates` on F0 curves    files/s, frames/s
+    poly_detect   `poly_detector.detect_file` on the audio files        files/s, frames/s
+
+The results are written as JSON, with the commit and the settings, to compare runs across versions:
+
+    python benchmark.py --songs 20 --measures 64 --tempo-changes -o bench.json
+    python benchmark.py --stages split anno --repeat 3
+"""
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+STAGES = ["split", "poly_vs_mono", "anno", "pyin", "candidates", "poly_detect"]
+CURVES = ["sweep", "vibrato", "bend"]
+
+# the range of the synthetic pitch curves, within the pYIN range of `load_audio_file` (C2 - G6)
+LOWEST_PITCH = 40
+HIGHEST_PITCH = 84
+
+
+def make_song(
+    path, n_tracks=3, n_measures=32, beats_per_measure=8, max_notes=3, tempo_changes=False, tempo_track=None, seed=0
+):
+    """Write a random multi-track GuitarPro file
+
+    Every track is a 6-string guitar track (so `get_guitar_tracks` keeps it) in 4/4. Each beat is a rest,
+    or has 1 to `max_notes` notes on distinct strings, some with effects (vibrato, hammer, palm mute,
+    bend, slide) or tied.
+
+    Args:
+        path (str): The path of the file to write, the extension gives the GuitarPro version
+        n_tracks (int, optional): The number of tracks. Defaults to 3.
+        n_measures (int, optional): The number of measures. Defaults to 32.
+        beats_per_measure (int, optional): The number of beats in each measure, a power of 2 up to 32. Defaults to 8.
+        max_notes (int, optional): The largest number of notes in a beat, up to 6. Defaults to 3.
+        tempo_changes (bool, optional): Whether to change the tempo every 4 measures. Defaults to False.
+        tempo_track (int, optional): Store the tempo changes on this track only, as Guitar Pro often does.
+            Defaults to None (each track has its own, random, tempo changes).
+        seed (int, optional): The random seed. Defaults to 0.
+
+    Returns:
+        int: The number of notes in the song
+    """
+    import guitarpro
+
+    if beats_per_measure not in (1, 2, 4, 8, 16, 32):
+        raise ValueError(f"beats_per_measure must be a power of 2 up to 32, got {beats_per_measure}")
+    rnd = random.Random(seed)
+    song = guitarpro.Song(tracks=[], measureHeaders=[])
+    song.tempo = 100
+    for i in range(n_measures):
+        song.measureHeaders.append(guitarpro.MeasureHeader(number=i + 1, start=960 + i * 3840))
+    n_notes = 0
+    for t in range(n_tracks):
+        track = guitarpro.Track(song, number=t + 1, name=f"Guitar {t + 1}", measures=[])
+        # channel 9 is percussion
+        channel = t if t < 9 else t + 1
+        track.channel = guitarpro.MidiChannel(channel=channel, effectChannel=channel, instrument=29)
+        for header in song.measureHeaders:
+            measure = guitarpro.Measure(track, header)
+            track.measures.append(measure)
+            voice = measure.voices[0]
+            for b in range(beats_per_measure):
+                beat = guitarpro.Beat(
+                    voice, duration=guitarpro.Duration(value=beats_per_measure), status=guitarpro.BeatStatus.normal
+                )
+                count = 0 if rnd.random() < 0.15 else rnd.randint(1, max_notes)
+                if count == 0:
+                    beat.status = guitarpro.BeatStatus.rest
+                for string in rnd.sample(range(1, 7), count):
+                    effect = guitarpro.NoteEffect(
+                        vibrato=rnd.random() < 0.2, hammer=rnd.random() < 0.1, palmMute=rnd.random() < 0.1
+                    )
+                    if rnd.random() < 0.1:
+                        effect.bend = guitarpro.BendEffect(
+                            type=guitarpro.BendType.bend,
+                            value=50,
+                            points=[guitarpro.BendPoint(0, 0), guitarpro.BendPoint(6, 2), guitarpro.BendPoint(12, 2)],
+                        )
+                    if rnd.random() < 0.1:
+                        effect.slides = [guitarpro.SlideType.legatoSlideTo]
+                    tied = count == 1 and rnd.random() < 0.15
+                    note_type = guitarpro.NoteType.tie if tied else guitarpro.NoteType.normal
+                    beat.notes.append(
+                        guitarpro.Note(beat, value=rnd.randint(0, 15), string=string, effect=effect, type=note_type)
+                    )
+                n_notes += count
+                if tempo_changes and b == 0 and header.number % 4 == 0 and tempo_track in (None, t):
+                    beat.effect.mixTableChange = guitarpro.MixTableChange(
+                        tempo=guitarpro.MixTableItem(value=rnd.choice([80, 100, 140]), duration=0, allTracks=True)
+                    )
+                voice.beats.append(beat)
+        song.tracks.append(track)
+    guitarpro.write(song, path)
+    return n_notes
+
+
+def make_pitch_curve(kind, seconds, rate, seed=0):
+    """A synthetic pitch curve, in MIDI note numbers, NaN where it is silent
+
+    Args:
+        kind (str): "sweep" (one glide over the whole range), "vibrato" (notes with a 6 Hz, +-0.5 semitone
+            vibrato) or "bend" (notes bent up a whole tone over their first half)
+        seconds (float): The length in seconds
+        rate (float): The number of values per second, the sampling rate for audio, or the frame rate for F0
+        seed (int, optional): The random seed. Defaults to 0.
+
+    Returns:
+        np.ndarray: The pitch curve
+    """
+    n = int(seconds * rate)
+    t = np.arange(n) / rate
+    if kind == "sweep":
+        return LOWEST_PITCH + (HIGHEST_PITCH - LOWEST_PITCH) * t / seconds
+    rng = np.random.default_rng(seed)
+    # notes of 0.3 - 0.8 s, each followed by 0.1 s of silence
+    note_durs = rng.uniform(0.3, 0.8, size=int(seconds / 0.3) + 1)
+    note_starts = np.concatenate(([0], np.cumsum(note_durs + 0.1)[:-1]))
+    note_pitches = rng.integers(LOWEST_PITCH, HIGHEST_PITCH - 2, size=len(note_durs))
+    note_idx = np.searchsorted(note_starts, t, side="right") - 1
+    t_in_note = t - note_starts[note_idx]
+    pitch = note_pitches[note_idx].astype(np.float64)
+    if kind == "vibrato":
+        pitch += 0.5 * np.sin(2 * np.pi * 6 * t_in_note)
+    elif kind == "bend":
+        pitch += 2 * np.minimum(t_in_note / (note_durs[note_idx] / 2), 1)
+    else:
+        raise ValueError(f"unknown pitch curve {kind!r}, expected one of {CURVES}")
+    pitch[t_in_note >= note_durs[note_idx]] = np.nan
+    return pitch
+
+
+def make_audio(path, kind, seconds=30, sr=44100, seed=0):
+    """Write a mono WAV file of a sine tone following `make_pitch_curve(kind, ...)`
+
+    Returns:
+        int: The number of samples
+    """
+    import soundfile
+
+    pitch = make_pitch_curve(kind, seconds, sr, seed=seed)
+    voiced = ~np.isnan(pitch)
+    hz = 440 * 2 ** ((np.where(voiced, pitch, 69) - 69) / 12)
+    y = 0.5 * np.sin(2 * np.pi * np.cumsum(hz) / sr) * voiced
+    soundfile.write(path, y.astype(np.float32), sr, subtype="PCM_16")
+    return len(y)
+
+
+def make_inputs(work_dir, n_songs=10, n_audio=3, audio_seconds=30, seed=0, **song_options):
+    """Generate the songs and audio files of a benchmark run into `work_dir`
+
+    Returns:
+        dict: The generated files and their note counts, the input of `run_stage`
+    """
+    song_dir = os.path.join(work_dir, "songs")
+    audio_dir = os.path.join(work_dir, "audio")
+    for directory in (song_dir, audio_dir, os.path.join(work_dir, "single"), os.path.join(work_dir, "anno")):
+        os.makedirs(directory, exist_ok=True)
+    songs = []
+    n_notes = 0
+    for i in range(n_songs):
+        path = os.path.join(song_dir, f"song_{i}.gp5")
+        n_notes += make_song(path, seed=seed + i, **song_options)
+        songs.append(path)
+    audio = []
+    for i in range(n_audio):
+        kind = CURVES[i % len(CURVES)]
+        path = os.path.join(audio_dir, f"{kind}_{i}.wav")
+        make_audio(path, kind, seconds=audio_seconds, seed=seed + i)
+        audio.append(path)
+    return {
+        "work_dir": work_dir,
+        "songs": songs,
+        "song_notes": n_notes,
+        "audio": audio,
+        "audio_seconds": audio_seconds,
+        "seed": seed,
+    }
+
+
+def _count_track_notes(song):
+    return sum(len(beat.notes) for measure in song.tracks[0].measures for beat in measure.voices[0].beats)
+
+
+def _bench_split(inputs):
+    from operations import get_single_tracks
+
+    output_dir = os.path.join(inputs["work_dir"], "single")
+    for file in inputs["songs"]:
+        get_single_tracks(file, output_dir, verbose=False)
+    return {"files": len(inputs["songs"]), "notes": inputs["song_notes"]}
+
+
+def _single_track_files(inputs):
+    files = sorted(glob.glob(os.path.join(inputs["work_dir"], "single", "*.gp5")))
+    if not files:
+        raise RuntimeError("no one-track files, run the split stage first")
+    return files
+
+
+def _bench_poly_vs_mono(inputs, songs, n_notes):
+    from operations import poly_vs_mono
+
+    for song in songs:
+        poly_vs_mono(song)
+    return {"files": len(songs), "notes": n_notes}
+
+
+def _bench_anno(inputs, files, n_notes):
+    from operations import gen_anno
+
+    anno_dir = os.path.join(inputs["work_dir"], "anno")
+    for file in files:
+        gen_anno(file, anno_dir)
+    return {"files": len(files), "notes": n_notes}
+
+
+def _bench_pyin(inputs):
+    from f0_analysis_utils import load_audio_file
+
+    n_frames = 0
+    for file in inputs["audio"]:
+        _, notes = load_audio_file(os.path.abspath(file), use_cache=False)
+        n_frames += len(notes)
+    return {"files": len(inputs["audio"]), "frames": n_frames}
+
+
+def _bench_candidates(inputs, curves):
+    from f0_analysis_utils import (
+        detect_candidates,
+        gather_note_events,
+        get_continous_f0_segment_bounds,
+        get_note_event_bounds,
+    )
+
+    n_events = 0
+    for notes in curves:
+        starts, ends = get_continous_f0_segment_bounds(notes)
+        starts, ends = get_note_event_bounds(notes, starts, ends)
+        values, offsets = gather_note_events(notes, starts, ends)
+        detect_candidates(values, offsets)
+        n_events += len(starts)
+    return {"files": len(curves), "frames": int(sum(len(notes) for notes in curves)), "note_events": n_events}
+
+
+def _bench_poly_detect(inputs, model):
+    from poly_detector import detect_file
+
+    n_frames = 0
+    for file in inputs["audio"]:
+        n_frames += detect_file(file, model)["frames"]
+    return {"files": len(inputs["audio"]), "frames": n_frames}
+
+
+def _prepare_stage(stage, inputs):
+    # the per-stage setup that is not timed, returns the extra arguments of the stage function
+    if stage == "poly_vs_mono":
+        import guitarpro
+
+        songs = [guitarpro.parse(file) for file in _single_track_files(inputs)]
+        return songs, sum(_count_track_notes(song) for song in songs)
+    if stage == "anno":
+        import guitarpro
+        from operations import get_track_annos
+        from unroll import get_timing
+
+        # the notes in the mono segments, i.e., in the annotations
+        files = _single_track_files(inputs)
+        n_notes = 0
+        for file in files:
+            song = guitarpro.parse(file)
+            tempo_map, order = get_timing(song)
+            n_notes += sum(len(anno) for anno in get_track_annos(song.tracks[0], tempo_map, order))
+        return files, n_notes
+    if stage == "candidates":
+        from f0_analysis_utils import HOPSIZE, SR
+
+        # the F0 curves of a pyin stage run on 10x the audio, without running pYIN
+        seconds = 10 * inputs["audio_seconds"]
+        return (
+            [
+                make_pitch_curve(CURVES[i % len(CURVES)], seconds, SR / HOPSIZE, seed=inputs["seed"] + i)
+                for i in range(len(inputs["audio"]))
+            ],
+        )
+    if stage == "poly_detect":
+        import librosa
+        from poly_detector import extract_frames, train_detector
+
+        # a detector trained on the frames of the first audio file, labeled in alternating blocks:
+        # only its size matters to the throughput, not what it detects
+        y, sr = librosa.load(inputs["audio"][0], sr=None, mono=True)
+        features, silent = extract_frames(y, sr)
+        labels = (np.arange(len(features)) // 20) % 2
+        return (train_detector(features[~silent], labels[~silent]),)
+    return ()
+
+
+_STAGE_FUNCTIONS = {
+    "split": _bench_split,
+    "poly_vs_mono": _bench_poly_vs_mono,
+    "anno": _bench_anno,
+    "pyin": _bench_pyin,
+    "candidates": _bench_candidates,
+    "poly_detect": _bench_poly_detect,
+}
+
+
+def _read_status_kb(field):
+    """A memory field of /proc/self/status (e.g. "VmRSS", "VmHWM") in KB, None where it is not available"""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    """Reset the peak RSS (VmHWM) of this process to its current RSS, return False where it is not supported"""
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        return False
+    return _read_status_kb("VmHWM") is not None
+
+
+def run_stage(stage, inputs, repeat=1):
+    """Run one benchmark stage in this process
+
+    Args:
+        stage (str): One of STAGES
+        inputs (dict): The generated inputs, see `make_inputs`
+        repeat (int, optional): The number of runs, the fastest one is reported. Defaults to 1.
+
+    Returns:
+        dict: The counts of one run (files, notes or frames), the best time in seconds, the rates
+        per second, the RSS after the (untimed) setup of the stage and the peak RSS of the timed
+        runs, in MB
+    """
+    args = _prepare_stage(stage, inputs)
+    # the setup (e.g. training the poly_detect model) is not part of the stage: measure the peak
+    # of the timed runs only, from the RSS after the setup
+    setup_rss_kb = _read_status_kb("VmRSS")
+    peak_reset = _reset_peak_rss()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        counts = _STAGE_FUNCTIONS[stage](inputs, *args)
+        times.append(time.perf_counter() - start)
+    result = dict(counts)
+    result["seconds"] = round(min(times), 6)
+    for key, value in counts.items():
+        result[f"{key}_per_sec"] = round(value / min(times), 3) if min(times) > 0 else None
+    if peak_reset:
+        peak_rss_kb = _read_status_kb("VmHWM")
+    else:
+        # the peak of the whole process, setup included (ru_maxrss is in KB on Linux)
+        peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if setup_rss_kb is not None:
+        result["setup_rss_mb"] = round(setup_rss_kb / 1024, 1)
+    result["peak_rss_mb"] = round(peak_rss_kb / 1024, 1)
+    result["peak_rss_includes_setup"] = not peak_reset
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(stages=None, work_dir=None, repeat=1, **options):
+    """Generate the inputs and run the stages, each in a fresh process
+
+    Args:
+        stages (list, optional): The stages to run, in the order of STAGES. Defaults to None (all of them).
+        work_dir (str, optional): The directory for the inputs and outputs. Defaults to None (a temporary directory).
+        repeat (int, optional): See `run_stage`. Defaults to 1.
+        **options: Passed on to `make_inputs` (and `make_song`)
+
+    Returns:
+        dict: The results, see the module docstring
+    """
+    stages = [stage for stage in STAGES if stages is None or stage in stages]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = work_dir or tmp_dir
+        start = time.perf_counter()
+        inputs = make_inputs(work_dir, **options)
+        results = {
+            "commit": _git_commit(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "options": dict(options, repeat=repeat),
+            "generate_seconds": round(time.perf_counter() - start, 6),
+            "stages": {},
+        }
+        # "spawn" so that the peak RSS of a stage does not include the parent
+        context = multiprocessing.get_context("spawn")
+        for stage in stages:
+            if stage == "poly_vs_mono" or stage == "anno":
+                # they run on the output of split
+                if not glob.glob(os.path.join(work_dir, "single", "*.gp5")):
+                    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                        pool.submit(_bench_split, inputs).result()
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                results["stages"][stage] = pool.submit(run_stage, stage, inputs, repeat).result()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=None, help="the stages to run (default: all)")
+    parser.add_argument("--songs", type=int, default=10, help="the number of songs")
+    parser.add_argument("--tracks", type=int, default=3, help="the number of tracks per song")
+    parser.add_argument("--measures", type=int, default=32, help="the number of measures per song")
+    parser.add_argument("--beats", type=int, default=8, help="the number of beats per measure (a power of 2)")
+    parser.add_argument("--notes", type=int, default=3, help="the largest number of notes per beat")
+    parser.add_argument("--tempo-changes", action="store_true", help="change the tempo every 4 measures")
+    parser.add_argument("--audio-files", type=int, default=3, help="the number of audio files")
+    parser.add_argument("--audio-seconds", type=float, default=30, help="the length of each audio file")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=1, help="report the fastest of this many runs")
+    parser.add_argument("--work-dir", default=None, help="keep the inputs and outputs here")
+    parser.add_argument("-o", "--output", default=None, help="write the JSON results here (default: stdout)")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(
+        stages=args.stages,
+        work_dir=args.work_dir,
+        repeat=args.repeat,
+        n_songs=args.songs,
+        n_audio=args.audio_files,
+        audio_seconds=args.audio_seconds,
+        seed=args.seed,
+        n_tracks=args.tracks,
+        n_measures=args.measures,
+        beats_per_measure=args.beats,
+        max_notes=args.notes,
+        tempo_changes=args.tempo_changes,
+    )
+    if args.output:
+        with open(args.output, "w") as outfile:
+            json.dump(results, outfile, indent=2)
+        for stage, result in results["stages"].items():
+            rates = ", ".join(f"{key} {value}" for key, value in result.items() if key.endswith("_per_sec"))
+            setup = f" (after setup {result['setup_rss_mb']} MB)" if "setup_rss_mb" in result else ""
+            print(f"{stage}: {result['seconds']:.3f}s, {rates}, peak RSS {result['peak_rss_mb']} MB{setup}")
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,6 @@
 """
+For rendering without the GUI (on servers, in parallel), see `render.py` and `python batch.py render`.
+
 1. Open an irrelevant file in Guitar Pro 
 2. Put the Guitar Pro window on laptop screen
 3. Double click the window to make sure it fits the screen
@@ -0,0 +1,44 @@
+"""The data directories and cache settings, shared by the analysis modules
+
+Every setting can be overridden with an environment variable, e.g.
+
+    GP_ANNO_DIR=/data/annos python batch.py f0 ...
+
+or changed at runtime, before calling the functions that use it:
+
+    from config import config
+    config.anno_dir = "/data/annos"
+"""
+import os
+from dataclasses import dataclass, fields
+
+DATA_ROOT = "/Volumes/MacOnly/UG_proc/all_time_top_by_hits/clean_tone"
+
+
+@dataclass
+class Config:
+    # the mono audio segments
+    mono_segments_dir: str = os.path.join(DATA_ROOT, "mono_audio_segments")
+    # the annotation directory, or an annotation store file (see `anno_store`)
+    anno_dir: str = os.path.join(DATA_ROOT, "clean_single_track_annotations")
+    # the preprocessed audio files (mono audio segments that has a reasonable length)
+    filtered_audio_dir: str = os.path.join(DATA_ROOT, "mono_audio_segments_filtered")
+    # the pYIN cache, see `f0_cache`
+    f0_cache_dir: str = os.path.join(os.path.expanduser("~"), ".cache", "gp_f0")
+    f0_cache_max_bytes: int = 2 * 1024**3
+    # the SoundFont and the FluidSynth executable for `render`
+    soundfont: str = ""
+    fluidsynth: str = "fluidsynth"
+
+    @classmethod
+    def from_env(cls, prefix="GP_"):
+        """Build a config from the defaults, overridden by the `GP_<FIELD NAME>` environment variables"""
+        values = {}
+        for field in fields(cls):
+            value = os.environ.get(prefix + field.name.upper())
+            if value is not None:
+                values[field.name] = field.type(value)
+        return cls(**values)
+
+
+config = Config.from_env()
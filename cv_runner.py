@@ -0,0 +1,368 @@
+"""Nested cross-validation of the playing technique classifier, in parallel and resumable
+
+The same experiment as the nested CV cells of `pt_classifier_eval.ipynb`: for each feature combination,
+a 5-fold stratified outer CV, and in every outer fold a grid search (2-fold stratified inner CV,
+macro F1) over the SVC settings of a `StandardScaler` + `SVC(class_weight="balanced")` pipeline,
+refitted on the outer training rows with the best settings and scored on the outer test rows.
+(The notebook fits every combination on all the columns `X[train_index]`; here each one only sees its
+own columns, read from a `feature_dataset`.)
+
+Instead of running the outer folds of one combination after the other, every (combination, outer fold)
+pair is a job of a process pool, the largest combinations first. The fits of a job share cached scalers:
+`StandardScaler` works column by column, so the scalers of each outer fold and inner split are fitted
+once per column group, before the jobs, and a combination concatenates the scalers of its groups.
+The scores of the grid search are the same as `GridSearchCV` with the pipeline.
+
+Everything goes into the run directory, as soon as it is known:
+
+    RUN_DIR/
+        run.json                    the dataset, the folds' seed and sizes, and the parameter grid
+        folds.npz                   the outer fold of every row, and the inner fold of every training row
+        scalers/fold_0.joblib       the fitted scalers of an outer fold, by inner split and column group
+        models/timbre.fold_0.joblib the refitted pipeline of a job
+        results.jsonl               one line per finished job
+
+A job is done when its result line is written, so a run started again with the same arguments skips
+the finished jobs and only runs the rest:
+
+    python cv_runner.py DATASET_DIR RUN_DIR -j 16
+    python cv_runner.py DATASET_DIR RUN_DIR --combos timbre timbre+pitch --C 1 10 --gamma scale
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from feature_dataset import FeatureDataset
+
+# the feature combinations of `pt_classifier_eval.ipynb`
+FEATURE_COMBOS = {
+    "mfcc": ["mfcc"],
+    "pitch": ["pitch"],
+    "timbre": ["timbre"],
+    "timbre+pitch": ["timbre", "pitch"],
+    "timbre+mfcc": ["timbre", "mfcc"],
+    "pitch+mfcc": ["pitch", "mfcc"],
+    "all": ["mfcc", "pitch", "timbre"],
+}
+P_GRID = {"svc__C": [1, 10, 100, 1000], "svc__gamma": ["scale", "auto"]}
+SCORING = "f1_macro"
+RESULTS_FILE = "results.jsonl"
+
+
+def make_folds(y, n_outer=5, n_inner=2, seed=0):
+    """The outer and inner stratified folds, as `StratifiedKFold(shuffle=True)` in the notebook
+
+    Args:
+        y (np.ndarray): The labels
+        n_outer (int, optional): The number of outer folds. Defaults to 5.
+        n_inner (int, optional): The number of inner folds. Defaults to 2.
+        seed (int, optional): The random seed of the outer folds; outer fold k splits its training rows with seed + 1 + k. Defaults to 0.
+
+    Returns:
+        dict: "outer", the outer (test) fold of every row, and "inner_{k}", the inner (validation)
+        fold of every training row of outer fold k, in row order
+    """
+    from sklearn.model_selection import StratifiedKFold
+
+    folds = {"outer": np.empty(len(y), dtype=np.int64)}
+    outer_cv = StratifiedKFold(n_splits=n_outer, shuffle=True, random_state=seed)
+    for k, (_, test_index) in enumerate(outer_cv.split(np.zeros((len(y), 1)), y)):
+        folds["outer"][test_index] = k
+    for k in range(n_outer):
+        y_train = y[folds["outer"] != k]
+        inner = np.empty(len(y_train), dtype=np.int64)
+        inner_cv = StratifiedKFold(n_splits=n_inner, shuffle=True, random_state=seed + 1 + k)
+        for j, (_, val_index) in enumerate(inner_cv.split(np.zeros((len(y_train), 1)), y_train)):
+            inner[val_index] = j
+        folds[f"inner_{k}"] = inner
+    return folds
+
+
+def _dump(obj, path):
+    import joblib
+
+    joblib.dump(obj, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def _scaler_file(run_dir, fold):
+    return os.path.join(run_dir, "scalers", f"fold_{fold}.joblib")
+
+
+def fit_fold_scalers(dataset_dir, run_dir, fold):
+    """Fit the scalers of one outer fold: on its training rows, and on the training rows of each inner split
+
+    The scalers are saved as {"outer": {group: scaler}, "inner": [{group: scaler}, ...]}.
+
+    Args:
+        dataset_dir (str): The feature dataset
+        run_dir (str): The run directory, with the folds
+        fold (int): The outer fold
+    """
+    from sklearn.preprocessing import StandardScaler
+
+    dataset = FeatureDataset(dataset_dir)
+    folds = np.load(os.path.join(run_dir, "folds.npz"))
+    train_rows = np.flatnonzero(folds["outer"] != fold)
+    inner = folds[f"inner_{fold}"]
+    scalers = {"outer": {}, "inner": [{} for _ in range(inner.max() + 1)]}
+    for group in dataset.groups:
+        X_train = dataset.load([group], rows=train_rows)
+        scalers["outer"][group] = StandardScaler().fit(X_train)
+        for j, split_scalers in enumerate(scalers["inner"]):
+            split_scalers[group] = StandardScaler().fit(X_train[inner != j])
+    _dump(scalers, _scaler_file(run_dir, fold))
+
+
+def merge_scalers(scalers):
+    """One fitted `StandardScaler` for the concatenated columns of fitted scalers"""
+    from sklearn.preprocessing import StandardScaler
+
+    merged = StandardScaler()
+    for attribute in ("mean_", "var_", "scale_"):
+        setattr(merged, attribute, np.concatenate([getattr(scaler, attribute) for scaler in scalers]))
+    merged.n_features_in_ = len(merged.mean_)
+    # one count per column when there are NaNs
+    if any(np.ndim(scaler.n_samples_seen_) for scaler in scalers):
+        merged.n_samples_seen_ = np.concatenate(
+            [np.broadcast_to(scaler.n_samples_seen_, len(scaler.mean_)) for scaler in scalers]
+        )
+    else:
+        merged.n_samples_seen_ = scalers[0].n_samples_seen_
+    return merged
+
+
+def run_job(dataset_dir, run_dir, combo, groups, fold, p_grid):
+    """Grid search, refit and test one feature combination on one outer fold
+
+    Args:
+        dataset_dir (str): The feature dataset
+        run_dir (str): The run directory, with the folds and the scalers
+        combo (str): The name of the feature combination
+        groups (list): Its column groups
+        fold (int): The outer fold
+        p_grid (dict): The SVC parameter grid, with the "svc__" prefix of the notebook
+
+    Returns:
+        dict: The result line of the job
+    """
+    import joblib
+    from sklearn.metrics import classification_report, f1_score
+    from sklearn.model_selection import ParameterGrid
+    from sklearn.pipeline import Pipeline
+    from sklearn.svm import SVC
+
+    start = time.perf_counter()
+    dataset = FeatureDataset(dataset_dir)
+    folds = np.load(os.path.join(run_dir, "folds.npz"))
+    scalers = joblib.load(_scaler_file(run_dir, fold))
+    X = dataset.load(groups)
+    y = dataset.labels()
+    train = folds["outer"] != fold
+    X_train, y_train = X[train], y[train]
+    X_test, y_test = X[~train], y[~train]
+    inner = folds[f"inner_{fold}"]
+
+    # the inner splits, scaled once for all the grid points
+    splits = []
+    for j, split_scalers in enumerate(scalers["inner"]):
+        scaler = merge_scalers([split_scalers[group] for group in groups])
+        fit, val = inner != j, inner == j
+        splits.append((scaler.transform(X_train[fit]), y_train[fit], scaler.transform(X_train[val]), y_train[val]))
+    candidates = list(ParameterGrid(p_grid))
+    scores = np.empty((len(candidates), len(splits)))
+    for i, params in enumerate(candidates):
+        svc_params = {name.split("__", 1)[1]: value for name, value in params.items()}
+        for j, (X_fit, y_fit, X_val, y_val) in enumerate(splits):
+            svc = SVC(class_weight="balanced", **svc_params).fit(X_fit, y_fit)
+            scores[i, j] = f1_score(y_val, svc.predict(X_val), average="macro")
+    mean_scores = scores.mean(axis=1)
+    # the first of the best, as GridSearchCV
+    best = int(np.argmax(mean_scores))
+    best_params = candidates[best]
+
+    scaler = merge_scalers([scalers["outer"][group] for group in groups])
+    svc_params = {name.split("__", 1)[1]: value for name, value in best_params.items()}
+    model = Pipeline([("scaler", scaler), ("svc", SVC(class_weight="balanced", **svc_params))])
+    model.named_steps["svc"].fit(scaler.transform(X_train), y_train)
+    y_pred = model.predict(X_test)
+    _dump(model, os.path.join(run_dir, "models", f"{combo}.fold_{fold}.joblib"))
+    return {
+        "combo": combo,
+        "groups": groups,
+        "fold": fold,
+        "best_params": best_params,
+        "best_score": float(mean_scores[best]),
+        "grid": [{"params": params, "score": float(score)} for params, score in zip(candidates, mean_scores)],
+        "test_score": float(f1_score(y_test, y_pred, average="macro")),
+        "report": classification_report(y_test, y_pred, digits=3, output_dict=True, zero_division=0),
+        "n_train": int(train.sum()),
+        "n_test": int((~train).sum()),
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def load_results(run_dir):
+    """The result lines written so far, skipping a line cut off by a crash"""
+    results = []
+    path = os.path.join(run_dir, RESULTS_FILE)
+    if not os.path.exists(path):
+        return results
+    with open(path) as infile:
+        for line in infile:
+            try:
+                results.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return results
+
+
+def summarize(results):
+    """The mean and standard deviation of the test scores of each combination, over its outer folds"""
+    summary = {}
+    for result in results:
+        summary.setdefault(result["combo"], []).append(result["test_score"])
+    return {
+        combo: {"folds": len(scores), "mean": float(np.mean(scores)), "std": float(np.std(scores))}
+        for combo, scores in summary.items()
+    }
+
+
+def run_nested_cv(
+    dataset_dir,
+    run_dir,
+    combos=None,
+    p_grid=None,
+    n_outer=5,
+    n_inner=2,
+    seed=0,
+    workers=None,
+    verbose=True,
+):
+    """Run (or resume) the nested CV of some feature combinations, see the module docstring
+
+    Args:
+        dataset_dir (str): The feature dataset, see `feature_dataset`
+        run_dir (str): The run directory
+        combos (list, optional): The names of the combinations, in FEATURE_COMBOS. Defaults to None (all of them).
+        p_grid (dict, optional): The parameter grid. Defaults to None (P_GRID).
+        n_outer (int, optional): The number of outer folds. Defaults to 5.
+        n_inner (int, optional): The number of inner folds. Defaults to 2.
+        seed (int, optional): The random seed of the folds. Defaults to 0.
+        workers (int, optional): The number of worker processes. Defaults to None (one per CPU).
+        verbose (bool, optional): Print the progress. Defaults to True.
+
+    Raises:
+        ValueError: If the run directory holds a run with other settings
+
+    Returns:
+        dict: The summary of all the finished jobs of the run, see `summarize`
+    """
+    combos = list(FEATURE_COMBOS) if combos is None else combos
+    p_grid = P_GRID if p_grid is None else p_grid
+    dataset = FeatureDataset(dataset_dir)
+    for combo in combos:
+        missing = [group for group in FEATURE_COMBOS[combo] if group not in dataset.groups]
+        if missing:
+            raise ValueError(f"{dataset_dir} has no column group {missing} for {combo}")
+    os.makedirs(os.path.join(run_dir, "scalers"), exist_ok=True)
+    os.makedirs(os.path.join(run_dir, "models"), exist_ok=True)
+
+    # the settings the folds, scalers and results depend on (the combinations can change between runs)
+    settings = {
+        "dataset": os.path.abspath(dataset_dir),
+        "rows": len(dataset),
+        "n_outer": n_outer,
+        "n_inner": n_inner,
+        "seed": seed,
+        "p_grid": p_grid,
+    }
+    settings_file = os.path.join(run_dir, "run.json")
+    if os.path.exists(settings_file):
+        with open(settings_file) as infile:
+            previous = json.load(infile)
+        if previous != json.loads(json.dumps(settings)):
+            raise ValueError(f"{run_dir} holds a run with other settings: {previous}")
+    folds_file = os.path.join(run_dir, "folds.npz")
+    if not os.path.exists(folds_file):
+        np.savez(folds_file + ".tmp.npz", **make_folds(dataset.labels(), n_outer, n_inner, seed))
+        os.replace(folds_file + ".tmp.npz", folds_file)
+    with open(settings_file, "w") as outfile:
+        json.dump(settings, outfile, indent=1)
+
+    done = {(result["combo"], result["fold"]) for result in load_results(run_dir)}
+    jobs = [(combo, fold) for combo in combos for fold in range(n_outer) if (combo, fold) not in done]
+    # the combinations with the most columns take the longest, start them first
+    jobs.sort(key=lambda job: -sum(len(dataset.groups[group]) for group in FEATURE_COMBOS[job[0]]))
+    if verbose:
+        print(f"{len(jobs)} jobs to run, {len(done)} already done")
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending_folds = sorted({fold for _, fold in jobs if not os.path.exists(_scaler_file(run_dir, fold))})
+        for future in as_completed(
+            [executor.submit(fit_fold_scalers, dataset_dir, run_dir, fold) for fold in pending_folds]
+        ):
+            future.result()
+        futures = [
+            executor.submit(run_job, dataset_dir, run_dir, combo, FEATURE_COMBOS[combo], fold, p_grid)
+            for combo, fold in jobs
+        ]
+        results_path = os.path.join(run_dir, RESULTS_FILE)
+        with open(results_path, "a+b") as results_file:
+            # end a line cut off by a crash
+            if results_file.tell():
+                results_file.seek(-1, os.SEEK_END)
+                if results_file.read(1) != b"\n":
+                    results_file.write(b"\n")
+            for i, future in enumerate(as_completed(futures), 1):
+                result = future.result()
+                results_file.write((json.dumps(result) + "\n").encode())
+                results_file.flush()
+                if verbose:
+                    print(
+                        f"{i} / {len(jobs)}: {result['combo']} fold {result['fold']}, "
+                        f"{SCORING} {result['test_score']:.3f} with {result['best_params']} "
+                        f"({result['seconds']:.1f}s, {time.perf_counter() - start:.0f}s elapsed)"
+                    )
+    return summarize(load_results(run_dir))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("dataset_dir", help="a feature dataset, see feature_dataset.py")
+    parser.add_argument("run_dir")
+    parser.add_argument("--combos", nargs="+", choices=list(FEATURE_COMBOS), default=None)
+    parser.add_argument("--C", nargs="+", type=float, default=None, help="the SVC C values of the grid")
+    parser.add_argument("--gamma", nargs="+", default=None, help="the SVC gamma values of the grid")
+    parser.add_argument("--outer", type=int, default=5, help="the number of outer folds")
+    parser.add_argument("--inner", type=int, default=2, help="the number of inner folds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-j", "--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    p_grid = dict(P_GRID)
+    if args.C:
+        p_grid["svc__C"] = [int(c) if c.is_integer() else c for c in args.C]
+    if args.gamma:
+        p_grid["svc__gamma"] = [gamma if gamma in ("scale", "auto") else float(gamma) for gamma in args.gamma]
+    summary = run_nested_cv(
+        args.dataset_dir,
+        args.run_dir,
+        combos=args.combos,
+        p_grid=p_grid,
+        n_outer=args.outer,
+        n_inner=args.inner,
+        seed=args.seed,
+        workers=args.workers,
+    )
+    for combo, scores in sorted(summary.items(), key=lambda item: -item[1]["mean"]):
+        print(f"{combo:>14}: {SCORING} {scores['mean']:.3f} +- {scores['std']:.3f} ({scores['folds']} folds)")
+
+
+if __name__ == "__main__":
+    main()
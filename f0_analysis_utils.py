@@ -1,37 +1,72 @@
+"""Analysis of pYIN F0 curves against the ground-truth annotation
+
+The analysis functions only need NumPy. librosa (F0 extraction), matplotlib (plotting) and scipy
+are imported by the functions that use them, so that importing this module stays fast, e.g., in
+process-pool workers. The directories come from `config`.
+"""
 import os, json
-import librosa
-import matplotlib.pyplot as plt
+from functools import lru_cache
 import numpy as np
-from scipy.signal import find_peaks
+
+from config import config
+from f0_cache import cached_pyin
+from metrics import metrics
+from note_table import EFFECTS
 
 FRAMESIZE = 2048
 HOPSIZE = 512
 SR = 44100
 
-MONO_SEGMENTS_DIR = (
-    "/Volumes/MacOnly/UG_proc/all_time_top_by_hits/clean_tone/mono_audio_segments"
-)
-ANNO_DIR = "/Volumes/MacOnly/UG_proc/all_time_top_by_hits/clean_tone/clean_single_track_annotations"
+# the directories as configured at import time, for the notebooks
+# the functions below read `config` on every call instead
+MONO_SEGMENTS_DIR = config.mono_segments_dir
+ANNO_DIR = config.anno_dir
 # the directory for preprocessed audio files (mono audio segments that has a reasonable length)
-FILTERED_AUDIO_DIR = "/Volumes/MacOnly/UG_proc/all_time_top_by_hits/clean_tone/mono_audio_segments_filtered"
+FILTERED_AUDIO_DIR = config.filtered_audio_dir
+
 
+@lru_cache(maxsize=None)
+def ms_to_frames(ms):
+    """Convert a duration in ms to a number of frames (FRAMESIZE / HOPSIZE at SR).
+
+    This is the arithmetic of `librosa.time_to_frames(ms / 1000, sr=SR, hop_length=HOPSIZE, n_fft=FRAMESIZE)`,
+    without importing librosa. The thresholds are the same for every note event, so the result is cached.
+
+    Args:
+        ms (int): The duration in ms.
 
-def load_audio_file(file):
+    Returns:
+        int: The number of frames.
+    """
+    samples = int(ms / 1000 * SR)
+    return (samples - FRAMESIZE // 2) // HOPSIZE
+
+
+def load_audio_file(file, use_cache=True, rebuild_cache=False, audio_dir=None):
     """Generic function for loading an audio file into time and frequency.
 
+    The pYIN result is cached on disk (see `f0_cache`), so only the first call on a file is slow.
+
     Args:
         file (str): The audio file name
+        use_cache (bool, optional): Set to False to bypass the F0 cache. Defaults to True.
+        rebuild_cache (bool, optional): Recompute the F0 and overwrite the cache entry. Defaults to False.
+        audio_dir (str, optional): The path to the audio directory. Defaults to None (`config.filtered_audio_dir`).
 
     Returns:
         tuple: (times, notes), the time sequence and F0 sequence converted to MIDI notes
     """
-    y, sr = librosa.load(os.path.join(FILTERED_AUDIO_DIR, file), sr=None)
-    f0, _, _ = librosa.pyin(
-        y,
+    import librosa
+
+    f0, _, _, sr = cached_pyin(
+        os.path.join(audio_dir or config.filtered_audio_dir, file),
         fmin=librosa.note_to_hz("C2"),
         fmax=librosa.note_to_hz("G6"),
-        sr=sr,
+        frame_length=FRAMESIZE,
+        hop_length=HOPSIZE,
         center=False,
+        use_cache=use_cache,
+        refresh=rebuild_cache,
     )
     times = librosa.times_like(f0, sr=sr, hop_length=512, n_fft=2048)
     # convert F0 sequence to MIDI note sequence
@@ -39,16 +74,77 @@ def load_audio_file(file):
     return times, notes
 
 
-def find_anno(file, anno_dir=ANNO_DIR):
+def stream_audio_file(file, block_sec=60, context_sec=5, audio_dir=None):
+    """Like `load_audio_file`, but read and analyze the audio block by block, for long files.
+
+    Only one block (plus its context) is in memory at a time. Each block is read with its
+    neighbouring `context_sec` on both sides, and the F0 of the context frames is dropped, so the
+    frames and their times are exactly those of `load_audio_file`. The F0 values only differ where
+    the pYIN Viterbi decoding (which is global to the analyzed signal) has not settled within the context.
+
+    Args:
+        file (str): The audio file name
+        block_sec (float, optional): The length of the blocks in seconds. Defaults to 60.
+        context_sec (float, optional): The context on each side of a block in seconds. Defaults to 5.
+        audio_dir (str, optional): The path to the audio directory. Defaults to None (`config.filtered_audio_dir`).
+
+    Yields:
+        tuple: (times, notes) of each block, see `load_audio_file`
+    """
+    import librosa
+    import soundfile
+
+    path = os.path.join(audio_dir or config.filtered_audio_dir, file)
+    info = soundfile.info(path)
+    sr = info.samplerate
+    # the frames of `librosa.pyin(..., center=False)` on the whole file
+    n_frames = max(0, 1 + (info.frames - FRAMESIZE) // HOPSIZE)
+    block_frames = max(1, int(block_sec * sr) // HOPSIZE)
+    context_frames = int(context_sec * sr) // HOPSIZE
+    for block_start in range(0, n_frames, block_frames):
+        block_end = min(block_start + block_frames, n_frames)
+        first = max(0, block_start - context_frames)
+        last = min(n_frames, block_end + context_frames)
+        # the samples covered by frames first ... last - 1
+        with metrics.timer("audio_load"):
+            y, _ = soundfile.read(
+                path,
+                start=first * HOPSIZE,
+                stop=(last - 1) * HOPSIZE + FRAMESIZE,
+                dtype="float32",
+                always_2d=True,
+            )
+            # mono, as `librosa.load`
+            y = y.mean(axis=1) if y.shape[1] > 1 else y[:, 0]
+        with metrics.timer("pyin"):
+            f0, _, _ = librosa.pyin(
+                y,
+                fmin=librosa.note_to_hz("C2"),
+                fmax=librosa.note_to_hz("G6"),
+                sr=sr,
+                frame_length=FRAMESIZE,
+                hop_length=HOPSIZE,
+                center=False,
+            )
+        f0 = f0[block_start - first : block_end - first]
+        times = librosa.frames_to_time(
+            np.arange(block_start, block_end), sr=sr, hop_length=HOPSIZE, n_fft=FRAMESIZE
+        )
+        yield times, librosa.hz_to_midi(f0)
+
+
+def find_anno(file, anno_dir=None):
     """Given an audio file name, find the path to its corresponding annotation file. 
 
     Args:
         file (str): The path to the mono audio segment file.
-        anno_dir (str, optional): The path to the annotation directory. Defaults to ANNO_DIR.
+        anno_dir (str, optional): The path to the annotation directory. Defaults to None (`config.anno_dir`).
 
     Returns:
         str: The complete path to the annotation file. 
     """
+    if anno_dir is None:
+        anno_dir = config.anno_dir
     segment_name_with_onset, _ = os.path.splitext(file.split("/")[-1])
     segment_name = "_".join(segment_name_with_onset.split("_")[:-1])
     anno_file_name = segment_name + ".json"
@@ -56,29 +152,55 @@ def find_anno(file, anno_dir=ANNO_DIR):
     return anno_file
 
 
-def plot_f0_vs_gt(file, anno_dir=ANNO_DIR):
+def load_anno(file, anno_dir=None):
+    """Given an audio file name, load the note-infos of its corresponding annotation.
+
+    Args:
+        file (str): The path to the mono audio segment file.
+        anno_dir (str, optional): The path to the annotation directory, or to an annotation store file
+            (see `anno_store`). Defaults to None (`config.anno_dir`).
+
+    Returns:
+        list: The note-infos of the annotation.
+    """
+    if anno_dir is None:
+        anno_dir = config.anno_dir
+    if os.path.isfile(anno_dir):
+        segment_name, _ = os.path.splitext(find_anno(file, anno_dir="").split("/")[-1])
+        return _get_anno_store(anno_dir).get_note_infos(segment_name)
+    with open(find_anno(file, anno_dir=anno_dir)) as anno:
+        return json.load(anno)
+
+
+_anno_stores = {}
+
+
+def _get_anno_store(path):
+    # open each store once per process, the lookups after that are O(1)
+    if path not in _anno_stores:
+        from anno_store import AnnoStore
+
+        _anno_stores[path] = AnnoStore(path)
+    return _anno_stores[path]
+
+
+def plot_f0_vs_gt(file, audio_dir=None, anno_dir=None):
     """Given an audio file name, plot its ground-truth pitches and estimated F0 curve
 
+    Needs matplotlib.
+
     Args:
         file (str): The filename of the mono audio segment.
-        audio_dir (str, optional): The path to the audio directory. Defaults to MONO_SEGMENTS_DIR.
-        anno_dir (str, optional): The path to the annotation directory. Defaults to ANNO_DIR.
+        audio_dir (str, optional): The path to the audio directory. Defaults to None (`config.filtered_audio_dir`).
+        anno_dir (str, optional): The path to the annotation directory. Defaults to None (`config.anno_dir`).
     """
-    times, notes = load_audio_file(file)
+    import matplotlib.pyplot as plt
 
-    anno_file = find_anno(file, anno_dir=anno_dir)
-    with open(anno_file) as anno:
-        note_infos = json.load(anno)
+    times, notes = load_audio_file(file, audio_dir=audio_dir)
 
-    gt = np.empty_like(notes)
-    gt[:] = np.NaN
+    note_infos = load_anno(file, anno_dir=anno_dir)
 
-    for note in note_infos:
-        onset = note["time"]["start"] * SR
-        offset = (note["time"]["start"] + note["time"]["dur"]) * SR
-        onset_fr = librosa.samples_to_frames(onset, hop_length=512)
-        offset_fr = librosa.samples_to_frames(offset, hop_length=512)
-        gt[onset_fr:offset_fr] = note["pitch"]
+    gt = rasterize_notes(note_infos, len(notes))["pitch"]
 
     plt.figure(figsize=(20, 5))
     plt.plot(times, notes, label="pYIN", color="blue")
@@ -87,6 +209,102 @@ def plot_f0_vs_gt(file, anno_dir=ANNO_DIR):
     plt.show()
 
 
+def get_note_arrays(notes):
+    """Turn the notes of an annotation into arrays.
+
+    Args:
+        notes (list or np.ndarray): The note-infos of an annotation, or its note table (see `note_table`).
+
+    Returns:
+        dict: "start", "dur" (in seconds) and "pitch" float arrays, and one bool array per effect in EFFECTS.
+    """
+    if isinstance(notes, np.ndarray):
+        arrays = {
+            "start": notes["start"].astype(np.float64),
+            "dur": notes["dur"].astype(np.float64),
+            "pitch": notes["pitch"].astype(np.float64),
+        }
+        for i, effect in enumerate(EFFECTS):
+            arrays[effect] = (notes["effects"] & (1 << i)) != 0
+        return arrays
+    arrays = {
+        "start": np.array([note["time"]["start"] for note in notes], dtype=np.float64),
+        "dur": np.array([note["time"]["dur"] for note in notes], dtype=np.float64),
+        "pitch": np.array([note["pitch"] for note in notes], dtype=np.float64),
+    }
+    for effect in EFFECTS:
+        arrays[effect] = np.array([bool(note["effects"][effect]) for note in notes], dtype=bool)
+    return arrays
+
+
+def rasterize_annos(annos, n_frames, sr=SR, hop_length=HOPSIZE):
+    """Rasterize many annotations into frame-level pitch and effect labels in one pass.
+
+    A note covers frames `int(start * sr // hop_length)` to `int((start + dur) * sr // hop_length)` (exclusive),
+    as in `plot_f0_vs_gt`. Where notes overlap, the later note wins, like assigning the notes in order.
+
+    Args:
+        annos (list): The annotations, each a list of note-infos or a note table.
+        n_frames (list): The number of frames of each annotation, e.g., `len(notes)` from `load_audio_file`.
+        sr (int, optional): The sampling rate. Defaults to SR.
+        hop_length (int, optional): The hop size. Defaults to HOPSIZE.
+
+    Returns:
+        dict, np.ndarray: The frame-level arrays of all annotations concatenated: "pitch" (NaN where there is
+        no note) and one bool array per effect in EFFECTS, and the frame offsets (the frames of
+        annotation k are `offsets[k] : offsets[k + 1]`).
+    """
+    n_frames = np.asarray(n_frames, dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(n_frames)))
+    note_arrays = [get_note_arrays(notes) for notes in annos]
+    arrays = {
+        key: np.concatenate([a[key] for a in note_arrays]) if note_arrays else np.empty(0)
+        for key in ["start", "dur", "pitch"] + EFFECTS
+    }
+    note_counts = [len(a["start"]) for a in note_arrays]
+    # per note: the first frame and the number of frames of its annotation
+    frame_offsets = np.repeat(offsets[:-1], note_counts)
+    note_n_frames = np.repeat(n_frames, note_counts)
+
+    onset_fr = (arrays["start"] * sr // hop_length).astype(np.int64)
+    offset_fr = ((arrays["start"] + arrays["dur"]) * sr // hop_length).astype(np.int64)
+    # clip to the frames of the annotation, like slicing does
+    onset_fr = np.clip(onset_fr, 0, note_n_frames)
+    offset_fr = np.clip(offset_fr, 0, note_n_frames)
+    lengths = np.maximum(offset_fr - onset_fr, 0)
+    # the (global) frames covered by each note, without a loop over the notes
+    note_idx = np.repeat(np.arange(len(lengths)), lengths)
+    run_starts = np.cumsum(lengths) - lengths
+    frames = np.arange(lengths.sum()) + np.repeat(onset_fr + frame_offsets - run_starts, lengths)
+
+    # the later note wins
+    owner = np.full(offsets[-1], -1, dtype=np.int64)
+    np.maximum.at(owner, frames, note_idx)
+    covered = owner >= 0
+    frame_arrays = {"pitch": np.full(offsets[-1], np.nan)}
+    frame_arrays["pitch"][covered] = arrays["pitch"][owner[covered]]
+    for effect in EFFECTS:
+        frame_arrays[effect] = np.zeros(offsets[-1], dtype=bool)
+        frame_arrays[effect][covered] = arrays[effect][owner[covered]]
+    return frame_arrays, offsets
+
+
+def rasterize_notes(notes, n_frames, sr=SR, hop_length=HOPSIZE):
+    """Rasterize one annotation into frame-level pitch and effect labels, see `rasterize_annos`.
+
+    Args:
+        notes (list or np.ndarray): The note-infos of the annotation, or its note table.
+        n_frames (int): The number of frames.
+        sr (int, optional): The sampling rate. Defaults to SR.
+        hop_length (int, optional): The hop size. Defaults to HOPSIZE.
+
+    Returns:
+        dict: "pitch" (NaN where there is no note) and one bool array per effect in EFFECTS.
+    """
+    frame_arrays, _ = rasterize_annos([notes], [n_frames], sr=sr, hop_length=hop_length)
+    return frame_arrays
+
+
 def get_continous_f0_segments(notes, dur_thres=80):
     """Given an estimated F0 curve, split it (on NaNs) into continuous segments
 
@@ -96,23 +314,30 @@ def get_continous_f0_segments(notes, dur_thres=80):
 
     Returns:
         list of F0 segment indices: A list of lists. Each list consists of the indices of a continuous F0 segment
+        (none for a curve without any F0, whatever the threshold)
     """
-    # valid_indices are the indices of non-NaN elements
-    valid_indices = [i for i in range(len(notes)) if not np.isnan(notes[i])]
+    starts, ends = get_continous_f0_segment_bounds(notes, dur_thres=dur_thres)
+    return [np.arange(start, end) for start, end in zip(starts, ends)]
 
-    # group consecutive elements in the array
-    def consecutive(data, stepsize=1):
-        return np.split(data, np.where(np.diff(data) != stepsize)[0] + 1)
 
-    # group the consecutive indices into index_segments
-    f0_segments = consecutive(valid_indices)
-    dur_thres_fr = librosa.time_to_frames(
-        dur_thres / 1000, sr=44100, hop_length=512, n_fft=2048
-    )
-    valid_f0_segments = [
-        f0_segment for f0_segment in f0_segments if len(f0_segment) >= dur_thres_fr
-    ]
-    return valid_f0_segments
+def get_continous_f0_segment_bounds(notes, dur_thres=80):
+    """Vectorized version of `get_continous_f0_segments`, returning the segment boundaries
+
+    Args:
+        notes (np.Array): The estimated F0 sequence converted to MIDI note sequence
+        dur_thres (int): The duration threshold for a single note event. Defaults to 80 ms.
+
+    Returns:
+        np.Array, np.Array: The start indices and the (exclusive) end indices of the continuous F0 segments
+    """
+    # +1 where a run of non-NaN frames starts, -1 right after it ends
+    valid = np.concatenate(([0], ~np.isnan(notes), [0])).astype(np.int8)
+    edges = np.diff(valid)
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    dur_thres_fr = ms_to_frames(dur_thres)
+    keep = ends - starts >= dur_thres_fr
+    return starts[keep], ends[keep]
 
 
 def get_note_events_from_f0_segment(
@@ -137,29 +362,54 @@ def get_note_events_from_f0_segment(
     # check that the indices in the f0 segment is indeed continuous
     assert np.all(np.diff(f0_segment, n=1) == 1)
 
-    previous_note = notes[f0_segment[0]]
-    # note_event records the indices of the elements that belongs to the current note event
-    note_event = [f0_segment[0]]
-    note_events = []
-
-    # this assumes the f0 segment has at least two frames (~60 ms)
-    for i in f0_segment[1:]:
-        if abs(notes[i] - previous_note) <= f0_change_thres:
-            note_event.append(i)
-            if i == f0_segment[-1]:
-                note_events.append(note_event)
-        else:
-            note_events.append(note_event)
-            note_event = [i]
-        previous_note = notes[i]
-
-    dur_thres_fr = librosa.time_to_frames(
-        dur_thres / 1000, sr=44100, hop_length=512, n_fft=2048
+    starts, ends = get_note_event_bounds(
+        notes,
+        [f0_segment[0]],
+        [f0_segment[-1] + 1],
+        f0_change_thres=f0_change_thres,
+        dur_thres=dur_thres,
     )
-    valid_note_events = [
-        note_event for note_event in note_events if len(note_event) >= dur_thres_fr
-    ]
-    return valid_note_events
+    return [list(range(start, end)) for start, end in zip(starts, ends)]
+
+
+def get_note_event_bounds(notes, starts, ends, f0_change_thres=0.5, dur_thres=80):
+    """Vectorized version of `get_note_events_from_f0_segment`, for all F0 segments of a file at once
+
+    Args:
+        notes (np.Array): The estimated F0 sequence converted to MIDI note sequence
+        starts (np.Array): The start indices of the F0 segments, obtained from `get_continous_f0_segment_bounds`
+        ends (np.Array): The (exclusive) end indices of the F0 segments
+        f0_change_thres (float, optional): Cut the F0 segments where the difference between two adjacent frames exceeds this threshold. Defaults to 0.5 semitone.
+        dur_thres (int): The duration threshold for a single note event. Defaults to 80 ms.
+
+    Returns:
+        np.Array, np.Array: The start indices and the (exclusive) end indices of the note events
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    if len(starts) == 0:
+        return starts, ends
+
+    # a cut before frame i+1 wherever it is not within `f0_change_thres` of frame i
+    cuts = np.flatnonzero(~(np.abs(np.diff(notes)) <= f0_change_thres)) + 1
+    # only the cuts strictly inside a segment start a new note event
+    cut_segments = np.searchsorted(starts, cuts, side="right") - 1
+    inside = (cut_segments >= 0) & (cuts < ends[cut_segments]) & (cuts > starts[cut_segments])
+    event_starts = np.sort(np.concatenate((starts, cuts[inside])))
+    event_segments = np.searchsorted(starts, event_starts, side="right") - 1
+
+    # an event ends where the next one starts, unless it is the last event of its segment
+    is_last = np.ones(len(event_starts), dtype=bool)
+    is_last[:-1] = event_segments[1:] != event_segments[:-1]
+    event_ends = np.empty_like(event_starts)
+    event_ends[:-1] = event_starts[1:]
+    event_ends[is_last] = ends[event_segments[is_last]]
+
+    event_lens = event_ends - event_starts
+    dur_thres_fr = ms_to_frames(dur_thres)
+    # the frame-by-frame version never closes a one-frame event at the end of a segment, keep that behaviour
+    keep = (event_lens >= dur_thres_fr) & ~(is_last & (event_lens == 1))
+    return event_starts[keep], event_ends[keep]
 
 
 # functions for picking BEND/RELEASE candidates
@@ -172,20 +422,11 @@ def count_consecutive_rise(diff):
     Returns:
         int: How long is the longest rising trend.
     """
-    cnt = 0
-    max_cnt = 0
-    for element in diff:
-        # use >= here will count both RISE and FLAT
-        # a mostly flat note (no bend/release) will also be considered as candidate
-        # this should be filtered out by using the difference between the max and min freq
-        if element >= 0:
-            cnt += 1
-        elif cnt > 0:
-            max_cnt = max(max_cnt, cnt)
-            cnt = 0
-    if cnt > 0:
-        max_cnt = max(max_cnt, cnt)
-    return max_cnt
+    diff = np.asarray(diff)
+    # use >= here will count both RISE and FLAT
+    # a mostly flat note (no bend/release) will also be considered as candidate
+    # this should be filtered out by using the difference between the max and min freq
+    return int(_longest_true_runs(diff >= 0, np.zeros(len(diff), dtype=np.int64), 1)[0])
 
 
 def count_consecutive_drop(diff):
@@ -197,20 +438,11 @@ def count_consecutive_drop(diff):
     Returns:
         int: How long is the longest dropping trend.
     """
-    cnt = 0
-    max_cnt = 0
-    for element in diff:
-        # use >= here will count both DROP and FLAT
-        # a mostly flat note (no bend/release) will also be considered as candidate
-        # this should be filtered out by using the difference between the max and min freq
-        if element <= 0:
-            cnt += 1
-        elif cnt > 0:
-            max_cnt = max(max_cnt, cnt)
-            cnt = 0
-    if cnt > 0:
-        max_cnt = max(max_cnt, cnt)
-    return max_cnt
+    diff = np.asarray(diff)
+    # use <= here will count both DROP and FLAT
+    # a mostly flat note (no bend/release) will also be considered as candidate
+    # this should be filtered out by using the difference between the max and min freq
+    return int(_longest_true_runs(diff <= 0, np.zeros(len(diff), dtype=np.int64), 1)[0])
 
 
 def is_bend_candidate(notes, dur_thres=80):
@@ -228,9 +460,7 @@ def is_bend_candidate(notes, dur_thres=80):
     """
     diff = np.diff(notes, 1)
     # the freq should RISE monotonically for dur_thres ms
-    dur_thres_fr = librosa.time_to_frames(
-        dur_thres / 1000, sr=44100, hop_length=512, n_fft=2048
-    )
+    dur_thres_fr = ms_to_frames(dur_thres)
     condition1 = count_consecutive_rise(diff) >= dur_thres_fr
     # the freq difference between two consectutive frames should be smaller than one semitone
     # this is probably always true. if two adjacent frames differ more than 1 semitone,
@@ -259,9 +489,7 @@ def is_release_candidate(notes, dur_thres=80):
     """
     diff = np.diff(notes, 1)
     # the freq should DROP monotonically for dur_thres ms
-    dur_thres_fr = librosa.time_to_frames(
-        dur_thres / 1000, sr=44100, hop_length=512, n_fft=2048
-    )
+    dur_thres_fr = ms_to_frames(dur_thres)
     condition1 = count_consecutive_drop(diff) >= dur_thres_fr
     # the freq difference between two consectutive frames should be smaller than one semitone
     condition2 = np.all(abs(diff) <= 1)
@@ -289,18 +517,16 @@ def is_vibrato_candidate(
     Returns:
         bool: True for vibrato, False for not vibrato
     """
+    from scipy.signal import find_peaks
+
     # find local maxima in the pitch curve of the note event
     peak_indices, _ = find_peaks(notes)
     condition1 = len(peak_indices) >= peak_count
     # get the distance (in frames) between adjacent peaks
     peak_dists = np.diff(peak_indices, 1)
     # convert distance thresholds from time to frame
-    peak_dist_min_fr = librosa.time_to_frames(
-        peak_dist_min / 1000, sr=44100, hop_length=512, n_fft=2048
-    )
-    peak_dist_max_fr = librosa.time_to_frames(
-        peak_dist_max / 1000, sr=44100, hop_length=512, n_fft=2048
-    )
+    peak_dist_min_fr = ms_to_frames(peak_dist_min)
+    peak_dist_max_fr = ms_to_frames(peak_dist_max)
     # True if any two adjacent peaks satisfy the distance threshold
     condition2 = (
         np.logical_and(
@@ -320,3 +546,130 @@ def is_vibrato_candidate(
     else:
         return False
 
+
+# batched candidate detection over all note events of a file
+def gather_note_events(notes, starts, ends):
+    """Gather the F0 of many note events into one flat array with offsets.
+
+    Args:
+        notes (np.Array): The F0 sequence (converted to MIDI notes) of a file
+        starts (np.Array): The start indices of the note events, e.g., from `get_note_event_bounds`
+        ends (np.Array): The (exclusive) end indices of the note events
+
+    Returns:
+        np.Array, np.Array: The concatenated F0 of all note events, and the offsets,
+        i.e., note event k is `values[offsets[k] : offsets[k + 1]]`
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    lens = np.asarray(ends, dtype=np.int64) - starts
+    offsets = np.concatenate(([0], np.cumsum(lens)))
+    indices = np.repeat(starts - offsets[:-1], lens) + np.arange(offsets[-1])
+    return notes[indices], offsets
+
+
+def _longest_true_runs(mask, run_events, n_events):
+    """The length of the longest run of True in `mask`, for each event. `mask` must be False between events."""
+    edges = np.diff(np.concatenate(([0], mask, [0])).astype(np.int8))
+    run_starts = np.flatnonzero(edges == 1)
+    run_ends = np.flatnonzero(edges == -1)
+    longest = np.zeros(n_events, dtype=np.int64)
+    np.maximum.at(longest, run_events[run_starts], run_ends - run_starts)
+    return longest
+
+
+def detect_candidates(
+    values,
+    offsets,
+    dur_thres=80,
+    peak_count=2,
+    peak_dist_min=60,
+    peak_dist_max=800,
+    pitch_diff=1,
+):
+    """Batched version of `is_bend_candidate`, `is_release_candidate` and `is_vibrato_candidate`.
+
+    All note events of a file are checked at once with run-length encoding over the flat F0 array,
+    and the frame thresholds are computed once. The results are the same as calling the three functions
+    on every note event.
+
+    Args:
+        values (np.Array): The concatenated F0 of all note events, obtained from `gather_note_events`
+        offsets (np.Array): The offsets of the note events. Every note event must have at least one frame.
+        dur_thres (int, optional): See `is_bend_candidate`. Defaults to 80 ms.
+        peak_count (int, optional): See `is_vibrato_candidate`. Defaults to 2.
+        peak_dist_min (int, optional): See `is_vibrato_candidate`. Defaults to 60 ms.
+        peak_dist_max (int, optional): See `is_vibrato_candidate`. Defaults to 800 ms.
+        pitch_diff (float, optional): See `is_vibrato_candidate`. Defaults to 1.
+
+    Returns:
+        dict: Boolean arrays of shape (n_events,) under the keys "bend", "release" and "vibrato"
+    """
+    values = np.asarray(values, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n_events = len(offsets) - 1
+    if n_events == 0:
+        empty = np.zeros(0, dtype=bool)
+        return {"bend": empty, "release": empty.copy(), "vibrato": empty.copy()}
+    lens = np.diff(offsets)
+    frame_events = np.repeat(np.arange(n_events), lens)
+
+    # diff[j] = values[j + 1] - values[j] belongs to an event unless j is the last frame of that event
+    diff = np.diff(values)
+    in_event = np.ones(len(diff), dtype=bool)
+    last_frames = offsets[1:-1] - 1
+    in_event[last_frames[last_frames >= 0]] = False
+    diff_events = frame_events[:-1]
+
+    # BEND / RELEASE
+    dur_thres_fr = ms_to_frames(dur_thres)
+    longest_rise = _longest_true_runs((diff >= 0) & in_event, diff_events, n_events)
+    longest_drop = _longest_true_runs((diff <= 0) & in_event, diff_events, n_events)
+    # the freq difference between two consectutive frames should be smaller than one semitone
+    large_steps = ~(np.abs(diff) <= 1) & in_event
+    small_steps = np.bincount(diff_events[large_steps], minlength=n_events) == 0
+    # the difference between the max and min freq should be more than half a semitone
+    event_max = np.maximum.reduceat(values, offsets[:-1])
+    event_min = np.minimum.reduceat(values, offsets[:-1])
+    wide_range = event_max - event_min >= 0.5
+    bend = (longest_rise >= dur_thres_fr) & small_steps & wide_range
+    release = (longest_drop >= dur_thres_fr) & small_steps & wide_range
+
+    # VIBRATO
+    # local maxima as in `scipy.signal.find_peaks`: a run of equal values (a plateau) is a peak if the runs
+    # before and after it in the same event are lower, and the peak index is the middle of the plateau
+    new_run = np.ones(len(values), dtype=bool)
+    new_run[1:] = (values[1:] != values[:-1]) | (frame_events[1:] != frame_events[:-1])
+    run_starts = np.flatnonzero(new_run)
+    run_ends = np.append(run_starts[1:], len(values))
+    run_values = values[run_starts]
+    run_events = frame_events[run_starts]
+    has_prev = np.zeros(len(run_starts), dtype=bool)
+    has_prev[1:] = run_events[1:] == run_events[:-1]
+    has_next = np.zeros(len(run_starts), dtype=bool)
+    has_next[:-1] = run_events[:-1] == run_events[1:]
+    higher_than_prev = np.zeros(len(run_starts), dtype=bool)
+    higher_than_prev[1:] = run_values[:-1] < run_values[1:]
+    higher_than_next = np.zeros(len(run_starts), dtype=bool)
+    higher_than_next[:-1] = run_values[1:] < run_values[:-1]
+    is_peak = has_prev & has_next & higher_than_prev & higher_than_next
+    peaks = (run_starts[is_peak] + run_ends[is_peak] - 1) // 2
+    peak_events = run_events[is_peak]
+
+    condition1 = np.bincount(peak_events, minlength=n_events) >= peak_count
+    # True if any two adjacent peaks satisfy the distance threshold
+    peak_dists = np.diff(peaks)
+    same_event = peak_events[1:] == peak_events[:-1]
+    good_dists = (
+        same_event
+        & (peak_dists >= ms_to_frames(peak_dist_min))
+        & (peak_dists <= ms_to_frames(peak_dist_max))
+    )
+    condition2 = np.bincount(peak_events[1:][good_dists], minlength=n_events) > 0
+    # True if the highest peak does not exceed the average too much
+    highest_peak = np.full(n_events, -np.inf)
+    np.maximum.at(highest_peak, peak_events, values[peaks])
+    event_mean = np.add.reduceat(values, offsets[:-1]) / lens
+    condition3 = highest_peak - event_mean <= pitch_diff
+    vibrato = condition1 & condition2 & condition3
+
+    return {"bend": bend, "release": release, "vibrato": vibrato}
@@ -0,0 +1,215 @@
+"""On-disk cache for pYIN F0 estimates
+
+pYIN is by far the most expensive step of the F0 analysis, and the same files are analyzed again and again
+with the same settings. `cached_pyin` stores f0, voiced flags and voiced probabilities of each
+(audio content, sr, fmin, fmax, frame length, hop length, center) combination as one .npz file.
+The cache is bounded in size; the least recently used entries are evicted first.
+
+The location and size limit come from `config` (GP_F0_CACHE_DIR and GP_F0_CACHE_MAX_BYTES).
+"""
+import hashlib
+import os
+import time
+import zipfile
+
+import numpy as np
+
+from config import config
+from hashing import file_hash
+from metrics import metrics
+
+# rescan the cache at least every EVICT_EVERY saves of a process, to see the entries of the other processes
+EVICT_EVERY = 100
+# a temporary file older than this is left behind by a killed worker
+STALE_TMP_SECONDS = 3600
+
+# cache directory -> [estimated size in bytes, saves since the last scan], see `save_entry`
+_cache_sizes = {}
+
+
+def cache_key(path, sr, fmin, fmax, frame_length, hop_length, center):
+    """The cache key of one audio file analyzed with one set of pYIN parameters"""
+    params = f"{file_hash(path)}|{sr}|{fmin!r}|{fmax!r}|{frame_length}|{hop_length}|{center}"
+    return hashlib.sha1(params.encode()).hexdigest()
+
+
+def load_entry(key, cache_dir=None):
+    """Load a cache entry
+
+    Args:
+        key (str): The cache key, obtained from `cache_key`
+        cache_dir (str, optional): The cache directory. Defaults to None (`config.f0_cache_dir`).
+
+    Returns:
+        tuple: (f0, voiced_flag, voiced_prob, sr), or None if there is no such entry
+    """
+    path = os.path.join(cache_dir or config.f0_cache_dir, key + ".npz")
+    try:
+        with np.load(path) as entry:
+            result = (
+                entry["f0"],
+                entry["voiced_flag"],
+                entry["voiced_prob"],
+                int(entry["sr"]),
+            )
+    except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile):
+        # a missing entry, or a broken one (e.g., truncated)
+        return None
+    # the modification time is the "last used" time for the LRU eviction
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        # another worker evicted it in the meantime
+        pass
+    return result
+
+
+def save_entry(key, f0, voiced_flag, voiced_prob, sr, cache_dir=None, max_bytes=None):
+    """Store a cache entry, then evict the least recently used entries if the cache is too large
+
+    The size of the cache is estimated from the entries saved by this process, and only scanned
+    when the estimate passes the limit, or every EVICT_EVERY saves.
+
+    f0 is kept as float64 so that a cache hit gives exactly the same notes as a fresh pYIN run,
+    the voiced probabilities are stored as float32.
+
+    Args:
+        key (str): The cache key, obtained from `cache_key`
+        f0, voiced_flag, voiced_prob: The outputs of `librosa.pyin`
+        sr (int): The sampling rate of the analyzed audio
+        cache_dir (str, optional): The cache directory. Defaults to None (`config.f0_cache_dir`).
+        max_bytes (int, optional): The size limit of the cache. Defaults to None (`config.f0_cache_max_bytes`).
+    """
+    cache_dir = cache_dir or config.f0_cache_dir
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, key + ".npz")
+    # write to a temporary file first, so that concurrent workers never read a half-written entry
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as outfile:
+        np.savez_compressed(
+            outfile,
+            f0=np.asarray(f0, dtype=np.float64),
+            voiced_flag=np.asarray(voiced_flag, dtype=bool),
+            voiced_prob=np.asarray(voiced_prob, dtype=np.float32),
+            sr=np.int64(sr),
+        )
+    size = os.path.getsize(tmp_path)
+    os.replace(tmp_path, path)
+    if max_bytes is None:
+        max_bytes = config.f0_cache_max_bytes
+    estimate = _cache_sizes.get(cache_dir)
+    if estimate is None:
+        _cache_sizes[cache_dir] = [evict(cache_dir, max_bytes), 0]
+        return
+    estimate[0] += size
+    estimate[1] += 1
+    if estimate[0] > max_bytes or estimate[1] >= EVICT_EVERY:
+        _cache_sizes[cache_dir] = [evict(cache_dir, max_bytes), 0]
+
+
+def evict(cache_dir=None, max_bytes=None):
+    """Delete the least recently used entries until the cache is at most `max_bytes`
+
+    The temporary files left behind by killed workers are deleted too.
+
+    Returns:
+        int: The size of the cache after the eviction, in bytes
+    """
+    cache_dir = cache_dir or config.f0_cache_dir
+    if max_bytes is None:
+        max_bytes = config.f0_cache_max_bytes
+    entries = []
+    total = 0
+    now = time.time()
+    for entry in os.scandir(cache_dir):
+        if not entry.name.endswith((".npz", ".tmp")):
+            continue
+        try:
+            stat = entry.stat()
+            if entry.name.endswith(".tmp"):
+                # an entry being written by a live worker is only counted
+                if now - stat.st_mtime > STALE_TMP_SECONDS:
+                    os.remove(entry.path)
+                else:
+                    total += stat.st_size
+                continue
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total += stat.st_size
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # another worker evicted it first
+            pass
+        total -= size
+    return total
+
+
+def clear(cache_dir=None):
+    """Delete every entry of the cache"""
+    evict(cache_dir, max_bytes=0)
+
+
+def cached_pyin(
+    path,
+    fmin,
+    fmax,
+    sr=None,
+    frame_length=2048,
+    hop_length=512,
+    center=True,
+    use_cache=True,
+    refresh=False,
+    cache_dir=None,
+    max_bytes=None,
+):
+    """Load an audio file and run `librosa.pyin` on it, going through the cache
+
+    Args:
+        path (str): The path to the audio file
+        fmin (float): The minimum frequency in Hz
+        fmax (float): The maximum frequency in Hz
+        sr (int, optional): Resample to this rate, as in `librosa.load`. Defaults to None (native rate).
+        frame_length (int, optional): The pYIN frame length. Defaults to 2048.
+        hop_length (int, optional): The pYIN hop length. Defaults to 512.
+        center (bool, optional): The pYIN `center` option. Defaults to True.
+        use_cache (bool, optional): Set to False to bypass the cache completely. Defaults to True.
+        refresh (bool, optional): Recompute and overwrite the cache entry. Defaults to False.
+        cache_dir (str, optional): The cache directory. Defaults to None (`config.f0_cache_dir`).
+        max_bytes (int, optional): The size limit of the cache. Defaults to None (`config.f0_cache_max_bytes`).
+
+    Returns:
+        tuple: (f0, voiced_flag, voiced_prob, sr)
+    """
+    import librosa
+
+    key = None
+    if use_cache:
+        key = cache_key(path, sr, fmin, fmax, frame_length, hop_length, center)
+        if not refresh:
+            entry = load_entry(key, cache_dir)
+            if entry is not None:
+                metrics.count("f0_cache_hits")
+                return entry
+            metrics.count("f0_cache_misses")
+
+    with metrics.timer("audio_load"):
+        y, sr = librosa.load(path, sr=sr)
+    with metrics.timer("pyin"):
+        f0, voiced_flag, voiced_prob = librosa.pyin(
+            y,
+            fmin=fmin,
+            fmax=fmax,
+            sr=sr,
+            frame_length=frame_length,
+            hop_length=hop_length,
+            center=center,
+        )
+    metrics.count("frames_analyzed", len(f0))
+    if use_cache:
+        save_entry(key, f0, voiced_flag, voiced_prob, sr, cache_dir, max_bytes)
+    return f0, voiced_flag, voiced_prob, sr
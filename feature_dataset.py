@@ -0,0 +1,314 @@
+"""A sharded on-disk dataset of note features, with memory-mapped column groups
+
+`pt_classifier_eval.ipynb` loads the whole feature matrix and slices the MFCC, pitch and timbre
+columns out of it by hand (`separate_features`). Here the rows are written in shards, and each
+shard stores every column group (see `note_features.FEATURE_GROUPS`) in its own .npy file, so an
+experiment on one group only reads (memory-maps) the files of that group:
+
+    DATASET_DIR/
+        schema.json                 the columns, the groups, and the shards with their row counts
+        shard_00000.mfcc.npy        (rows, 360)
+        shard_00000.pitch.npy       (rows, 18)
+        shard_00000.timbre.npy      (rows, 108)
+        shard_00000.labels.npy      (rows,)
+        ...
+
+Writing, e.g., from `note_features.get_annotation_features`:
+
+    with FeatureDatasetWriter(DATASET_DIR) as writer:
+        for y, sr, annotation in ...:
+            X_notes, y_notes, _, _ = get_annotation_features(y, sr, annotation)
+            writer.append(X_notes, y_notes)
+
+Reading:
+
+    dataset = FeatureDataset(DATASET_DIR)
+    X, y = dataset.load(["timbre", "pitch"]), dataset.labels()
+    for X_batch, y_batch in dataset.iter_batches(["mfcc"], batch_size=4096):
+        ...
+
+The columns of `load(groups)` are those of the groups in the given order, each group in its
+`FEATURE_GROUPS` order, i.e., `np.concatenate((X_timbre, X_pitch), axis=1)` in the notebook.
+A matrix of the notebook (features, then the label in the last column) is converted with
+`python feature_dataset.py convert hits_data_notes.npy DATASET_DIR`.
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+
+from note_features import FEATURE_GROUPS, FEATURE_NAMES
+
+VERSION = 1
+SCHEMA_FILE = "schema.json"
+
+
+def _read_schema(path):
+    with open(os.path.join(path, SCHEMA_FILE)) as infile:
+        schema = json.load(infile)
+    if schema.get("version") != VERSION:
+        raise ValueError(f"unsupported feature dataset version {schema.get('version')} in {path}")
+    return schema
+
+
+class FeatureDatasetWriter:
+    """Write rows of features and labels into a feature dataset, shard by shard
+
+    The schema is rewritten after every shard, so the rows written before an interruption stay readable.
+    Appending to an existing dataset adds shards to it; its columns and groups must be the same.
+
+    Args:
+        path (str): The dataset directory, created if it does not exist
+        columns (list, optional): The column names. Defaults to None (`note_features.FEATURE_NAMES`).
+        groups (dict, optional): The column indices of each group, every column in exactly one group.
+            Defaults to None (`note_features.FEATURE_GROUPS`).
+        shard_rows (int, optional): The number of rows per shard. Defaults to 65536.
+        dtype (str, optional): The dtype of the features. Defaults to "float64".
+    """
+
+    def __init__(self, path, columns=None, groups=None, shard_rows=65536, dtype="float64"):
+        columns = list(FEATURE_NAMES if columns is None else columns)
+        groups = {name: [int(i) for i in cols] for name, cols in (FEATURE_GROUPS if groups is None else groups).items()}
+        if sorted(i for cols in groups.values() for i in cols) != list(range(len(columns))):
+            raise ValueError("every column must be in exactly one group")
+        self.path = path
+        self.shard_rows = shard_rows
+        self.group_columns = groups
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(os.path.join(path, SCHEMA_FILE)):
+            self.schema = _read_schema(path)
+            if self.schema["columns"] != columns or self.schema["groups"] != {
+                name: [columns[i] for i in cols] for name, cols in groups.items()
+            }:
+                raise ValueError(f"{path} has other columns or groups")
+        else:
+            self.schema = {
+                "version": VERSION,
+                "columns": columns,
+                "groups": {name: [columns[i] for i in cols] for name, cols in groups.items()},
+                "dtype": np.dtype(dtype).str,
+                "rows": 0,
+                "shards": [],
+            }
+        self.dtype = np.dtype(self.schema["dtype"])
+        self._features = []
+        self._labels = []
+        self._buffered = 0
+
+    def append(self, X, y):
+        """Add rows
+
+        Args:
+            X (np.ndarray): The features, of the shape (n_rows, n_columns)
+            y (np.ndarray): The labels, of the shape (n_rows,)
+        """
+        X = np.asarray(X, dtype=self.dtype)
+        y = np.asarray(y)
+        if X.ndim != 2 or X.shape[1] != len(self.schema["columns"]) or len(X) != len(y):
+            raise ValueError(
+                f"expected features of the shape (n, {len(self.schema['columns'])}) and n labels, "
+                f"got {X.shape} and {y.shape}"
+            )
+        self._features.append(X)
+        self._labels.append(y)
+        self._buffered += len(X)
+        while self._buffered >= self.shard_rows:
+            self._write_shard(self.shard_rows)
+
+    def flush(self):
+        """Write the buffered rows as a (smaller) shard"""
+        if self._buffered:
+            self._write_shard(self._buffered)
+
+    def _write_shard(self, n_rows):
+        X = np.concatenate(self._features)
+        y = np.concatenate(self._labels)
+        self._features = [X[n_rows:]]
+        self._labels = [y[n_rows:]]
+        self._buffered -= n_rows
+        name = f"shard_{len(self.schema['shards']):05d}"
+        arrays = {group: X[:n_rows, cols] for group, cols in self.group_columns.items()}
+        arrays["labels"] = y[:n_rows]
+        for suffix, array in arrays.items():
+            shard_file = os.path.join(self.path, f"{name}.{suffix}.npy")
+            with open(shard_file + ".tmp", "wb") as outfile:
+                np.save(outfile, np.ascontiguousarray(array))
+            os.replace(shard_file + ".tmp", shard_file)
+        self.schema["shards"].append({"name": name, "rows": n_rows})
+        self.schema["rows"] += n_rows
+        self._save_schema()
+
+    def _save_schema(self):
+        schema_file = os.path.join(self.path, SCHEMA_FILE)
+        with open(schema_file + ".tmp", "w") as outfile:
+            json.dump(self.schema, outfile, indent=1)
+        os.replace(schema_file + ".tmp", schema_file)
+
+    def close(self):
+        """Write the remaining rows, and the schema of an empty dataset"""
+        self.flush()
+        self._save_schema()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class FeatureDataset:
+    """Read-only access to a feature dataset written by `FeatureDatasetWriter`
+
+    Args:
+        path (str): The dataset directory
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.schema = _read_schema(path)
+        self.columns = self.schema["columns"]
+        self.groups = self.schema["groups"]
+        self.shards = [shard["name"] for shard in self.schema["shards"]]
+        self.offsets = np.concatenate(([0], np.cumsum([shard["rows"] for shard in self.schema["shards"]])))
+        self.offsets = self.offsets.astype(np.int64)
+        self.dtype = np.dtype(self.schema["dtype"])
+        self._maps = {}
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def _map(self, shard, suffix):
+        # every shard file is memory-mapped once, nothing is read until it is sliced
+        key = (shard, suffix)
+        if key not in self._maps:
+            self._maps[key] = np.load(os.path.join(self.path, f"{shard}.{suffix}.npy"), mmap_mode="r")
+        return self._maps[key]
+
+    def _groups(self, groups):
+        if groups is None:
+            return list(self.groups)
+        if isinstance(groups, str):
+            groups = [groups]
+        unknown = [group for group in groups if group not in self.groups]
+        if unknown:
+            raise KeyError(f"unknown column groups {unknown}, expected some of {list(self.groups)}")
+        return list(groups)
+
+    def column_names(self, groups=None):
+        """The names of the columns of `load(groups)`"""
+        return [column for group in self._groups(groups) for column in self.groups[group]]
+
+    def labels(self):
+        """The labels of all rows"""
+        if not self.shards:
+            return np.empty(0)
+        return np.concatenate([self._map(shard, "labels") for shard in self.shards])
+
+    def _read_rows(self, shard, groups, rows=slice(None)):
+        parts = [self._map(shard, group)[rows] for group in groups]
+        return parts[0] if len(parts) == 1 else np.concatenate(parts, axis=1)
+
+    def load(self, groups=None, rows=None):
+        """Read the columns of some groups into memory
+
+        Args:
+            groups (list, optional): The column groups, in the order of their columns. Defaults to None (all groups).
+            rows (np.ndarray, optional): The indices of the rows to read. Defaults to None (all rows).
+
+        Returns:
+            np.ndarray: The features, of the shape (n_rows, n_columns of the groups)
+        """
+        groups = self._groups(groups)
+        n_columns = sum(len(self.groups[group]) for group in groups)
+        if rows is None:
+            X = np.empty((len(self), n_columns), dtype=self.dtype)
+            for shard, start, end in zip(self.shards, self.offsets[:-1], self.offsets[1:]):
+                column = 0
+                for group in groups:
+                    width = len(self.groups[group])
+                    X[start:end, column : column + width] = self._map(shard, group)
+                    column += width
+            return X
+        rows = np.asarray(rows, dtype=np.int64)
+        X = np.empty((len(rows), n_columns), dtype=self.dtype)
+        row_shards = np.searchsorted(self.offsets, rows, side="right") - 1
+        for k in np.unique(row_shards):
+            selected = np.flatnonzero(row_shards == k)
+            X[selected] = self._read_rows(self.shards[k], groups, rows[selected] - self.offsets[k])
+        return X
+
+    def iter_batches(self, groups=None, batch_size=4096, shuffle=False, seed=None):
+        """Yield (features, labels) batches, reading one shard at a time
+
+        Args:
+            groups (list, optional): The column groups, see `load`. Defaults to None (all groups).
+            batch_size (int, optional): The number of rows per batch (the last batch of a shard can be smaller). Defaults to 4096.
+            shuffle (bool, optional): Visit the shards, and the rows within each shard, in random order. Defaults to False.
+            seed (int, optional): The random seed for `shuffle`. Defaults to None.
+
+        Yields:
+            np.ndarray, np.ndarray: The features (batch_size, n_columns of the groups) and the labels
+        """
+        groups = self._groups(groups)
+        rng = np.random.default_rng(seed)
+        shard_order = rng.permutation(len(self.shards)) if shuffle else range(len(self.shards))
+        for k in shard_order:
+            shard = self.shards[k]
+            n_rows = int(self.offsets[k + 1] - self.offsets[k])
+            if shuffle:
+                order = rng.permutation(n_rows)
+                for start in range(0, n_rows, batch_size):
+                    # sorted indices read the memory map front to back
+                    rows = np.sort(order[start : start + batch_size])
+                    yield self._read_rows(shard, groups, rows), self._map(shard, "labels")[rows]
+            else:
+                for start in range(0, n_rows, batch_size):
+                    rows = slice(start, start + batch_size)
+                    yield self._read_rows(shard, groups, rows), np.asarray(self._map(shard, "labels")[rows])
+
+
+def from_matrix(path, data, shard_rows=65536, **kwargs):
+    """Write a matrix with the label in the last column (as saved by `gt_generation.ipynb`) as a feature dataset
+
+    Args:
+        path (str): The dataset directory
+        data (np.ndarray): The matrix, of the shape (n_rows, n_columns + 1)
+        shard_rows (int, optional): The number of rows per shard. Defaults to 65536.
+        **kwargs: Passed on to `FeatureDatasetWriter`
+
+    Returns:
+        FeatureDataset: The written dataset
+    """
+    if os.path.exists(os.path.join(path, SCHEMA_FILE)):
+        raise FileExistsError(f"{path} already holds a feature dataset")
+    with FeatureDatasetWriter(path, shard_rows=shard_rows, **kwargs) as writer:
+        for start in range(0, len(data), shard_rows):
+            block = data[start : start + shard_rows]
+            writer.append(block[:, :-1], block[:, -1])
+    return FeatureDataset(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    convert_parser = subparsers.add_parser("convert", help="convert a .npy matrix with the label in the last column")
+    convert_parser.add_argument("npy_file")
+    convert_parser.add_argument("dataset_dir")
+    convert_parser.add_argument("--shard-rows", type=int, default=65536)
+    info_parser = subparsers.add_parser("info", help="print the size, groups and label counts of a dataset")
+    info_parser.add_argument("dataset_dir")
+    args = parser.parse_args(argv)
+
+    if args.command == "convert":
+        dataset = from_matrix(args.dataset_dir, np.load(args.npy_file, mmap_mode="r"), shard_rows=args.shard_rows)
+    else:
+        dataset = FeatureDataset(args.dataset_dir)
+    labels, counts = np.unique(dataset.labels(), return_counts=True)
+    print(f"{len(dataset)} rows in {len(dataset.shards)} shards")
+    print(", ".join(f"{group}: {len(columns)} columns" for group, columns in dataset.groups.items()))
+    print(", ".join(f"label {label:g}: {count}" for label, count in zip(labels, counts)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+"""Content hashes of input files, shared by the pYIN cache (`f0_cache`) and the batch manifests (`manifest`)"""
+import hashlib
+import os
+
+# (path, size, mtime) -> content hash, so a file is only hashed once per process
+_file_hashes = {}
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """The SHA-1 of the content of a file
+
+    Args:
+        path (str): The path to the file
+        chunk_size (int, optional): Read the file in chunks of this size. Defaults to 1 MB.
+
+    Returns:
+        str: The hex digest
+    """
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _file_hashes:
+        sha1 = hashlib.sha1()
+        with open(path, "rb") as infile:
+            for chunk in iter(lambda: infile.read(chunk_size), b""):
+                sha1.update(chunk)
+        _file_hashes[memo_key] = sha1.hexdigest()
+    return _file_hashes[memo_key]
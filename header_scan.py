@@ -0,0 +1,103 @@
+"""Decide whether a GuitarPro file has guitar tracks, without parsing its measures
+
+`utils.get_guitar_tracks` needs a parsed Song, but the decision only depends on the tracks and
+their MIDI channels, which come before the measures (the bulk of the file) in GP3/4/5 files.
+`read_song_header` runs the pyguitarpro reader of the file's version, but stops before the
+measures, so the header is decoded exactly as by `guitarpro.parse`.
+
+    stage, track_numbers = scan_guitar_tracks(file)
+    if stage != ACCEPTED:
+        ...  # skip the file
+"""
+import struct
+
+from guitarpro.gp3 import GP3File
+from guitarpro.gp4 import GP4File
+from guitarpro.gp5 import GP5File
+from guitarpro.io import getVersionAndGPFile
+from guitarpro.iobase import GPFileBase
+from guitarpro.models import GPException
+
+from utils import get_guitar_tracks
+
+# the outcomes of `scan_guitar_tracks`, in the order of the checks
+VERSION = "version"  # not a GuitarPro file, or an unsupported version
+HEADER = "header"  # the song header or the track list can not be read
+NO_GUITAR = "no_guitar"  # no 6-string guitar track
+ACCEPTED = "accepted"
+
+
+def _skip_measures(self, song):
+    # the last step of `readSong`, left out
+    pass
+
+
+_HEADER_READERS = {
+    gp_file: type(f"{gp_file.__name__}HeaderReader", (gp_file,), {"readMeasures": _skip_measures})
+    for gp_file in (GP3File, GP4File, GP5File)
+}
+
+
+def read_song_header(file, encoding="cp1252"):
+    """Read a GuitarPro file up to (not including) the measures
+
+    Args:
+        file (str): The path to the GuitarPro file
+        encoding (str, optional): The encoding of the strings, as in `guitarpro.parse`. Defaults to "cp1252".
+
+    Returns:
+        Song: A pyguitarpro Song object with the metadata, measure headers and tracks, but no measures
+    """
+    with open(file, "rb") as stream:
+        # the same steps as `guitarpro.io._open`
+        version_string = GPFileBase(stream, encoding).readVersion()
+        version, gp_file = getVersionAndGPFile(version_string)
+        reader = _HEADER_READERS[gp_file](
+            stream, encoding, version=version_string, versionTuple=version
+        )
+        return reader.readSong()
+
+
+def scan_guitar_tracks(file):
+    """Check whether a GuitarPro file has guitar tracks (see `utils.get_guitar_tracks`) from its header
+
+    Args:
+        file (str): The path to the GuitarPro file
+
+    Returns:
+        str, list: The outcome (VERSION, HEADER, NO_GUITAR or ACCEPTED), and the numbers of the guitar tracks
+    """
+    try:
+        with open(file, "rb") as stream:
+            getVersionAndGPFile(GPFileBase(stream, "cp1252").readVersion())
+    except (GPException, UnicodeDecodeError, OSError, struct.error, EOFError):
+        # not a GuitarPro file, or an empty / truncated one
+        return VERSION, []
+    try:
+        song = read_song_header(file)
+    except Exception:
+        # a broken header, `guitarpro.parse` would fail on it too
+        return HEADER, []
+    guitar_tracks = get_guitar_tracks(song)
+    if not guitar_tracks:
+        return NO_GUITAR, []
+    return ACCEPTED, [track.number for track in guitar_tracks]
+
+
+def scan_corpus(files):
+    """Scan many GuitarPro files, see `scan_guitar_tracks`
+
+    Args:
+        files (list): The paths to the GuitarPro files
+
+    Returns:
+        list, dict: The accepted files, and the number of files for each outcome
+    """
+    accepted = []
+    stats = {VERSION: 0, HEADER: 0, NO_GUITAR: 0, ACCEPTED: 0}
+    for file in files:
+        stage, _ = scan_guitar_tracks(file)
+        stats[stage] += 1
+        if stage == ACCEPTED:
+            accepted.append(file)
+    return accepted, stats
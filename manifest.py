@@ -0,0 +1,115 @@
+"""A manifest of processed input files, for incremental batch runs
+
+The manifest is a JSON file that records, for every input file, its size, modification time and
+content hash, and the outputs it produced with the options of the run:
+
+    {
+        "version": 1,
+        "options": {...},
+        "files": {
+            "/path/to/song.gp5": {"size": ..., "mtime_ns": ..., "sha1": ..., "outputs": [...], "annos": [...], "errors": [...]},
+            ...
+        }
+    }
+
+Before a run, `Manifest.plan` picks the new and changed inputs (a file whose size and mtime are
+unchanged is not hashed again), and the removed ones. The outputs of changed and removed inputs are
+deleted. When the options differ from those of the previous run, every input is processed again.
+"""
+import json
+import os
+
+from hashing import file_hash
+
+VERSION = 1
+
+
+class Manifest:
+    """The manifest of one batch step (e.g., split, or annotate)
+
+    Args:
+        path (str): The path of the manifest file, created on `save` if it does not exist
+        options (dict): The options of the run, JSON-serializable
+    """
+
+    def __init__(self, path, options):
+        self.path = path
+        # round-trip the options through JSON, so that they compare equal to the loaded ones
+        self.options = json.loads(json.dumps(options))
+        self.files = {}
+        if os.path.exists(path):
+            with open(path) as infile:
+                manifest = json.load(infile)
+            if manifest.get("version") == VERSION and manifest.get("options") == self.options:
+                self.files = manifest["files"]
+            else:
+                # processed with other options (or an older manifest): keep only the outputs, to delete them,
+                # without the hashes nothing is current
+                self.files = {
+                    file: {"outputs": entry.get("outputs", []), "annos": entry.get("annos", [])}
+                    for file, entry in manifest.get("files", {}).items()
+                }
+
+    def is_current(self, file):
+        """Whether `file` is in the manifest and did not change since"""
+        entry = self.files.get(file)
+        if entry is None or "sha1" not in entry:
+            return False
+        stat = os.stat(file)
+        if entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return True
+        if entry["size"] != stat.st_size or entry["sha1"] != file_hash(file):
+            return False
+        # touched, but the content is the same
+        entry["mtime_ns"] = stat.st_mtime_ns
+        return True
+
+    def plan(self, files):
+        """Split the input files into those to process, and the removed ones
+
+        Args:
+            files (list): The input files of this run
+
+        Returns:
+            list, list: The new or changed files (absolute paths), and the files in the manifest that are gone
+        """
+        files = [os.path.abspath(file) for file in files]
+        present = set(files)
+        todo = [file for file in files if not self.is_current(file)]
+        removed = [file for file in self.files if file not in present]
+        return todo, removed
+
+    def remove_outputs(self, file):
+        """Delete the outputs of one input file and forget it"""
+        entry = self.files.pop(file, None)
+        if entry is None:
+            return
+        for output in entry.get("outputs", []) + entry.get("annos", []):
+            try:
+                os.remove(output)
+            except FileNotFoundError:
+                pass
+
+    def update(self, record):
+        """Record the result of processing one input file, i.e., one record of `batch.run_batch`"""
+        file = os.path.abspath(record["file"])
+        stat = os.stat(file)
+        self.files[file] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha1": file_hash(file),
+            "outputs": record["outputs"],
+            "annos": record["annos"],
+            "errors": record["errors"],
+        }
+
+    def save(self):
+        """Write the manifest, through a temporary file so that an interrupted save keeps the previous one"""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as outfile:
+            json.dump(
+                {"version": VERSION, "options": self.options, "files": self.files},
+                outfile,
+                indent=1,
+            )
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,164 @@
+"""Timers and counters for the processing steps, per process
+
+The steps of `operations` and `f0_cache` are timed with the process-wide `metrics`:
+
+    from metrics import metrics
+
+    with metrics.timer("parse"):
+        song = guitarpro.parse(file)
+    metrics.count("tracks_written")
+
+Every worker process of `batch.run_batch` has its own `metrics`. The timings of each file are sent
+back with its record (see `instrumented`), and summed per worker and for the whole run, which can be
+exported as JSON lines or in the Prometheus text format (`write_metrics`).
+
+The timers in use: "scan" (header scan), "parse" (`guitarpro.parse`), "guitar_tracks"
+(`get_guitar_tracks`), "write" (`guitarpro.write`), "anno_dump" (annotation JSON dump),
+"audio_load" (`librosa.load`), "pyin" (`librosa.pyin`) and "file" (the whole worker call).
+"""
+import cProfile
+import json
+import os
+import time
+from contextlib import contextmanager
+
+
+class Metrics:
+    """Named timers (number of calls, total and longest time in seconds) and counters"""
+
+    def __init__(self):
+        self.timers = {}
+        self.counters = {}
+
+    @contextmanager
+    def timer(self, name):
+        """Time the body of a `with` block under `name`"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds, calls=1):
+        timer = self.timers.setdefault(name, {"calls": 0, "seconds": 0.0, "max": 0.0})
+        timer["calls"] += calls
+        timer["seconds"] += seconds
+        timer["max"] = max(timer["max"], seconds)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self):
+        """The timers and counters as a JSON-serializable dict"""
+        return {
+            "timers": {name: dict(timer) for name, timer in self.timers.items()},
+            "counters": dict(self.counters),
+        }
+
+    def merge(self, snapshot):
+        """Add the timers and counters of a snapshot (of another process, or of one file)"""
+        for name, timer in snapshot["timers"].items():
+            total = self.timers.setdefault(name, {"calls": 0, "seconds": 0.0, "max": 0.0})
+            total["calls"] += timer["calls"]
+            total["seconds"] += timer["seconds"]
+            total["max"] = max(total["max"], timer["max"])
+        for name, value in snapshot["counters"].items():
+            self.count(name, value)
+
+    def reset(self):
+        self.timers.clear()
+        self.counters.clear()
+
+
+# the metrics of this process
+metrics = Metrics()
+
+
+def instrumented(worker, file, profile_dir=None, profile_min_seconds=0.0):
+    """Run a `batch.run_batch` worker on one file and attach the metrics of this call to its record
+
+    The record gets the keys "metrics" (a `Metrics.snapshot` of this file only), "pid" and "seconds".
+    With `profile_dir`, the call runs under cProfile, and the profile is dumped as
+    `{profile_dir}/{file name}.prof` when the file took at least `profile_min_seconds`,
+    so that only the outliers are kept. Load it with `pstats.Stats(path)`.
+
+    Args:
+        worker (callable): A function taking one file and returning a record dict
+        file (str): The input file
+        profile_dir (str, optional): The directory for the profiles. Defaults to None (no profiling).
+        profile_min_seconds (float, optional): Only keep the profiles of slower files. Defaults to 0.0.
+
+    Returns:
+        dict: The record of `worker`
+    """
+    metrics.reset()
+    profile = cProfile.Profile() if profile_dir else None
+    start = time.perf_counter()
+    if profile:
+        record = profile.runcall(worker, file)
+    else:
+        record = worker(file)
+    seconds = time.perf_counter() - start
+    metrics.add_time("file", seconds)
+    if profile and seconds >= profile_min_seconds:
+        name, _ = os.path.splitext(file.split("/")[-1])
+        profile.dump_stats(os.path.join(profile_dir, name + ".prof"))
+    record["metrics"] = metrics.snapshot()
+    record["pid"] = os.getpid()
+    record.setdefault("seconds", round(seconds, 3))
+    return record
+
+
+def to_json_lines(snapshots):
+    """One JSON line per timer and counter
+
+    Args:
+        snapshots (dict): `Metrics.snapshot`s by label (e.g., "total", or a worker pid)
+
+    Returns:
+        str: The JSON lines
+    """
+    lines = []
+    for label, snapshot in snapshots.items():
+        for name, timer in snapshot["timers"].items():
+            lines.append(json.dumps({"worker": str(label), "timer": name, **timer}))
+        for name, value in snapshot["counters"].items():
+            lines.append(json.dumps({"worker": str(label), "counter": name, "value": value}))
+    return "".join(line + "\n" for line in lines)
+
+
+def to_prometheus(snapshots, prefix="gp_"):
+    """The Prometheus text exposition format, with one `worker` label value per snapshot
+
+    Args:
+        snapshots (dict): `Metrics.snapshot`s by label (e.g., "total", or a worker pid)
+        prefix (str, optional): The prefix of the metric names. Defaults to "gp_".
+
+    Returns:
+        str: The metrics text
+    """
+    families = [
+        ("step_calls_total", "counter", "The number of calls of each step", "calls"),
+        ("step_seconds_total", "counter", "The time spent in each step", "seconds"),
+        ("step_seconds_max", "gauge", "The longest call of each step", "max"),
+    ]
+    lines = []
+    for family, kind, help_text, key in families:
+        lines.append(f"# HELP {prefix}{family} {help_text}")
+        lines.append(f"# TYPE {prefix}{family} {kind}")
+        for label, snapshot in snapshots.items():
+            for name, timer in snapshot["timers"].items():
+                lines.append(f'{prefix}{family}{{step="{name}",worker="{label}"}} {timer[key]}')
+    lines.append(f"# HELP {prefix}events_total The number of counted events")
+    lines.append(f"# TYPE {prefix}events_total counter")
+    for label, snapshot in snapshots.items():
+        for name, value in snapshot["counters"].items():
+            lines.append(f'{prefix}events_total{{event="{name}",worker="{label}"}} {value}')
+    return "".join(line + "\n" for line in lines)
+
+
+def write_metrics(path, snapshots):
+    """Write the metrics in the Prometheus text format if `path` ends with ".prom", as JSON lines otherwise"""
+    text = to_prometheus(snapshots) if path.endswith(".prom") else to_json_lines(snapshots)
+    with open(path, "w") as outfile:
+        outfile.write(text)
@@ -0,0 +1,247 @@
+"""Note-level features for the playing technique classifier, one STFT per audio file
+
+The feature layout is that of `extract_features` / `get_all_stats` in `gt_generation.ipynb` and
+`results_and_eval.ipynb`: 27 frame-level features (20 MFCCs, the pYIN pitch, and 6 spectral / timbral
+features), with their first and second order deltas (81 rows), pooled over the frames of a note
+into 6 statistics (486 columns). Column `stat * 81 + order * 27 + feature` holds one statistic
+of one feature, as `separate_features` in `pt_classifier_eval.ipynb` expects; `FEATURE_NAMES`
+and `FEATURE_GROUPS` name them.
+
+The notebooks compute the features on the whole file, then slice and pool them note by note.
+Here the magnitude spectrogram is computed once and shared by the mel / MFCC, spectral and onset
+strength features, and the statistics of all notes are computed together (`pool_stats`):
+
+    y, sr = librosa.load(audio_file, sr=None)
+    X_notes, y_notes, X_trans, y_trans = get_annotation_features(y, sr, annotation)
+"""
+import numpy as np
+
+from metrics import metrics
+
+N_MFCC = 20
+TIMBRE_FEATURES = ["centroid", "bandwidth", "flatness", "rolloff", "zero_crossing", "flux"]
+BASE_FEATURES = [f"mfcc_{i}" for i in range(N_MFCC)] + ["pitch"] + TIMBRE_FEATURES
+ORDERS = ["", "delta", "accel"]
+STATS = ["mean", "std", "max", "min", "skew", "kurtosis"]
+
+N_BASE = len(BASE_FEATURES)  # 27
+N_ROWS = N_BASE * len(ORDERS)  # 81, the frame-level features
+N_FEATURES = N_ROWS * len(STATS)  # 486, the note-level features
+
+# the name of every column, e.g., "mfcc_3_delta_std"
+FEATURE_NAMES = [
+    "_".join(part for part in (feature, order, stat) if part)
+    for stat in STATS
+    for order in ORDERS
+    for feature in BASE_FEATURES
+]
+
+
+def _group_columns(first, count):
+    # the columns of `count` base features from `first` on, in every order and statistic
+    return [
+        stat * N_ROWS + order * N_BASE + feature
+        for stat in range(len(STATS))
+        for order in range(len(ORDERS))
+        for feature in range(first, first + count)
+    ]
+
+
+# the column groups of the feature ablations in `pt_classifier_eval.ipynb`, in the same column order
+FEATURE_GROUPS = {
+    "mfcc": _group_columns(0, N_MFCC),
+    "pitch": _group_columns(N_MFCC, 1),
+    "timbre": _group_columns(N_MFCC + 1, len(TIMBRE_FEATURES)),
+}
+
+# the note / transition labels of `gt_generation.ipynb`
+NORMAL = 0
+BEND = 1
+VIBRATO = 2
+HAMMER_ON = 3
+PULL_OFF = 4
+SLIDE = 5
+
+
+def extract_frame_features(y, sr, frame_size=2048, hop_size=512, pitch=None):
+    """The 81 frame-level features of a whole audio file
+
+    The same features as `extract_features(y, sr, frame_size, hop_size)` in `gt_generation.ipynb`,
+    but the STFT is computed once, instead of once by each of the MFCC, spectral and onset strength functions.
+
+    Args:
+        y (np.ndarray): The audio signal
+        sr (int): The sampling rate
+        frame_size (int, optional): The FFT size. Defaults to 2048.
+        hop_size (int, optional): The hop size. Defaults to 512.
+        pitch (np.ndarray, optional): The pYIN F0 (with `fill_na=None`) of the same frames, if it is
+            already known. Defaults to None (computed here).
+
+    Returns:
+        np.ndarray: The features, of the shape (81, n_frames), in the order of BASE_FEATURES and ORDERS
+    """
+    import librosa
+
+    with metrics.timer("stft"):
+        magnitude = np.abs(librosa.stft(y, n_fft=frame_size, hop_length=hop_size))
+    with metrics.timer("spectral_features"):
+        power = magnitude**2
+        log_mel = librosa.power_to_db(librosa.feature.melspectrogram(S=power, sr=sr))
+        mfcc = librosa.feature.mfcc(S=log_mel, n_mfcc=N_MFCC)
+        centroid = librosa.feature.spectral_centroid(S=magnitude, sr=sr, n_fft=frame_size)[0]
+        bandwidth = librosa.feature.spectral_bandwidth(S=magnitude, sr=sr, n_fft=frame_size)[0]
+        flatness = librosa.feature.spectral_flatness(S=magnitude)[0]
+        rolloff = librosa.feature.spectral_rolloff(S=magnitude, sr=sr, n_fft=frame_size)[0]
+        zero_crossing = librosa.feature.zero_crossing_rate(y, frame_length=frame_size, hop_length=hop_size)[0]
+        flux = librosa.onset.onset_strength(S=log_mel, sr=sr)
+    if pitch is None:
+        with metrics.timer("pyin"):
+            pitch, _, _ = librosa.pyin(
+                y,
+                fmin=librosa.note_to_hz("C2"),
+                fmax=librosa.note_to_hz("G6"),
+                sr=sr,
+                frame_length=frame_size,
+                hop_length=hop_size,
+                fill_na=None,
+            )
+    features = np.vstack((mfcc, pitch, centroid, bandwidth, flatness, rolloff, zero_crossing, flux))
+    features_delta = librosa.feature.delta(features, order=1)
+    features_accel = librosa.feature.delta(features, order=2)
+    return np.concatenate((features, features_delta, features_accel), axis=0)
+
+
+def pool_stats(features, starts, ends):
+    """The 6 statistics of every frame range, in one vectorized pass
+
+    Row k is `get_all_stats(features[:, starts[k] : ends[k]])` of `results_and_eval.ipynb`:
+    mean, std, max, min, skewness and kurtosis (biased, Fisher) of every feature, concatenated.
+    The central moments are computed around the mean of each range, as in scipy. Like scipy 1.8
+    (the pinned version), a constant feature has a skewness of 0 and a kurtosis of -3.
+
+    Args:
+        features (np.ndarray): The frame-level features, of the shape (n_rows, n_frames)
+        starts (np.ndarray): The first frame of each range
+        ends (np.ndarray): The (exclusive) end frame of each range, every range must have at least one frame
+
+    Returns:
+        np.ndarray: The statistics, of the shape (n_ranges, 6 * n_rows)
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    lens = np.asarray(ends, dtype=np.int64) - starts
+    n_rows = features.shape[0]
+    if len(starts) == 0:
+        return np.zeros((0, len(STATS) * n_rows))
+    if np.any(lens < 1):
+        raise ValueError("every frame range must have at least one frame")
+    # the frames of all ranges, one after the other (the ranges may overlap)
+    offsets = np.concatenate(([0], np.cumsum(lens)))
+    frames = np.repeat(starts - offsets[:-1], lens) + np.arange(offsets[-1])
+    values = features[:, frames].astype(np.float64)
+    bounds = offsets[:-1]
+
+    mean = np.add.reduceat(values, bounds, axis=1) / lens
+    centered = values - np.repeat(mean, lens, axis=1)
+    squared = centered**2
+    m2 = np.add.reduceat(squared, bounds, axis=1) / lens
+    m3 = np.add.reduceat(squared * centered, bounds, axis=1) / lens
+    m4 = np.add.reduceat(squared**2, bounds, axis=1) / lens
+    with np.errstate(all="ignore"):
+        zero = m2 <= (np.finfo(m2.dtype).resolution * mean) ** 2
+        skew = np.where(zero, 0, m3 / m2**1.5)
+        kurtosis = np.where(zero, 0, m4 / m2**2) - 3
+    stats = (
+        mean,
+        np.sqrt(m2),
+        np.maximum.reduceat(values, bounds, axis=1),
+        np.minimum.reduceat(values, bounds, axis=1),
+        skew,
+        kurtosis,
+    )
+    return np.concatenate(stats, axis=0).T
+
+
+def time_to_frames(times, sr, hop_size):
+    """`librosa.time_to_frames` for an array of times: the sample is truncated, then floor-divided"""
+    return (np.asarray(times, dtype=np.float64) * sr).astype(np.int64) // hop_size
+
+
+def get_annotation_frames(annotation, sr, hop_size, n_frames, tran_frames=2, max_gap=0.05):
+    """The frame ranges and labels of the notes and transitions of one annotation, as in `gt_generation.ipynb`
+
+    A note covers the frames `onset_fr` to `offset_fr` (inclusive), and is left out when `offset_fr - onset_fr < 1`.
+    A transition covers `tran_frames` frames on each side of `offset_fr`, and is only kept for a note that is
+    kept, is not the last one, and is followed by the next note within `max_gap` seconds.
+
+    Args:
+        annotation (list or np.ndarray): The note-infos of a track, or its note table (see `note_table`)
+        sr (int): The sampling rate
+        hop_size (int): The hop size
+        n_frames (int): The number of frames of the features, the ranges are clipped to it
+        tran_frames (int, optional): See above. Defaults to 2.
+        max_gap (float, optional): See above. Defaults to 0.05.
+
+    Returns:
+        dict: "note_starts", "note_ends", "note_labels", "tran_starts", "tran_ends" and "tran_labels" arrays
+    """
+    from f0_analysis_utils import get_note_arrays
+
+    notes = get_note_arrays(annotation)
+    onsets = notes["start"]
+    offsets = onsets + notes["dur"]
+    onset_fr = time_to_frames(onsets, sr, hop_size)
+    offset_fr = time_to_frames(offsets, sr, hop_size)
+    kept = offset_fr - onset_fr >= 1
+
+    note_labels = np.where(notes["vibrato"], VIBRATO, np.where(notes["bend"], BEND, NORMAL))
+
+    # transitions to the next note
+    has_next = np.zeros(len(onsets), dtype=bool)
+    has_next[:-1] = onsets[1:] - offsets[:-1] <= max_gap
+    has_tran = kept & has_next
+    next_pitch = np.append(notes["pitch"][1:], np.nan)
+    hammer_label = np.where(
+        notes["pitch"] < next_pitch, HAMMER_ON, np.where(notes["pitch"] > next_pitch, PULL_OFF, NORMAL)
+    )
+    tran_labels = np.where(notes["hammer"], hammer_label, np.where(notes["slide"], SLIDE, NORMAL))
+
+    # slicing clips the ranges to the frames
+    note_starts = np.minimum(onset_fr, n_frames)
+    note_ends = np.minimum(offset_fr + 1, n_frames)
+    tran_starts = np.clip(offset_fr - tran_frames, 0, n_frames)
+    tran_ends = np.clip(offset_fr + tran_frames + 1, 0, n_frames)
+    # a note (or transition) entirely after the end of the audio has no frame to pool
+    kept &= note_ends > note_starts
+    has_tran &= tran_ends > tran_starts
+    return {
+        "note_starts": note_starts[kept],
+        "note_ends": note_ends[kept],
+        "note_labels": note_labels[kept],
+        "tran_starts": tran_starts[has_tran],
+        "tran_ends": tran_ends[has_tran],
+        "tran_labels": tran_labels[has_tran],
+    }
+
+
+def get_annotation_features(y, sr, annotation, frame_size=2048, hop_size=512, features=None):
+    """The note and transition features and labels of one audio file, for training the classifier
+
+    Args:
+        y (np.ndarray): The audio signal
+        sr (int): The sampling rate
+        annotation (list or np.ndarray): The note-infos of the track, or its note table
+        frame_size (int, optional): The FFT size. Defaults to 2048.
+        hop_size (int, optional): The hop size. Defaults to 512.
+        features (np.ndarray, optional): The frame-level features, if they are already computed. Defaults to None.
+
+    Returns:
+        np.ndarray, np.ndarray, np.ndarray, np.ndarray: The note features (n_notes, 486), the note labels,
+        the transition features (n_transitions, 486) and the transition labels
+    """
+    if features is None:
+        features = extract_frame_features(y, sr, frame_size=frame_size, hop_size=hop_size)
+    frames = get_annotation_frames(annotation, sr, hop_size, features.shape[1])
+    with metrics.timer("pool_stats"):
+        X_notes = pool_stats(features, frames["note_starts"], frames["note_ends"])
+        X_trans = pool_stats(features, frames["tran_starts"], frames["tran_ends"])
+    return X_notes, frames["note_labels"], X_trans, frames["tran_labels"]
@@ -0,0 +1,244 @@
+"""A compact columnar representation of the note-level annotation
+
+Instead of one nested dict per note (see `utils.get_note_info`), the notes of a track are kept in
+one NumPy structured array with the columns in `NOTE_DTYPE`. The effects are packed in a bitmask,
+so notes can be selected with vectorized masks, e.g.
+
+    notes, offsets = get_note_table(track, song.tempo)
+    bends = notes[notes["effects"] & EFFECT_BITS["bend"] != 0]
+
+`note_table_to_annos` converts a table back to the JSON schema written by `operations.gen_anno`.
+"""
+import numpy as np
+from guitarpro.models import BendType, GraceEffectTransition, NoteType, SlideType
+
+from tempo_map import as_tempo_map
+from utils import iter_mono_beat_segments
+
+# the order follows `utils.get_effect_info`
+EFFECTS = ["hammer", "mute", "vibrato", "harmonic", "slide", "bend", "grace"]
+EFFECT_BITS = {effect: 1 << i for i, effect in enumerate(EFFECTS)}
+
+NOTE_DTYPE = np.dtype(
+    [
+        ("segment", np.int32),  # index of the mono segment the note belongs to
+        ("start", np.float64),  # start time in the segment, in seconds
+        ("dur", np.float64),  # duration in seconds, tied notes included
+        ("string", np.int8),
+        ("fret", np.int16),
+        ("pitch", np.int16),  # MIDI note number
+        ("type", np.int8),  # NoteType value, rest=0, normal=1, tie=2, dead=3
+        ("effects", np.uint8),  # bitmask of EFFECT_BITS
+        ("bend_type", np.int8),  # BendType value, -1 for no bend
+        ("bend_value", np.int32),
+        ("slide_types", np.uint8),  # bitmask, bit (SlideType value + 2) is set for each slide
+        ("grace_dur", np.int32),  # -1 for no grace note
+        ("grace_fret", np.int16),
+        ("grace_trans", np.int8),  # GraceEffectTransition value, -1 for no grace note
+    ]
+)
+
+# SlideType values start from -2 (intoFromAbove)
+SLIDE_BIT_OFFSET = 2
+
+
+def get_effect_bits(effect):
+    """Pack the boolean fields of `utils.get_effect_info` into a bitmask"""
+    bits = 0
+    if effect.hammer:
+        bits |= EFFECT_BITS["hammer"]
+    if effect.palmMute:
+        bits |= EFFECT_BITS["mute"]
+    if effect.vibrato:
+        bits |= EFFECT_BITS["vibrato"]
+    if effect.isHarmonic:
+        bits |= EFFECT_BITS["harmonic"]
+    if effect.slides:
+        bits |= EFFECT_BITS["slide"]
+    if effect.isBend:
+        bits |= EFFECT_BITS["bend"]
+    if effect.isGrace:
+        bits |= EFFECT_BITS["grace"]
+    return bits
+
+
+def get_note_row(note, segment):
+    """Return the columns of one note, except for the timing, as a tuple in `NOTE_DTYPE` order"""
+    effect = note.effect
+    slide_types = 0
+    for slide in effect.slides:
+        slide_types |= 1 << (slide.value + SLIDE_BIT_OFFSET)
+    return (
+        segment,
+        0.0,
+        0.0,
+        note.string,
+        note.value,
+        note.realValue,
+        note.type.value,
+        get_effect_bits(effect),
+        effect.bend.type.value if effect.isBend else -1,
+        effect.bend.value if effect.isBend else 0,
+        slide_types,
+        effect.grace.durationTime if effect.isGrace else -1,
+        effect.grace.fret if effect.isGrace else 0,
+        effect.grace.transition.value if effect.isGrace else -1,
+    )
+
+
+def get_note_table(track, bpm, order=None):
+    """Build the note table of the mono segments of one track in a single walk
+
+    This covers the same notes as `operations.get_track_annos`: tied notes are merged into the
+    previous note of the same segment, and the start times are relative to the segment start.
+
+    Args:
+        track (Track): A pyguitarpro Track object
+        bpm (int or TempoMap): The tempo of the song, or its tempo map
+        order (np.ndarray, optional): The playback order, see `utils.iter_beats`. Defaults to None (as written).
+
+    Returns:
+        np.ndarray, np.ndarray: The note table (`NOTE_DTYPE`), and the segment offsets, i.e., the notes of
+        mono segment i are `table[offsets[i] : offsets[i + 1]]` (segments without notes are kept)
+    """
+    rows = []
+    start_ticks = []
+    dur_ticks = []
+    segment_start_ticks = []
+    # tied notes are added to the duration of their owner note after the walk
+    tie_owners = []
+    tie_start_ticks = []
+    tie_ticks = []
+    offsets = [0]
+    for segment_idx, (_, segment) in enumerate(iter_mono_beat_segments(track, bpm, order)):
+        segment_start_ticks.append(segment[0].start)
+        segment_first_row = len(rows)
+        for beat in segment:
+            assert len(beat.notes) < 2
+            if not beat.notes:
+                continue
+            note = beat.notes[0]
+            if note.type == NoteType.tie:
+                # when there's no previous note in the segment, just ignore it and move on
+                if len(rows) > segment_first_row:
+                    tie_owners.append(len(rows) - 1)
+                    tie_start_ticks.append(beat.start)
+                    tie_ticks.append(beat.duration.time)
+                continue
+            rows.append(get_note_row(note, segment_idx))
+            start_ticks.append(beat.start)
+            dur_ticks.append(beat.duration.time)
+        offsets.append(len(rows))
+
+    table = np.array(rows, dtype=NOTE_DTYPE)
+    # the same conversion (and rounding) as `utils.get_note_time`, applied to all notes at once
+    tempo_map = as_tempo_map(bpm)
+    start_sec = np.round(tempo_map.to_seconds(np.asarray(start_ticks, dtype=np.int64)), 4)
+    segment_start_sec = np.round(
+        tempo_map.to_seconds(np.asarray(segment_start_ticks, dtype=np.int64)), 4
+    )
+    if len(table):
+        table["start"] = start_sec - segment_start_sec[table["segment"]]
+        table["dur"] = np.round(
+            tempo_map.durations(np.asarray(start_ticks), np.asarray(dur_ticks)), 4
+        )
+    if tie_owners:
+        tie_sec = np.round(
+            tempo_map.durations(np.asarray(tie_start_ticks), np.asarray(tie_ticks)), 4
+        )
+        # np.add.at adds in order, like the sequential additions in `gen_anno`
+        np.add.at(table["dur"], np.asarray(tie_owners), tie_sec)
+    return table, np.asarray(offsets, dtype=np.int64)
+
+
+def note_row_to_info(row):
+    """Convert one row of a note table to a note-info dict, see `utils.get_note_info`"""
+    effects = int(row["effects"])
+    effect_info = {effect: bool(effects & bit) for effect, bit in EFFECT_BITS.items()}
+    is_bend = effect_info["bend"]
+    is_grace = effect_info["grace"]
+    slide_types = int(row["slide_types"])
+    effect_info["bend_type"] = BendType(int(row["bend_type"])).name if is_bend else None
+    effect_info["bend_value"] = int(row["bend_value"]) if is_bend else None
+    # the slides come out in SlideType order, which may differ from the order in the GP file
+    effect_info["slide_types"] = (
+        [
+            slide.name
+            for slide in SlideType
+            if slide_types & (1 << (slide.value + SLIDE_BIT_OFFSET))
+        ]
+        if slide_types
+        else None
+    )
+    effect_info["grace_dur"] = int(row["grace_dur"]) if is_grace else None
+    effect_info["grace_fret"] = int(row["grace_fret"]) if is_grace else None
+    effect_info["grace_trans"] = (
+        GraceEffectTransition(int(row["grace_trans"])).name if is_grace else None
+    )
+    return {
+        "time": {"start": float(row["start"]), "dur": float(row["dur"])},
+        "string": int(row["string"]),
+        "fret": int(row["fret"]),
+        "pitch": int(row["pitch"]),
+        "type": NoteType(int(row["type"])).name,
+        "effects": effect_info,
+    }
+
+
+def note_table_to_json(table):
+    """Convert a note table (or a slice of it) to a list of note-info dicts"""
+    return [note_row_to_info(row) for row in table]
+
+
+def note_table_to_annos(table, offsets):
+    """Convert a note table to the per-segment note-info lists written by `operations.gen_anno`
+
+    Args:
+        table (np.ndarray): The note table, obtained from `get_note_table`
+        offsets (np.ndarray): The segment offsets, obtained from `get_note_table`
+
+    Returns:
+        list: A list of note-info lists, one for each mono segment
+    """
+    return [
+        note_table_to_json(table[offsets[i] : offsets[i + 1]])
+        for i in range(len(offsets) - 1)
+    ]
+
+
+def note_info_to_row(note_info, segment=0):
+    """Convert one note-info dict (see `utils.get_note_info`) to a row tuple in `NOTE_DTYPE` order"""
+    effects = note_info["effects"]
+    slide_types = 0
+    for slide_name in effects["slide_types"] or []:
+        slide_types |= 1 << (SlideType[slide_name].value + SLIDE_BIT_OFFSET)
+    bits = 0
+    for effect, bit in EFFECT_BITS.items():
+        if effects[effect]:
+            bits |= bit
+    is_bend = effects["bend"]
+    is_grace = effects["grace"]
+    return (
+        segment,
+        note_info["time"]["start"],
+        note_info["time"]["dur"],
+        note_info["string"],
+        note_info["fret"],
+        note_info["pitch"],
+        NoteType[note_info["type"]].value,
+        bits,
+        BendType[effects["bend_type"]].value if is_bend else -1,
+        effects["bend_value"] if is_bend else 0,
+        slide_types,
+        effects["grace_dur"] if is_grace else -1,
+        effects["grace_fret"] if is_grace else 0,
+        GraceEffectTransition[effects["grace_trans"]].value if is_grace else -1,
+    )
+
+
+def json_to_note_table(note_infos, segment=0):
+    """Convert a list of note-info dicts (e.g., one annotation JSON file) to a note table"""
+    return np.array(
+        [note_info_to_row(note_info, segment) for note_info in note_infos],
+        dtype=NOTE_DTYPE,
+    )
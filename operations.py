@@ -1,8 +1,15 @@
 from guitarpro.models import GPException
+from bisect import bisect_left
+import copy
 import os
 import glob
 import guitarpro
 import json
+import numpy as np
+from metrics import metrics
+from note_table import get_note_table
+from tempo_map import QUARTER_TIME, TempoMap, as_tempo_map, get_tempo_changes
+from unroll import get_timing
 from utils import *
 
 
@@ -13,6 +20,8 @@ def get_single_tracks(
     force_clean=True,
     disable_repeats=True,
     disable_mixTableChange=True,
+    keep_tempo=True,
+    verbose=True,
 ):
     """Split one multi-track GuitarPro file into several one-track GuitarPro files
 
@@ -22,47 +31,225 @@ def get_single_tracks(
         unify_volume (bool, optional): Whether to adjust the volume of every track to the same level. Defaults to True.
         force_clean (bool, optional): Whether to force all tracks to use the clean electric guitar tone. Defaults to True.
         disable_repeats (bool, optional): Whether to disable all repeats and alternate endings in the GuitarPro file. Defaults to True.
-        disable_mixTableChange (bool, optional): Whether to disable mixTableChange instances (e.g., tempo change in the middle of the song). Defaults to True.
+        disable_mixTableChange (bool, optional): Whether to disable mixTableChange instances (e.g., instrument or volume changes in the middle of the song). Defaults to True.
+        keep_tempo (bool, optional): Whether to keep the tempo changes of the disabled mixTableChange instances. Defaults to True.
+            The tempo changes of all the tracks of the song are copied into every one-track file, see `copy_tempo_changes`.
+        verbose (bool, optional): Whether to print a message when a corrupt output file is removed. Defaults to True.
+
+    Returns:
+        list, list: The paths of the written one-track files, and the names of the files removed because of a GPException
     """
-    song = guitarpro.parse(file)
+    with metrics.timer("parse"):
+        song = guitarpro.parse(file)
     # tempo = song.tempo
-    tracks = get_guitar_tracks(song)
+    with metrics.timer("guitar_tracks"):
+        tracks = get_guitar_tracks(song)
+    # the tempo changes of the song, often stored on one of its tracks only
+    tempo_changes = get_tempo_changes(song.tracks) if keep_tempo or not disable_mixTableChange else {}
+    written = []
+    failed = []
     for track in tracks:
-        # unify the volume for rendered audio
-        if unify_volume:
-            track.channel.volume = 100
-        # force the instrument to be clean electric guitar, so that synthesized audio is automatically clean guitar
-        if force_clean:
-            track.channel.instrument = 27
-
-        # disable repeats in all measures
-        # this includes repeats and alternative endings
-        for measure in track.measures:
-            if disable_repeats:
-                # isRepeatOpen is boolean, repeatClose takes -1 or 1,
-                # repeatAlternative can be whatever number, depending on which repeat group it belongs to
-                # the following is the default setting in normal bars
-                measure.header.isRepeatOpen = False
-                measure.header.repeatClose = -1
-                measure.header.repeatAlternative = 0
-            # disable mixTableChange in all beats
-            # this includes tempo changes, which mess up the calculation of note timings
-            # and other mysterious effect/instrument changes
-            if disable_mixTableChange:
-                for voice in measure.voices:
-                    for beat in voice.beats:
+        clean_track(
+            track,
+            unify_volume=unify_volume,
+            force_clean=force_clean,
+            disable_repeats=disable_repeats,
+            disable_mixTableChange=disable_mixTableChange,
+            keep_tempo=keep_tempo,
+        )
+        copy_tempo_changes(track, tempo_changes)
+        file_name = get_single_track_file_name(file, track)
+        if write_single_track(song, track, os.path.join(output_dir, file_name)):
+            written.append(os.path.join(output_dir, file_name))
+        else:
+            if verbose:
+                print(f"GPException, removing the corrupt file {file_name}")
+            failed.append(file_name)
+    return written, failed
+
+
+def clean_track(
+    track,
+    unify_volume=True,
+    force_clean=True,
+    disable_repeats=True,
+    disable_mixTableChange=True,
+    keep_tempo=True,
+):
+    """Apply the `get_single_tracks` options to one track in place
+
+    Args:
+        track (Track): A pyguitarpro Track object
+        unify_volume (bool, optional): Whether to set the volume to the common level. Defaults to True.
+        force_clean (bool, optional): Whether to force the clean electric guitar tone. Defaults to True.
+        disable_repeats (bool, optional): Whether to disable all repeats and alternate endings. Defaults to True.
+        disable_mixTableChange (bool, optional): Whether to disable mixTableChange instances. Defaults to True.
+        keep_tempo (bool, optional): Whether to keep the tempo changes of the disabled instances. Defaults to True.
+    """
+    # unify the volume for rendered audio
+    if unify_volume:
+        track.channel.volume = 100
+    # force the instrument to be clean electric guitar, so that synthesized audio is automatically clean guitar
+    if force_clean:
+        track.channel.instrument = 27
+
+    # disable repeats in all measures
+    # this includes repeats and alternative endings
+    for measure in track.measures:
+        if disable_repeats:
+            # isRepeatOpen is boolean, repeatClose takes -1 or 1,
+            # repeatAlternative can be whatever number, depending on which repeat group it belongs to
+            # the following is the default setting in normal bars
+            measure.header.isRepeatOpen = False
+            measure.header.repeatClose = -1
+            measure.header.repeatAlternative = 0
+        # disable mixTableChange in all beats: mysterious effect/instrument changes
+        # the tempo changes are kept unless `keep_tempo` is False, the tempo map (see `tempo_map`) times the notes with them
+        if disable_mixTableChange:
+            for voice in measure.voices:
+                for beat in voice.beats:
+                    mix_table_change = beat.effect.mixTableChange
+                    if keep_tempo and mix_table_change is not None and mix_table_change.tempo is not None:
+                        beat.effect.mixTableChange = guitarpro.MixTableChange(
+                            tempoName=mix_table_change.tempoName,
+                            tempo=mix_table_change.tempo,
+                            hideTempo=mix_table_change.hideTempo,
+                        )
+                    else:
                         beat.effect.mixTableChange = None
 
-        single_track_song = song  # this preserves the metadata in orginal song
-        single_track_song.tracks = [track]
-        file_name = "{}_{}.gp5".format(
-            file.split("/")[-1].split(".")[0], track.name.replace("/", " ")
-        )
-        try:
-            guitarpro.write(single_track_song, os.path.join(output_dir, file_name))
-        except GPException:
-            print(f"GPException, removing the corrupt file {file_name}")
-            os.remove(os.path.join(output_dir, file_name))
+
+def copy_tempo_changes(track, tempo_changes):
+    """Put the tempo changes of the whole song into the beats of one of its tracks, in place
+
+    Guitar Pro applies a tempo change to every track, but often stores it on one track only. A one-track
+    file needs all of them to play at the tempo of its song: each one is set on the beat of `track` that
+    starts on its tick. Where no beat starts on that tick, it goes on a rest in the second voice, if that
+    voice is unused and the gaps can be written as note durations (the annotations only read the first
+    voice). Otherwise, it is moved to the beat of the first voice that is playing on that tick.
+
+    Args:
+        track (Track): A pyguitarpro Track object
+        tempo_changes (dict): {tick: MixTableChange}, obtained from `tempo_map.get_tempo_changes`
+
+    Returns:
+        int: The number of tempo changes moved to another tick
+    """
+    moved = 0
+    ticks = sorted(tempo_changes)
+    for measure in track.measures:
+        first = bisect_left(ticks, measure.start)
+        last = bisect_left(ticks, measure.end)
+        if first == last:
+            continue
+        # the first voice wins when both voices have a beat on the tick
+        beats = {beat.start: beat for voice in reversed(measure.voices) for beat in voice.beats}
+        missing = []
+        for tick in ticks[first:last]:
+            if tick in beats:
+                _set_tempo(beats[tick], tempo_changes[tick])
+            else:
+                missing.append(tick)
+        if missing and not _add_tempo_beats(measure, missing, tempo_changes):
+            for tick in missing:
+                playing = [beat for beat in measure.voices[0].beats if beat.start <= tick]
+                if playing:
+                    _set_tempo(playing[-1], tempo_changes[tick])
+                    moved += 1
+    if moved:
+        metrics.count("tempo_changes_moved", moved)
+    return moved
+
+
+def _set_tempo(beat, tempo_change):
+    """Set the tempo of one mix-table change on a beat, keeping the other changes of the beat"""
+    if beat.effect.mixTableChange is None:
+        beat.effect.mixTableChange = guitarpro.MixTableChange()
+    beat.effect.mixTableChange.tempoName = tempo_change.tempoName
+    beat.effect.mixTableChange.tempo = copy.copy(tempo_change.tempo)
+    beat.effect.mixTableChange.hideTempo = tempo_change.hideTempo
+
+
+def _split_duration(ticks):
+    """Return the note durations that fill `ticks`, or None if there are none
+
+    Whole notes to 64th notes, then up to two 64th triplets for the rest of a triplet rhythm.
+    """
+    triplets = []
+    # a 64th triplet is 40 ticks, a 64th note 60 ticks
+    while ticks % 60 and ticks >= 40 and len(triplets) < 2:
+        triplets.append(guitarpro.Duration(value=64, tuplet=guitarpro.Tuplet(3, 2)))
+        ticks -= 40
+    if ticks % 60:
+        return None
+    durations = []
+    for value in (1, 2, 4, 8, 16, 32, 64):
+        count, ticks = divmod(ticks, QUARTER_TIME * 4 // value)
+        durations.extend(guitarpro.Duration(value=value) for _ in range(count))
+    return durations + triplets
+
+
+def _add_tempo_beats(measure, ticks, tempo_changes):
+    """Fill the second voice of a measure with rests, carrying the tempo changes on `ticks`
+
+    Returns:
+        bool: False (and the measure is left as it is) if the second voice is in use,
+        or if a gap can not be written as note durations
+    """
+    if len(measure.voices) < 2:
+        return False
+    voice = measure.voices[1]
+    if any(beat.status != guitarpro.BeatStatus.empty or beat.notes for beat in voice.beats):
+        return False
+    beats = []
+    bounds = [measure.start] + ticks + [measure.end]
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        durations = _split_duration(end - start)
+        if durations is None:
+            return False
+        for duration in durations:
+            # rests: empty beats take no time in pyguitarpro
+            beats.append(guitarpro.Beat(voice, duration=duration, start=start, status=guitarpro.BeatStatus.rest))
+            start += duration.time
+    voice.beats = beats
+    for beat in beats:
+        if beat.start in ticks:
+            _set_tempo(beat, tempo_changes[beat.start])
+    return True
+
+
+def get_single_track_file_name(file, track):
+    """The name of the one-track GuitarPro file made from `track` of the multi-track `file`"""
+    return "{}_{}.gp5".format(
+        file.split("/")[-1].split(".")[0], track.name.replace("/", " ")
+    )
+
+
+def write_single_track(song, track, path):
+    """Write `track` as a one-track GuitarPro file, keeping the metadata of `song`
+
+    The parsed song is not modified, so it can be reused for the other tracks.
+
+    Args:
+        song (Song): The pyguitarpro Song object that `track` belongs to
+        track (Track): The track to write
+        path (str): The path of the output file
+
+    Returns:
+        bool: True if the file is written, False if a GPException happened and the corrupt file is removed
+    """
+    # a shallow copy preserves the metadata in orginal song
+    single_track_song = copy.copy(song)
+    single_track_song.tracks = [track]
+    try:
+        with metrics.timer("write"):
+            guitarpro.write(single_track_song, path)
+    except GPException:
+        os.remove(path)
+        metrics.count("write_errors")
+        return False
+    metrics.count("tracks_written")
+    return True
 
 
 # this function may come in handy in later tasks, but for now, using get_single_tracks is sufficient
@@ -70,68 +257,120 @@ def get_single_tracks(
 # the optional parameters here are also implemented in get_single_tracks
 def get_phrases(
     single_track_file,
-    output_dir,
+    output_dir=None,
     force_clean=True,
     disable_mixTableChange=True,
+    keep_tempo=True,
     disable_repeats=True,
     bar_count=4,
+    stride=None,
 ):
-    # get 4-bar single-track phrases
-    # remove phrases where the 4 bars are completely empty
-    # disable any mixTableChange, including tempo change
-    # disable repeats and alternate-endings
-    # force clean_electric_guitar instrument channel
+    """Cut a single-track GuitarPro file into phrases of `bar_count` measures, skipping the empty ones
+
+    Each phrase is written as `{file name}_{i}.gp5`, where i is the index of the window. The song is
+    parsed and cleaned once, and every phrase is written from a shallow copy of the track that holds
+    a slice of the measures, so nothing is re-serialized or copied per phrase.
+
+    Args:
+        single_track_file (str): The path to the single-track GuitarPro file
+        output_dir (str, optional): The directory for the phrase files. Defaults to None (only return the phrases).
+        force_clean (bool, optional): Whether to force the clean electric guitar tone. Defaults to True.
+        disable_mixTableChange (bool, optional): Whether to disable mixTableChange instances. Defaults to True.
+        keep_tempo (bool, optional): Whether to keep their tempo changes. Defaults to True.
+        disable_repeats (bool, optional): Whether to disable all repeats and alternate endings. Defaults to True.
+        bar_count (int, optional): The number of measures in a phrase. Defaults to 4.
+        stride (int, optional): The number of measures between the starts of two phrases,
+            less than `bar_count` for overlapping phrases. Defaults to None (`bar_count`).
+
+    Returns:
+        list: The phrase descriptors, see `get_phrase_windows`, with the written path under "file"
+        (None if the phrase could not be written). None if the file can not be parsed.
+    """
     try:
         song = guitarpro.parse(single_track_file)
     except GPException:
         print(f"GPEXCEPTION in parsing {single_track_file.split('/')[-1]}")
         return
-    # tempo = song.tempo
     assert len(song.tracks) == 1
     track = song.tracks[0]
-    measures = track.measures
+    clean_track(
+        track,
+        unify_volume=False,
+        force_clean=force_clean,
+        disable_repeats=disable_repeats,
+        disable_mixTableChange=disable_mixTableChange,
+        keep_tempo=keep_tempo,
+    )
 
-    # disable repeats in all measures
-    # this includes repeats and alternative endings
-    if disable_repeats:
-        for measure in measures:
-            # isRepeatOpen is boolean, repeatClose takes -1 or 1,
-            # repeatAlternative can be whatever number, depending on which repeat group it belongs to
-            # the following is the default setting in normal bars
-            measure.header.isRepeatOpen = False
-            measure.header.repeatClose = -1
-            measure.header.repeatAlternative = 0
-
-    # disable mixTableChange in all beats
-    # this includes tempo changes, which mess up the calculation of note timings
-    # and other mysterious effect/instrument changes
-    if disable_mixTableChange:
-        for measure in measures:
-            for voice in measure.voices:
-                for beat in voice.beats:
-                    beat.effect.mixTableChange = None
-
-    bar_phrases = [
-        measures[i : i + bar_count] for i in range(0, len(measures), bar_count)
-    ]
-    for i, phrase in enumerate(bar_phrases):
-        if not all(len(get_measure_notes(measure)) == 0 for measure in phrase):
-            phrase_track = track
-            # force the instrument to be clean electric guitar, so that synthesized audio is automatically clean guitar
-            if force_clean:
-                phrase_track.channel.instrument = 27
-            phrase_track.measures = phrase
-            phrase_song = song
-            phrase_song.tracks = [phrase_track]
-            # phrase_song = guitarpro.Song(tracks=[phrase_track], tempo=song.tempo)
+    phrases = get_phrase_windows(
+        track, bar_count=bar_count, stride=stride, bpm=TempoMap.from_track(track, song.tempo)
+    )
+    for phrase in phrases:
+        phrase["file"] = None
+        if output_dir:
+            start, end = phrase["measures"]
+            phrase_track = copy.copy(track)
+            phrase_track.measures = track.measures[start:end]
             file_name = "{}_{}.gp5".format(
-                single_track_file.split("/")[-1].split(".")[0], i
+                single_track_file.split("/")[-1].split(".")[0], phrase["index"]
             )
+            path = os.path.join(output_dir, file_name)
+            if write_single_track(song, phrase_track, path):
+                phrase["file"] = path
+    return phrases
+
+
+def get_phrase_windows(track, bar_count=4, stride=None, bpm=None):
+    """Find the non-empty windows of `bar_count` measures of one track
+
+    The notes of each measure are counted once, and the windows are checked with prefix sums.
+
+    Args:
+        track (Track): A pyguitarpro Track object
+        bar_count (int, optional): The number of measures in a window. Defaults to 4.
+        stride (int, optional): The number of measures between the starts of two windows. Defaults to None (`bar_count`).
+        bpm (int or TempoMap, optional): The tempo, for the time spans. Defaults to None (no time spans).
+
+    Returns:
+        list: One dict per non-empty window, with the keys "index" (the window index, empty windows included),
+        "measures" (the [start, end) measure indices), "notes" (the [start, end) indices into the notes of
+        the track, in the order of `get_measure_notes`), "ticks" (the [start, end) ticks) and
+        "time" (the (start, end) in seconds, None without `bpm`)
+    """
+    stride = stride or bar_count
+    measures = track.measures
+    note_counts = np.fromiter(
+        (get_measure_note_count(measure) for measure in measures),
+        dtype=np.int64,
+        count=len(measures),
+    )
+    note_offsets = np.concatenate(([0], np.cumsum(note_counts)))
+    starts = np.arange(0, len(measures), stride)
+    ends = np.minimum(starts + bar_count, len(measures))
+    window_note_counts = note_offsets[ends] - note_offsets[starts]
+    tempo_map = as_tempo_map(bpm) if bpm is not None else None
 
-            guitarpro.write(phrase_song, os.path.join(output_dir, file_name))
-        # else:
-        #     print(f"empty measure found in {single_track_file.split('/')[-1]} - {i}")
-        # raise Exception(f"empty measure found in {single_track_file.split('/')[-1]} - {i}")
+    phrases = []
+    for index in np.flatnonzero(window_note_counts).tolist():
+        start, end = int(starts[index]), int(ends[index])
+        last_header = measures[end - 1].header
+        start_tick = measures[start].header.start
+        end_tick = last_header.start + last_header.length
+        phrases.append(
+            {
+                "index": index,
+                "measures": (start, end),
+                "notes": (int(note_offsets[start]), int(note_offsets[end])),
+                "ticks": (start_tick, end_tick),
+                "time": (
+                    round(tempo_map.to_seconds(start_tick), 4),
+                    round(tempo_map.to_seconds(end_tick), 4),
+                )
+                if tempo_map
+                else None,
+            }
+        )
+    return phrases
 
 
 def poly_vs_mono(song):
@@ -143,37 +382,28 @@ def poly_vs_mono(song):
     Returns:
         list, list: A list of (start, end) time stamps for all mono segments, and another list for all poly segments
     """
-    bpm = song.tempo
+    tempo_map, order = get_timing(song)
+    return get_track_segments(song.tracks[0], tempo_map, order)
+
+
+def get_track_segments(track, bpm, order=None):
+    """Return the time stamps of the poly / mono segments of one track, see `poly_vs_mono`
+
+    Args:
+        track (Track): A pyguitarpro Track object
+        bpm (int or TempoMap): The tempo of the song, or its tempo map
+        order (np.ndarray, optional): The playback order, see `unroll.get_playback_order`. Defaults to None (as written).
+
+    Returns:
+        list, list: A list of (start, end) time stamps for all poly segments, and another list for all mono segments
+    """
     poly_segments = []
     mono_segments = []
-    previous_beat_status = 0
-    beats = []
-    for measure in song.tracks[0].measures:
-        # for voice in measure.voices[0]:
-        voice = measure.voices[0]
-        beats.extend(voice.beats)
-    for beat in beats:
-        onset = beat.start
-        onset_sec = round(((onset - 960) / 960) / (bpm / 60), 4)
-        dur = beat.duration.time
-        dur_sec = round((dur / 960) / (bpm / 60), 4)
-        offset_sec = onset_sec + dur_sec
-        # 2 for polyphonic, 1 for monophonic and silence
-        beat_status = 2 if len(beat.notes) > 1 else 1
-        if beat_status != previous_beat_status:
-            # if current beat status is different from the previous beat, add the timing to the output list
-            # the following lines can obviously be better written, I leave it like this just for clarity
-            if beat_status == 2:
-                poly_segments.append([onset_sec, offset_sec])
-            if beat_status == 1:
-                mono_segments.append([onset_sec, offset_sec])
+    for start_sec, end_sec, kind, _ in iter_beat_segments(track, bpm, order):
+        if kind == "poly":
+            poly_segments.append([start_sec, end_sec])
         else:
-            # if current beat status is the same as the previous one, update the offset of the entry
-            if beat_status == 2:
-                poly_segments[-1][1] = offset_sec
-            if beat_status == 1:
-                mono_segments[-1][1] = offset_sec
-        previous_beat_status = beat_status
+            mono_segments.append([start_sec, end_sec])
     return poly_segments, mono_segments
 
 
@@ -192,46 +422,56 @@ def gen_anno(file, anno_dir):
     Args:
         file (str): The path to the single-track GuitarPro file
         anno_dir (str): The directory to put generated JSON files
+
+    Returns:
+        list: The paths of the generated JSON files
     """
-    song = guitarpro.parse(file)
+    with metrics.timer("parse"):
+        song = guitarpro.parse(file)
     # only process single track GP files
     assert len(song.tracks) == 1
 
-    # put all beats of the song in one place
-    beats = []
-    for measure in song.tracks[0].measures:
-        beats.extend(measure.voices[0].beats)
-
-    segment_idx = 0
-    segments = []  # a list of lists
-    segment = []  # a list of beat instances
-    for i, beat in enumerate(beats):
-        # if poly beat, add the accumulated `segment` list to `segments`
-        if len(beat.notes) > 1:
-            if segment:
-                segments.append(segment)
-                segment_idx += 1
-                # restart accumulation
-                segment = []
-        # if mono beat, accumulate beat instances in the `segment` list
-        else:
-            segment.append(beat)
-            # if it is also the last beat, add the final `segment` to `segments`
-            if i == len(beats) - 1:
-                segments.append(segment)
+    # the tempo (and its changes) is required for calculating the time in seconds
+    # repeats and alternate endings are unrolled in playback order
+    tempo_map, order = get_timing(song)
+    # each JSON file is written as soon as its segment is walked
+    annos = iter_track_annos(song.tracks[0], tempo_map, order)
+    track_title, _ = os.path.splitext(file.split("/")[-1])
+    return write_annos(annos, track_title, anno_dir)
 
-    # the tempo is required for calculating the time in seconds
-    bpm = song.tempo
-    for i, segment in enumerate(segments):
-        segment_start = segment[0].start
-        segment_start_sec = round(((segment_start - 960) / 960) / (bpm / 60), 4)
 
+def get_track_annos(track, bpm, order=None):
+    """Return the note-info annotations of the mono segments of one track, see `gen_anno`
+
+    Args:
+        track (Track): A pyguitarpro Track object
+        bpm (int or TempoMap): The tempo of the song, or its tempo map
+        order (np.ndarray, optional): The playback order, see `unroll.get_playback_order`. Defaults to None (as written).
+
+    Returns:
+        list: A list of note-info lists, one for each mono segment
+    """
+    return list(iter_track_annos(track, bpm, order))
+
+
+def iter_track_annos(track, bpm, order=None):
+    """Yield the note-info annotations of the mono segments of one track, one segment at a time
+
+    Args:
+        track (Track): A pyguitarpro Track object
+        bpm (int or TempoMap): The tempo of the song, or its tempo map
+        order (np.ndarray, optional): The playback order, see `unroll.get_playback_order`. Defaults to None (as written).
+
+    Yields:
+        list: The note-info list of one mono segment
+    """
+    for segment_start_sec, segment in iter_mono_beat_segments(track, bpm, order):
         note_infos = []
         for beat in segment:
             assert len(beat.notes) < 2
             if beat.notes:
                 note = beat.notes[0]
-                note_info = get_note_info(note, bpm, segment_start_sec)
+                note_info = get_note_info(note, bpm, segment_start_sec, beat=beat)
                 # if current note is tied, add its duration to the previous note
                 if note_info["type"] == "tie":
                     try:
@@ -243,7 +483,104 @@ def gen_anno(file, anno_dir):
                         continue
                 else:
                     note_infos.append(note_info)
+        yield note_infos
+
+
+def write_annos(annos, track_title, anno_dir):
+    """Dump the annotations of one track as `{track_title}_{i}.json` files, one for each mono segment
 
-        track_title, _ = os.path.splitext(file.split("/")[-1])
-        with open(os.path.join(anno_dir, f"{track_title}_{i}.json"), "w") as outfile:
+    Args:
+        annos (iterable): The note-info lists, obtained from `get_track_annos` or `iter_track_annos`
+        track_title (str): The name of the single-track GuitarPro file, without the extension
+        anno_dir (str): The directory to put generated JSON files
+
+    Returns:
+        list: The paths of the generated JSON files
+    """
+    anno_files = []
+    for i, note_infos in enumerate(annos):
+        anno_file = os.path.join(anno_dir, f"{track_title}_{i}.json")
+        with metrics.timer("anno_dump"), open(anno_file, "w") as outfile:
             json.dump(note_infos, outfile, indent=4)
+        anno_files.append(anno_file)
+        metrics.count("notes_annotated", len(note_infos))
+    return anno_files
+
+
+def process_song(
+    file,
+    output_dir=None,
+    anno_dir=None,
+    note_table=False,
+    unify_volume=True,
+    force_clean=True,
+    disable_repeats=True,
+    disable_mixTableChange=True,
+    keep_tempo=True,
+):
+    """Split, segment and annotate one multi-track GuitarPro file with a single parse
+
+    This gives the same outputs as `get_single_tracks` followed by `poly_vs_mono` and `gen_anno`
+    on every one-track file, without writing and re-parsing the intermediate .gp5 files.
+    The notes are timed with the tempo map of the whole song, built once.
+
+    Args:
+        file (str): The path to the multi-track GuitarPro file
+        output_dir (str, optional): Write the one-track .gp5 files here. Defaults to None (not written).
+        anno_dir (str, optional): Write the annotation JSON files here. Defaults to None (not written).
+        note_table (bool, optional): Whether to also return the annotations as a note table
+            (see `note_table.get_note_table`), under the keys "notes" and "offsets". Defaults to False.
+        The remaining options are the same as in `get_single_tracks`.
+
+    Returns:
+        list: One dict per guitar track, with the keys "name" (the one-track file name without extension),
+        "file" (the written .gp5 path, or None), "poly" and "mono" (the segment time stamps),
+        "annos" (the note-info lists of the mono segments, left out when only a note table is asked for), "anno_files" (the written JSON paths)
+        and "error" ("GPException" if the .gp5 file could not be written, in which case the track is not annotated)
+    """
+    with metrics.timer("parse"):
+        song = guitarpro.parse(file)
+    with metrics.timer("guitar_tracks"):
+        tracks = get_guitar_tracks(song)
+    # the tempo changes of the song, often stored on one of its tracks only
+    keep_tempo_changes = keep_tempo or not disable_mixTableChange
+    tempo_changes = get_tempo_changes(song.tracks) if keep_tempo_changes else {}
+    timing = None
+    results = []
+    for track in tracks:
+        clean_track(
+            track,
+            unify_volume=unify_volume,
+            force_clean=force_clean,
+            disable_repeats=disable_repeats,
+            disable_mixTableChange=disable_mixTableChange,
+            keep_tempo=keep_tempo,
+        )
+        if timing is None:
+            # once per song, from the tempo changes of all its tracks,
+            # after `clean_track` has disabled the repeats of the (shared) measure headers
+            timing = get_timing(song, song.tracks if keep_tempo_changes else [])
+        tempo_map, order = timing
+        if copy_tempo_changes(track, tempo_changes):
+            # some tempo changes could not be written on their ticks: time the notes as the written file
+            tempo_map, order = get_timing(song, [track])
+        file_name = get_single_track_file_name(file, track)
+        track_title, _ = os.path.splitext(file_name)
+        result = {"name": track_title, "file": None, "anno_files": [], "error": None}
+        results.append(result)
+        if output_dir:
+            path = os.path.join(output_dir, file_name)
+            # a track that can not be written is not annotated, just like in `get_single_tracks`
+            if not write_single_track(song, track, path):
+                result["error"] = "GPException"
+                continue
+            result["file"] = path
+        result["poly"], result["mono"] = get_track_segments(track, tempo_map, order)
+        if note_table:
+            result["notes"], result["offsets"] = get_note_table(track, tempo_map, order)
+        # with a note table, the note-info dicts are only built when they are written
+        if anno_dir or not note_table:
+            result["annos"] = get_track_annos(track, tempo_map, order)
+        if anno_dir:
+            result["anno_files"] = write_annos(result["annos"], track_title, anno_dir)
+    return results
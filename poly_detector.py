@@ -0,0 +1,305 @@
+"""Poly / mono detection on rendered audio, without the GuitarPro file
+
+`poly_detect.ipynb` trains a frame classifier (StandardScaler + SVC) on the MFCCs of the frames of
+segment files, computed one segment file at a time. Here the frames of a whole render are computed
+from one STFT, all of them are classified in one `predict` call, and the frame labels are smoothed
+(a running majority vote) into segments, in the format of `operations.poly_vs_mono`:
+
+    model = load_detector("poly_detector.joblib")
+    y, sr = librosa.load(audio_file, sr=None, mono=True)
+    poly, mono = detect_segments(y, sr, model)
+
+The frames are those of `poly_detect.ipynb` (`n_fft = hop_length = FRAME_SIZE`, `center=False`), so a
+model trained on its MFCC data can be used as is: frame k covers the samples k * HOP_SIZE to
+k * HOP_SIZE + FRAME_SIZE, and its center is FRAME_SIZE // 2 later. As in `poly_vs_mono`, where a
+rest belongs to a mono segment, silent frames are mono, and the segments cover the whole file one
+after the other.
+
+Training data comes from the renders and their GuitarPro files, a frame being labeled by the
+`poly_vs_mono` segment its center falls in (see `get_training_frames`):
+
+    python poly_detector.py train SINGLE_TRACK_AUDIO_DIR SINGLE_TRACK_GTP_DIR poly_detector.joblib --max-frames 200000
+
+A corpus is run through `batch.py poly` (see `batch.detect_poly_corpus`).
+"""
+import argparse
+import glob
+import os
+
+import numpy as np
+
+from audio_segments import MONO, POLY, get_segment_index
+from metrics import metrics
+
+FRAME_SIZE = 2048
+HOP_SIZE = 2048
+# the features of the final model of `poly_detect.ipynb`
+N_MFCC = 40
+# the window of the majority vote, in frames (~0.23 s at 44.1 kHz)
+SMOOTH_FRAMES = 5
+# frames outside of every segment
+UNLABELED = -1
+
+
+def extract_frames(y, sr, frame_size=FRAME_SIZE, hop_size=HOP_SIZE, n_mfcc=N_MFCC):
+    """The MFCCs of all the frames of an audio signal, from one STFT
+
+    The same values as `librosa.feature.mfcc(S=librosa.power_to_db(librosa.feature.melspectrogram(y, sr,
+    n_fft=frame_size, hop_length=hop_size, center=False)), n_mfcc=n_mfcc)` in `poly_detect.ipynb`.
+    A signal shorter than one frame has no frames.
+
+    Args:
+        y (np.ndarray): The audio signal
+        sr (int): The sampling rate
+        frame_size (int, optional): The FFT size. Defaults to FRAME_SIZE.
+        hop_size (int, optional): The hop size. Defaults to HOP_SIZE.
+        n_mfcc (int, optional): The number of MFCCs. Defaults to N_MFCC.
+
+    Returns:
+        np.ndarray, np.ndarray: The features (n_frames, n_mfcc), and whether each frame is silent
+        (an all-zero mel spectrum, the frames the notebooks leave out)
+    """
+    import librosa
+
+    if len(y) < frame_size:
+        return np.zeros((0, n_mfcc)), np.zeros(0, dtype=bool)
+    with metrics.timer("stft"):
+        power = np.abs(librosa.stft(y, n_fft=frame_size, hop_length=hop_size, center=False)) ** 2
+    with metrics.timer("spectral_features"):
+        mel = librosa.feature.melspectrogram(S=power, sr=sr)
+        mfcc = librosa.feature.mfcc(S=librosa.power_to_db(mel), n_mfcc=n_mfcc)
+    return mfcc.T, ~mel.any(axis=0)
+
+
+def count_frames(n_samples, frame_size=FRAME_SIZE, hop_size=HOP_SIZE):
+    """The number of frames of `extract_frames` for a signal of `n_samples` samples"""
+    return 0 if n_samples < frame_size else 1 + (n_samples - frame_size) // hop_size
+
+
+def get_frame_labels(poly, mono, n_frames, sr, frame_size=FRAME_SIZE, hop_size=HOP_SIZE):
+    """The label (POLY or MONO) of every frame, from `poly_vs_mono` segments
+
+    Args:
+        poly (list): The [start_sec, end_sec] of the poly segments
+        mono (list): The [start_sec, end_sec] of the mono segments
+        n_frames (int): The number of frames
+        sr (int): The sampling rate
+        frame_size (int, optional): The FFT size. Defaults to FRAME_SIZE.
+        hop_size (int, optional): The hop size. Defaults to HOP_SIZE.
+
+    Returns:
+        np.ndarray: The label of the segment the center of each frame is in, UNLABELED if none
+    """
+    index = np.sort(get_segment_index(poly, mono, sr), order="start")
+    centers = np.arange(n_frames) * hop_size + frame_size // 2
+    segment = np.searchsorted(index["start"], centers, side="right") - 1
+    labels = np.full(n_frames, UNLABELED, dtype=np.int8)
+    inside = segment >= 0
+    inside[inside] = centers[inside] < index["end"][segment[inside]]
+    labels[inside] = index["kind"][segment[inside]]
+    return labels
+
+
+def get_training_frames(y, sr, poly, mono, frame_size=FRAME_SIZE, hop_size=HOP_SIZE, n_mfcc=N_MFCC):
+    """The labeled, non-silent frames of one render, for `train_detector`
+
+    Args:
+        y (np.ndarray): The audio signal
+        sr (int): The sampling rate
+        poly (list): The [start_sec, end_sec] of the poly segments, see `operations.poly_vs_mono`
+        mono (list): The [start_sec, end_sec] of the mono segments
+        frame_size (int, optional): The FFT size. Defaults to FRAME_SIZE.
+        hop_size (int, optional): The hop size. Defaults to HOP_SIZE.
+        n_mfcc (int, optional): The number of MFCCs. Defaults to N_MFCC.
+
+    Returns:
+        np.ndarray, np.ndarray: The features (n_frames, n_mfcc) and the labels (1 for poly, 0 for mono)
+    """
+    features, silent = extract_frames(y, sr, frame_size, hop_size, n_mfcc)
+    labels = get_frame_labels(poly, mono, len(features), sr, frame_size, hop_size)
+    kept = ~silent & (labels != UNLABELED)
+    return features[kept], labels[kept]
+
+
+def train_detector(X, y, C=10, gamma="scale"):
+    """Fit the frame classifier of `poly_detect.ipynb`, `make_pipeline(StandardScaler(), SVC(C=10, gamma="scale"))`"""
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.svm import SVC
+
+    return make_pipeline(StandardScaler(), SVC(C=C, gamma=gamma)).fit(X, y)
+
+
+def load_detector(path):
+    """Load a frame classifier saved with `joblib.dump`"""
+    import joblib
+
+    return joblib.load(path)
+
+
+def predict_frames(model, features, silent=None):
+    """Classify all the frames in one batch
+
+    Args:
+        model: A fitted frame classifier
+        features (np.ndarray): The features (n_frames, n_features), see `extract_frames`
+        silent (np.ndarray, optional): The silent frames, labeled MONO without being classified. Defaults to None.
+
+    Returns:
+        np.ndarray: The label of every frame
+    """
+    if features.shape[1] != model.n_features_in_:
+        raise ValueError(f"the model expects {model.n_features_in_} features per frame, got {features.shape[1]}")
+    labels = np.full(len(features), MONO, dtype=np.int8)
+    sounding = np.ones(len(features), dtype=bool) if silent is None else ~silent
+    if sounding.any():
+        with metrics.timer("predict"):
+            labels[sounding] = model.predict(features[sounding])
+    return labels
+
+
+def smooth_labels(labels, smooth_frames=SMOOTH_FRAMES):
+    """A running majority vote over `smooth_frames` (odd) frames, which removes the shorter runs"""
+    from scipy.ndimage import median_filter
+
+    if smooth_frames <= 1:
+        return labels
+    return median_filter(labels, size=smooth_frames, mode="nearest")
+
+
+def labels_to_segments(labels, sr, frame_size=FRAME_SIZE, hop_size=HOP_SIZE, duration=None):
+    """Convert frame labels into `poly_vs_mono` segments
+
+    A segment boundary falls halfway between the centers of the two frames around it. Without any frame,
+    the whole file is one mono segment.
+
+    Args:
+        labels (np.ndarray): The label of every frame
+        sr (int): The sampling rate
+        frame_size (int, optional): The FFT size. Defaults to FRAME_SIZE.
+        hop_size (int, optional): The hop size. Defaults to HOP_SIZE.
+        duration (float, optional): The end of the last segment, in seconds. Defaults to None (the end of the last frame).
+
+    Returns:
+        list, list: The [start_sec, end_sec] of the poly segments, and of the mono segments
+    """
+    if duration is None:
+        duration = ((len(labels) - 1) * hop_size + frame_size) / sr if len(labels) else 0.0
+    if len(labels) == 0:
+        return [], [[0.0, round(duration, 4)]] if duration > 0 else []
+    poly, mono = [], []
+    changes = np.flatnonzero(np.diff(labels)) + 1
+    starts = np.concatenate(([0], changes))
+    boundaries = ((changes - 0.5) * hop_size + frame_size // 2) / sr
+    bounds = np.concatenate(([0.0], np.minimum(boundaries, duration), [duration]))
+    for start, start_sec, end_sec in zip(starts.tolist(), bounds[:-1].tolist(), bounds[1:].tolist()):
+        segment = [round(start_sec, 4), round(end_sec, 4)]
+        (poly if labels[start] == POLY else mono).append(segment)
+    return poly, mono
+
+
+def detect_segments(
+    y, sr, model, frame_size=FRAME_SIZE, hop_size=HOP_SIZE, smooth_frames=SMOOTH_FRAMES
+):
+    """The poly / mono segments of an audio signal, see the module docstring
+
+    Args:
+        y (np.ndarray): The audio signal
+        sr (int): The sampling rate
+        model: A fitted frame classifier, see `train_detector`; its number of features is the number of MFCCs
+        frame_size (int, optional): The FFT size. Defaults to FRAME_SIZE.
+        hop_size (int, optional): The hop size. Defaults to HOP_SIZE.
+        smooth_frames (int, optional): See `smooth_labels`. Defaults to SMOOTH_FRAMES.
+
+    Returns:
+        list, list: The [start_sec, end_sec] of the poly segments, and of the mono segments, as `operations.poly_vs_mono`
+    """
+    features, silent = extract_frames(y, sr, frame_size, hop_size, n_mfcc=model.n_features_in_)
+    labels = smooth_labels(predict_frames(model, features, silent), smooth_frames)
+    return labels_to_segments(labels, sr, frame_size, hop_size, duration=len(y) / sr)
+
+
+def detect_file(audio_file, model, frame_size=FRAME_SIZE, hop_size=HOP_SIZE, smooth_frames=SMOOTH_FRAMES):
+    """`detect_segments` on an audio file
+
+    Returns:
+        dict: The file, its duration in seconds and number of frames, and the "poly" and "mono" segments
+    """
+    import librosa
+
+    with metrics.timer("audio_load"):
+        y, sr = librosa.load(audio_file, sr=None, mono=True)
+    poly, mono = detect_segments(y, sr, model, frame_size, hop_size, smooth_frames)
+    return {
+        "file": audio_file,
+        "duration": round(len(y) / sr, 3),
+        "frames": count_frames(len(y), frame_size, hop_size),
+        "poly": poly,
+        "mono": mono,
+    }
+
+
+def build_training_data(audio_files, gtp_dir, max_frames=None, seed=0, **options):
+    """The training frames of renders with one-track GuitarPro files of the same name in `gtp_dir`
+
+    Args:
+        audio_files (list): The rendered audio files
+        gtp_dir (str): The directory of the one-track GuitarPro (.gp5) files
+        max_frames (int, optional): Keep a random sample of this many frames. Defaults to None (all of them).
+        seed (int, optional): The random seed of the sample. Defaults to 0.
+        **options: Passed on to `get_training_frames`
+
+    Returns:
+        np.ndarray, np.ndarray: The features and the labels
+    """
+    import guitarpro
+    import librosa
+
+    from operations import poly_vs_mono
+
+    features, labels = [], []
+    for audio_file in audio_files:
+        track_name, _ = os.path.splitext(os.path.basename(audio_file))
+        gtp_file = os.path.join(gtp_dir, track_name + ".gp5")
+        if not os.path.exists(gtp_file):
+            continue
+        poly, mono = poly_vs_mono(guitarpro.parse(gtp_file))
+        y, sr = librosa.load(audio_file, sr=None, mono=True)
+        X, y_frames = get_training_frames(y, sr, poly, mono, **options)
+        features.append(X)
+        labels.append(y_frames)
+    if not features:
+        raise ValueError(f"no audio file with a GuitarPro file in {gtp_dir}")
+    X = np.concatenate(features)
+    y = np.concatenate(labels)
+    if max_frames is not None and len(X) > max_frames:
+        kept = np.sort(np.random.default_rng(seed).choice(len(X), max_frames, replace=False))
+        X, y = X[kept], y[kept]
+    return X, y
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    train_parser = subparsers.add_parser("train", help="train the frame classifier on renders and their GuitarPro files")
+    train_parser.add_argument("audio_dir")
+    train_parser.add_argument("gtp_dir")
+    train_parser.add_argument("model_file")
+    train_parser.add_argument("--pattern", default="*.wav")
+    train_parser.add_argument("--n-mfcc", type=int, default=N_MFCC)
+    train_parser.add_argument("--max-frames", type=int, default=None, help="train on a random sample of the frames")
+    train_parser.add_argument("--C", type=float, default=10)
+    train_parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    import joblib
+
+    audio_files = sorted(glob.glob(os.path.join(args.audio_dir, args.pattern)))
+    X, y = build_training_data(audio_files, args.gtp_dir, args.max_frames, args.seed, n_mfcc=args.n_mfcc)
+    print(f"{len(X)} frames, {np.sum(y == POLY)} poly, {np.sum(y == MONO)} mono")
+    joblib.dump(train_detector(X, y, C=args.C), args.model_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""Headless rendering of one-track GuitarPro files to audio, through MIDI and FluidSynth
+
+`clicker/autogtp.py` exports the audio by clicking through the Guitar Pro GUI. Here a one-track
+file (the output of `operations.get_single_tracks`) is converted to a Standard MIDI File, and the
+MIDI file is rendered offline by the FluidSynth command line synthesizer with a SoundFont:
+
+    write_track_midi("song_Guitar 1.gp5", "song_Guitar 1.mid")
+    render_midi("song_Guitar 1.mid", "song_Guitar 1.wav", "FluidR3_GM.sf2")
+
+The MIDI file follows the timing of the annotations: the first voice of the track is played in
+playback order (repeats unrolled, see `unroll`) with the tempo changes of the song, at the GuitarPro
+resolution of 960 ticks per quarter note, so a note starts at the time `gen_anno` gives it.
+Tied notes are merged into the note they continue (as in the annotations), bends become pitch bends
+(held through the tied notes) on a MIDI channel of their own, and dead notes, which are annotated
+too, are played as short muted notes.
+
+FluidSynth renders faster than real time and, with reverb and chorus off, the output only depends on
+the MIDI file, the SoundFont and the options, so a file renders to the same samples every time.
+`batch.py render` runs it over a corpus.
+"""
+import os
+import shutil
+import struct
+import subprocess
+
+import guitarpro
+
+from metrics import metrics
+from tempo_map import QUARTER_TIME, START_TICK
+from unroll import get_timing
+from utils import iter_beats
+
+# MIDI ticks per quarter note, the same as the GuitarPro ticks
+DIVISION = QUARTER_TIME
+PERCUSSION_CHANNEL = 9
+# the pitch bend range, in semitones, set with RPN 0 (the General MIDI default is 2)
+BEND_RANGE = 12
+# the unit of `BendPoint.value`, a quarter tone
+BEND_POINT_SEMITONES = 0.5
+# the General MIDI "Electric Guitar (muted)" program, and the longest dead note (a 32nd note)
+MUTED_GUITAR_PROGRAM = 28
+DEAD_NOTE_TIME = QUARTER_TIME // 8
+
+# the order of the events at the same tick: set-up first, a note ends before the next one starts,
+# and the bend of a note is set before it sounds
+_SETUP, _NOTE_OFF, _BEND_RESET, _BEND, _NOTE_ON = range(5)
+
+
+def _var_len(value):
+    # a MIDI variable-length quantity
+    out = [value & 0x7F]
+    value >>= 7
+    while value:
+        out.append(0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(reversed(out))
+
+
+def write_midi(path, events, division=DIVISION):
+    """Write a format 0 Standard MIDI File
+
+    Args:
+        path (str): The path of the file to write
+        events (list): (tick, order, message bytes) tuples, see `get_midi_events`. They are sorted
+            by tick and order; events with the same tick and order keep their order.
+        division (int, optional): The number of ticks per quarter note. Defaults to DIVISION.
+    """
+    track = bytearray()
+    last_tick = 0
+    for tick, _, message in sorted(events, key=lambda event: (event[0], event[1])):
+        track += _var_len(tick - last_tick) + message
+        last_tick = tick
+    # end of track
+    track += _var_len(0) + b"\xff\x2f\x00"
+    with open(path, "wb") as outfile:
+        outfile.write(b"MThd" + struct.pack(">IHHH", 6, 0, 1, division))
+        outfile.write(b"MTrk" + struct.pack(">I", len(track)) + bytes(track))
+
+
+def _pitch_bend(channel, semitones):
+    value = min(max(8192 + round(semitones / BEND_RANGE * 8192), 0), 16383)
+    return bytes([0xE0 | channel, value & 0x7F, value >> 7])
+
+
+def _channel_setup(channel, program, volume):
+    control = 0xB0 | channel
+    return [
+        (0, _SETUP, bytes([0xC0 | channel, program & 0x7F])),
+        (0, _SETUP, bytes([control, 7, min(max(volume, 0), 127)])),
+        # RPN 0 (pitch bend sensitivity) = BEND_RANGE semitones
+        (0, _SETUP, bytes([control, 101, 0])),
+        (0, _SETUP, bytes([control, 100, 0])),
+        (0, _SETUP, bytes([control, 6, BEND_RANGE])),
+        (0, _SETUP, bytes([control, 38, 0])),
+    ]
+
+
+def get_midi_events(track, tempo_map, order=None):
+    """The MIDI events of one track, for `write_midi`
+
+    The notes are played on the channel of the track. A pitch bend applies to a whole MIDI channel,
+    so every bent note is played on a channel of its own (free for the time of the note), and the
+    other notes sounding with it keep their pitch. Dead notes are played for at most DEAD_NOTE_TIME
+    on another channel, with the muted guitar program.
+
+    Args:
+        track (Track): A pyguitarpro Track object
+        tempo_map (TempoMap): The tempo map of the song, in unrolled ticks if `order` is given
+        order (np.ndarray, optional): The playback order, see `unroll.get_playback_order`. Defaults to None (as written).
+
+    Returns:
+        list: (tick, order, message bytes) tuples, the ticks start at 0 on the first beat
+    """
+    channel = track.channel.channel
+    if channel == PERCUSSION_CHANNEL:
+        channel = 0
+    # the channels for the dead notes and the bent notes
+    dead_channel, *bend_channels = [c for c in range(16) if c not in (channel, PERCUSSION_CHANNEL)]
+    events = []
+    for tick, bpm in zip(tempo_map.ticks.tolist(), tempo_map.tempos.tolist()):
+        usec_per_quarter = round(60_000_000 / bpm)
+        events.append(
+            (max(tick - START_TICK, 0), _SETUP, b"\xff\x51\x03" + usec_per_quarter.to_bytes(3, "big"))
+        )
+    events += _channel_setup(channel, track.channel.instrument, track.channel.volume)
+
+    # every note: [pitch, start, end, velocity, bend points (tick, semitones), dead],
+    # the events are made once the ties are merged
+    notes = []
+    # the last note of each string, and the last note of all
+    last_on_string = {}
+    last_note = None
+
+    def bend_points(effect, start, end):
+        return [(start + point.getTime(end - start), point.value * BEND_POINT_SEMITONES) for point in effect.bend.points]
+
+    for beat in iter_beats(track, order):
+        start = beat.start - START_TICK
+        end = start + beat.duration.time
+        for note in beat.notes:
+            if note.type == guitarpro.NoteType.tie:
+                # merged into the note it continues, as in the annotations (`operations.get_track_annos`):
+                # the last note of the string, or else (in a one-note beat) the last note; a tie without one is left out
+                previous = last_on_string.get(note.string, last_note if len(beat.notes) == 1 else None)
+                if previous is None:
+                    continue
+                # held through, or (after a rest) lengthened by the duration of the tie
+                previous[2] = end if previous[2] == start else previous[2] + end - start
+                if note.effect.isBend:
+                    previous[4] += bend_points(note.effect, start, end)
+                continue
+            velocity = min(max(note.velocity, 1), 127)
+            if note.type == guitarpro.NoteType.dead:
+                # annotated like any other note, but not continued by a tie
+                last_on_string.pop(note.string, None)
+                notes.append([note.realValue, start, start + min(end - start, DEAD_NOTE_TIME), velocity, [], True])
+                continue
+            bends = bend_points(note.effect, start, end) if note.effect.isBend else []
+            current = [note.realValue, start, end, velocity, bends, False]
+            notes.append(current)
+            last_on_string[note.string] = current
+            last_note = current
+
+    if any(dead for *_, dead in notes):
+        events += _channel_setup(dead_channel, MUTED_GUITAR_PROGRAM, track.channel.volume)
+    # the tick each bend channel is free from, a channel is set up when it is first used
+    free_from = {}
+    for pitch, start, end, velocity, bends, dead in sorted(notes, key=lambda note: note[1]):
+        note_channel = dead_channel if dead else channel
+        if bends:
+            # the first free channel (or the one free the soonest, with more bent notes at once
+            # than bend channels, which 6 strings do not give)
+            free = [c for c in bend_channels if free_from.get(c, 0) <= start]
+            note_channel = free[0] if free else min(bend_channels, key=lambda c: free_from.get(c, 0))
+            if note_channel not in free_from:
+                events += _channel_setup(note_channel, track.channel.instrument, track.channel.volume)
+            free_from[note_channel] = end
+            events += [(tick, _BEND, _pitch_bend(note_channel, semitones)) for tick, semitones in bends]
+            # the bend is held until the end of the note, ties included
+            events.append((end, _BEND_RESET, _pitch_bend(note_channel, 0)))
+        events.append((start, _NOTE_ON, bytes([0x90 | note_channel, pitch, velocity])))
+        events.append((end, _NOTE_OFF, bytes([0x80 | note_channel, pitch, 0])))
+    return events
+
+
+def write_track_midi(file, midi_path):
+    """Convert a one-track GuitarPro file to a MIDI file, see the module docstring
+
+    Args:
+        file (str): The path to the one-track GuitarPro file
+        midi_path (str): The path of the MIDI file to write
+
+    Returns:
+        int: The number of notes written
+    """
+    with metrics.timer("parse"):
+        song = guitarpro.parse(file)
+    with metrics.timer("midi"):
+        tempo_map, order = get_timing(song)
+        events = get_midi_events(song.tracks[0], tempo_map, order)
+        write_midi(midi_path, events)
+    return sum(1 for _, kind, _ in events if kind == _NOTE_ON)
+
+
+def render_midi(midi_path, wav_path, soundfont, sr=44100, gain=0.5, fluidsynth="fluidsynth"):
+    """Render a MIDI file to a 16-bit WAV file with FluidSynth, without reverb and chorus
+
+    Args:
+        midi_path (str): The path to the MIDI file
+        wav_path (str): The path of the WAV file to write
+        soundfont (str): The path to the SoundFont (.sf2)
+        sr (int, optional): The sampling rate. Defaults to 44100.
+        gain (float, optional): The FluidSynth master gain. Defaults to 0.5.
+        fluidsynth (str, optional): The FluidSynth executable. Defaults to "fluidsynth" (looked up in PATH).
+
+    Raises:
+        RuntimeError: If FluidSynth is not installed, or fails
+    """
+    executable = shutil.which(fluidsynth)
+    if executable is None:
+        raise RuntimeError(f"FluidSynth ({fluidsynth}) not found, install it, e.g., `apt install fluidsynth`")
+    command = [
+        executable,
+        "-n",  # no MIDI input
+        "-i",  # no shell
+        "-R", "0",
+        "-C", "0",
+        "-g", str(gain),
+        "-r", str(sr),
+        "-T", "wav",
+        "-O", "s16",
+        "-F", wav_path,
+        soundfont,
+        midi_path,
+    ]
+    with metrics.timer("synth"):
+        result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0 or not os.path.exists(wav_path):
+        raise RuntimeError(f"FluidSynth failed on {midi_path}: {result.stderr.strip()[-500:]}")
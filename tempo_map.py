@@ -0,0 +1,160 @@
+"""Tick to seconds conversion that follows the tempo changes of a song
+
+A GuitarPro file gives the timing of every beat in ticks (960 per quarter note, the first beat at
+tick 960), and the tempo changes as mix-table changes on beats. `TempoMap` is built once per
+song (or track) from those tempo events, and converts ticks with a bisect (one value) or
+`np.searchsorted` (an array of values).
+
+With a single tempo, the results are exactly those of the formula used so far,
+`((tick - 960) / 960) / (bpm / 60)`, so the maps can replace `song.tempo` everywhere.
+
+    tempo_map = TempoMap.from_song(song)
+    onset_sec, dur_sec = tempo_map.beat_time(beat)
+    onsets_sec = tempo_map.to_seconds(np.array([beat.start for beat in beats]))
+"""
+from bisect import bisect_right
+
+import numpy as np
+
+QUARTER_TIME = 960
+# the tick of the first beat of a song
+START_TICK = 960
+
+
+def as_tempo_map(bpm):
+    """Return `bpm` if it is a TempoMap already, otherwise the map of the constant tempo `bpm`"""
+    if isinstance(bpm, TempoMap):
+        return bpm
+    return TempoMap([START_TICK], [bpm])
+
+
+def get_tempo_changes(tracks):
+    """Return the tempo changes in the beats of some tracks, as {tick: MixTableChange}
+
+    A tempo change applies to the whole song, whichever track it is stored on. On the same tick,
+    the change of the later track wins, as in `TempoMap.from_beats`.
+    """
+    changes = {}
+    for track in tracks:
+        for measure in track.measures:
+            for voice in measure.voices:
+                for beat in voice.beats:
+                    mix_table_change = beat.effect.mixTableChange
+                    if mix_table_change is not None and mix_table_change.tempo is not None:
+                        changes[max(beat.start, START_TICK)] = mix_table_change
+    return changes
+
+
+class TempoMap:
+    """A piecewise-constant tempo over ticks
+
+    Args:
+        ticks (list): The ticks of the tempo events, sorted, the first one is START_TICK
+        tempos (list): The tempo (bpm) from each event on
+    """
+
+    def __init__(self, ticks, tempos):
+        self.ticks = np.asarray(ticks, dtype=np.int64)
+        self.tempos = np.asarray(tempos, dtype=np.float64)
+        # the time of each event, accumulated segment by segment with the single-tempo formula
+        seconds = [0.0]
+        for i in range(1, len(self.ticks)):
+            seconds.append(
+                seconds[-1]
+                + ((int(self.ticks[i]) - int(self.ticks[i - 1])) / QUARTER_TIME)
+                / (float(self.tempos[i - 1]) / 60)
+            )
+        self.seconds = np.asarray(seconds)
+        # plain lists for the scalar lookups, which are faster than indexing arrays
+        self._ticks = self.ticks.tolist()
+        self._tempos = self.tempos.tolist()
+        self._seconds = seconds
+
+    @classmethod
+    def from_track(cls, track, bpm):
+        """Build the tempo map from the tempo changes in the beats of one track
+
+        Args:
+            track (Track): A pyguitarpro Track object
+            bpm (int): The initial tempo, i.e., `song.tempo`
+        """
+        return cls.from_tracks([track], bpm)
+
+    @classmethod
+    def from_song(cls, song):
+        """Build the tempo map from the tempo changes in all tracks of a song"""
+        return cls.from_tracks(song.tracks, song.tempo)
+
+    @classmethod
+    def from_tracks(cls, tracks, bpm):
+        """Build the tempo map from the tempo changes in the beats of some tracks, starting from `bpm`"""
+
+        def iter_beats():
+            for track in tracks:
+                for measure in track.measures:
+                    for voice in measure.voices:
+                        yield from voice.beats
+
+        return cls.from_beats(iter_beats(), bpm)
+
+    @classmethod
+    def from_beats(cls, beats, bpm):
+        """Build the tempo map from the tempo changes in some beats (at their `start` ticks), starting from `bpm`"""
+        events = {START_TICK: bpm}
+        for beat in beats:
+            mix_table_change = beat.effect.mixTableChange
+            if mix_table_change is not None and mix_table_change.tempo is not None:
+                events[max(beat.start, START_TICK)] = mix_table_change.tempo.value
+        ticks = sorted(events)
+        tempos = [events[tick] for tick in ticks]
+        # drop the events that do not change the tempo, so that the map stays as short as possible
+        keep = [0] + [i for i in range(1, len(ticks)) if tempos[i] != tempos[i - 1]]
+        return cls([ticks[i] for i in keep], [tempos[i] for i in keep])
+
+    @property
+    def is_constant(self):
+        return len(self._ticks) == 1
+
+    def __repr__(self):
+        return f"TempoMap({list(zip(self._ticks, self._tempos))})"
+
+    def to_seconds(self, ticks):
+        """Convert ticks (one int, or an array) to seconds from the first beat"""
+        if np.ndim(ticks) == 0:
+            i = max(bisect_right(self._ticks, ticks) - 1, 0)
+            return self._seconds[i] + ((ticks - self._ticks[i]) / QUARTER_TIME) / (
+                self._tempos[i] / 60
+            )
+        ticks = np.asarray(ticks)
+        i = np.maximum(np.searchsorted(self.ticks, ticks, side="right") - 1, 0)
+        return self.seconds[i] + ((ticks - self.ticks[i]) / QUARTER_TIME) / (
+            self.tempos[i] / 60
+        )
+
+    def durations(self, starts, durations):
+        """Convert durations in ticks to seconds, given their start ticks (ints, or arrays)
+
+        A duration within one tempo is converted with `(duration / 960) / (bpm / 60)` like before,
+        one across tempo changes is the difference of the end and start times.
+        """
+        if np.ndim(starts) == 0:
+            i = max(bisect_right(self._ticks, starts) - 1, 0)
+            if i + 1 == len(self._ticks) or starts + durations <= self._ticks[i + 1]:
+                return (durations / QUARTER_TIME) / (self._tempos[i] / 60)
+            return self.to_seconds(starts + durations) - self.to_seconds(starts)
+        starts = np.asarray(starts)
+        durations = np.asarray(durations)
+        i = np.maximum(np.searchsorted(self.ticks, starts, side="right") - 1, 0)
+        local = (durations / QUARTER_TIME) / (self.tempos[i] / 60)
+        if self.is_constant:
+            return local
+        ends = starts + durations
+        crossing = np.searchsorted(self.ticks, ends, side="left") - 1 > i
+        return np.where(crossing, self.to_seconds(ends) - self.to_seconds(starts), local)
+
+    def beat_time(self, beat):
+        """Return the (start, duration) of one beat in seconds, rounded as in `utils.get_note_time`"""
+        return (
+            round(self.to_seconds(beat.start), 4),
+            round(self.durations(beat.start, beat.duration.time), 4),
+        )
@@ -0,0 +1,59 @@
+"""Checks of the annotation store against the per-segment JSON files it replaces"""
+import json
+
+import numpy as np
+import pytest
+
+from anno_store import MAGIC, AnnoStore, write_anno_store
+from note_table import json_to_note_table
+from test_f0_analysis_utils import random_annotation
+
+
+def random_segments(rng, n):
+    # non-ASCII names, and some empty segments
+    return [
+        (f"Motörhead - Ace of Spades_Guitar {i}_{i % 3}", random_annotation(rng, seconds=float(rng.uniform(0, 5))))
+        for i in range(n)
+    ]
+
+
+def test_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    segments = random_segments(rng, 20)
+    path = tmp_path / "annotations.annos"
+    write_anno_store(path, ((name, json_to_note_table(notes)) for name, notes in segments))
+    store = AnnoStore(path)
+    assert list(store) == [name for name, _ in segments]
+    for name, notes in segments:
+        assert np.array_equal(store[name], json_to_note_table(notes))
+        assert np.array_equal(json_to_note_table(store.get_note_infos(name)), store[name])
+
+
+def test_empty_store(tmp_path):
+    path = tmp_path / "annotations.annos"
+    write_anno_store(path, [])
+    assert len(AnnoStore(path)) == 0
+
+
+def test_duplicate_names(tmp_path):
+    rng = np.random.default_rng(1)
+    (name, notes), *_ = random_segments(rng, 1)
+    table = json_to_note_table(notes)
+    with pytest.raises(ValueError, match="duplicate"):
+        write_anno_store(tmp_path / "annotations.annos", [(name, table), ("other", table), (name, table)])
+
+
+def test_other_version(tmp_path):
+    path = tmp_path / "annotations.annos"
+    write_anno_store(path, [])
+    data = path.read_bytes()
+    header_size = int(np.frombuffer(data[len(MAGIC) : len(MAGIC) + 8], dtype=np.uint64)[0])
+    start = len(MAGIC) + 8
+    header = json.loads(data[start : start + header_size])
+    header["version"] = 1
+    path.write_bytes(data[:start] + json.dumps(header).encode().ljust(header_size) + data[start + header_size :])
+    with pytest.raises(ValueError, match="version 1"):
+        AnnoStore(path)
+    path.write_bytes(b"GPANNO1\0" + data[len(MAGIC) :])
+    with pytest.raises(ValueError, match="not an annotation store"):
+        AnnoStore(path)
@@ -0,0 +1,43 @@
+"""Checks of the corpus runs against the per-file outputs"""
+import json
+import os
+
+from anno_store import AnnoStore
+from batch import split_corpus
+from benchmark import make_song
+
+
+def make_songs(directory, n_songs):
+    os.makedirs(directory)
+    files = []
+    for seed in range(n_songs):
+        files.append(os.path.join(directory, f"song{seed}.gp5"))
+        make_song(files[-1], n_tracks=2, n_measures=8, seed=seed)
+    return files
+
+
+def test_split_corpus_anno_store(tmp_path):
+    files = make_songs(tmp_path / "multi", 4)
+    anno_dir = tmp_path / "anno"
+    summary = split_corpus(files, str(tmp_path / "single"), anno_dir=str(anno_dir), workers=2)
+    store_summary = split_corpus(files, str(tmp_path / "single_2"), anno_store=str(tmp_path / "annotations.annos"), workers=2)
+    assert store_summary["annos"] == summary["annos"] == len(os.listdir(anno_dir))
+    assert store_summary["errors"] == []
+    assert "segments" not in store_summary
+
+    store = AnnoStore(tmp_path / "annotations.annos")
+    assert sorted(store) == sorted(os.path.splitext(name)[0] for name in os.listdir(anno_dir))
+    for name in store:
+        with open(anno_dir / f"{name}.json") as anno:
+            assert store.get_note_infos(name) == json.load(anno)
+
+
+def test_split_corpus_duplicate_segments(tmp_path):
+    # the same file names in two directories give the same segment names
+    files = make_songs(tmp_path / "a", 2) + make_songs(tmp_path / "b", 1)
+    summary = split_corpus(files, str(tmp_path / "single"), anno_store=str(tmp_path / "annotations.annos"), workers=2)
+    duplicates = [error for error in summary["errors"] if error["stage"] == "store"]
+    assert duplicates and {error["file"] for error in duplicates} <= {files[0], files[2]}
+    store = AnnoStore(tmp_path / "annotations.annos")
+    assert len(store) == summary["annos"]
+    assert all(name.startswith(("song0_", "song1_")) for name in store)
@@ -0,0 +1,80 @@
+"""Checks of the parallel nested CV against the `GridSearchCV` of `pt_classifier_eval.ipynb`"""
+import json
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("sklearn")
+
+from cv_runner import FEATURE_COMBOS, P_GRID, RESULTS_FILE, load_results, run_nested_cv
+from feature_dataset import FeatureDataset, from_matrix
+
+
+def make_dataset(path, n=240, seed=0):
+    rng = np.random.default_rng(seed)
+    y = rng.integers(0, 4, n)
+    X = rng.normal(size=(n, 486)) + y[:, None] * rng.normal(size=486) * 0.15
+    # a column on another scale, so that the scalers matter
+    X[:, 20] *= 100
+    from_matrix(path, np.column_stack((X, y)), shard_rows=100)
+
+
+def test_nested_cv(tmp_path):
+    import joblib
+    from sklearn.metrics import f1_score
+    from sklearn.model_selection import GridSearchCV
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.svm import SVC
+
+    dataset_dir = str(tmp_path / "dataset")
+    run_dir = str(tmp_path / "run")
+    make_dataset(dataset_dir)
+    combos = ["pitch", "timbre+pitch"]
+    run_nested_cv(dataset_dir, run_dir, combos=combos, workers=2, verbose=False)
+
+    dataset = FeatureDataset(dataset_dir)
+    labels = dataset.labels()
+    folds = np.load(os.path.join(run_dir, "folds.npz"))
+    results = {(result["combo"], result["fold"]): result for result in load_results(run_dir)}
+    assert len(results) == 5 * len(combos)
+    for combo in combos:
+        X = dataset.load(FEATURE_COMBOS[combo])
+        for fold in range(5):
+            train = folds["outer"] != fold
+            inner = folds[f"inner_{fold}"]
+            cv = [(np.flatnonzero(inner != j), np.flatnonzero(inner == j)) for j in range(2)]
+            pipeline = Pipeline([("scaler", StandardScaler()), ("svc", SVC(class_weight="balanced"))])
+            search = GridSearchCV(pipeline, [P_GRID], scoring="f1_macro", cv=cv).fit(X[train], labels[train])
+            result = results[(combo, fold)]
+            assert search.best_params_ == result["best_params"]
+            np.testing.assert_allclose(search.cv_results_["mean_test_score"], [grid["score"] for grid in result["grid"]])
+            model = joblib.load(os.path.join(run_dir, "models", f"{combo}.fold_{fold}.joblib"))
+            predicted = model.predict(X[~train])
+            np.testing.assert_array_equal(search.predict(X[~train]), predicted)
+            assert np.isclose(f1_score(labels[~train], predicted, average="macro"), result["test_score"])
+
+
+def test_resume(tmp_path):
+    dataset_dir = str(tmp_path / "dataset")
+    run_dir = str(tmp_path / "run")
+    make_dataset(dataset_dir, n=120)
+    p_grid = {"svc__C": [1, 10], "svc__gamma": ["scale"]}
+    run_nested_cv(dataset_dir, run_dir, combos=["pitch"], p_grid=p_grid, workers=1, verbose=False)
+    results_file = os.path.join(run_dir, RESULTS_FILE)
+    with open(results_file) as infile:
+        lines = infile.readlines()
+    # an interrupted run: two jobs lost, the last line cut in the middle
+    with open(results_file, "w") as outfile:
+        outfile.writelines(lines[:2])
+        outfile.write(lines[2][:10])
+    run_nested_cv(dataset_dir, run_dir, combos=["pitch"], p_grid=p_grid, workers=1, verbose=False)
+    results = load_results(run_dir)
+    assert sorted(result["fold"] for result in results) == list(range(5))
+    # the finished jobs are not run again
+    assert [json.dumps(result, sort_keys=True) for result in results[:2]] == [
+        json.dumps(json.loads(line), sort_keys=True) for line in lines[:2]
+    ]
+    with pytest.raises(ValueError):
+        run_nested_cv(dataset_dir, run_dir, combos=["pitch"], p_grid=P_GRID, workers=1, verbose=False)
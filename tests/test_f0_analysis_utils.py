@@ -0,0 +1,223 @@
+"""Randomized checks of the vectorized F0 analysis against the loops it replaces
+
+Each `ref_*` function is the frame-by-frame (or note-by-note) version of the original `f0_analysis_utils` code.
+"""
+import numpy as np
+import pytest
+
+import f0_analysis_utils as f0
+from f0_analysis_utils import ms_to_frames
+from note_table import EFFECTS, json_to_note_table
+
+N_TRIALS = 100
+
+
+def ref_continous_f0_segments(notes, dur_thres=80):
+    valid_indices = [i for i in range(len(notes)) if not np.isnan(notes[i])]
+    f0_segments = np.split(valid_indices, np.where(np.diff(valid_indices) != 1)[0] + 1)
+    return [segment for segment in f0_segments if len(segment) >= ms_to_frames(dur_thres)]
+
+
+def ref_note_events_from_f0_segment(notes, f0_segment, f0_change_thres=0.5, dur_thres=80):
+    previous_note = notes[f0_segment[0]]
+    note_event = [f0_segment[0]]
+    note_events = []
+    for i in f0_segment[1:]:
+        if abs(notes[i] - previous_note) <= f0_change_thres:
+            note_event.append(i)
+            if i == f0_segment[-1]:
+                note_events.append(note_event)
+        else:
+            note_events.append(note_event)
+            note_event = [i]
+        previous_note = notes[i]
+    return [note_event for note_event in note_events if len(note_event) >= ms_to_frames(dur_thres)]
+
+
+def ref_longest_run(mask):
+    cnt = 0
+    max_cnt = 0
+    for element in mask:
+        if element:
+            cnt += 1
+        elif cnt > 0:
+            max_cnt = max(max_cnt, cnt)
+            cnt = 0
+    if cnt > 0:
+        max_cnt = max(max_cnt, cnt)
+    return max_cnt
+
+
+def ref_candidates(notes, dur_thres=80, peak_count=2, peak_dist_min=60, peak_dist_max=800, pitch_diff=1):
+    """The original `is_bend_candidate`, `is_release_candidate` and `is_vibrato_candidate`"""
+    from scipy.signal import find_peaks
+
+    diff = np.diff(notes, 1)
+    small_steps = np.all(abs(diff) <= 1)
+    wide_range = max(notes) - min(notes) >= 0.5
+    bend = ref_longest_run(diff >= 0) >= ms_to_frames(dur_thres) and small_steps and wide_range
+    release = ref_longest_run(diff <= 0) >= ms_to_frames(dur_thres) and small_steps and wide_range
+    peak_indices, _ = find_peaks(notes)
+    condition1 = len(peak_indices) >= peak_count
+    peak_dists = np.diff(peak_indices, 1)
+    condition2 = (
+        np.logical_and(peak_dists >= ms_to_frames(peak_dist_min), peak_dists <= ms_to_frames(peak_dist_max)).any()
+        if condition1
+        else False
+    )
+    condition3 = np.max(notes[peak_indices]) - np.mean(notes) <= pitch_diff if condition1 else False
+    return bool(bend), bool(release), bool(condition1 and condition2 and condition3)
+
+
+def random_f0(rng):
+    n = int(rng.integers(1, 400))
+    notes = np.cumsum(rng.normal(0, 0.4, n)) + 60
+    notes[rng.random(n) < rng.uniform(0, 0.3)] = np.nan
+    return notes
+
+
+def random_note_events(rng):
+    events = []
+    for length in rng.integers(1, 60, int(rng.integers(1, 40))):
+        t = np.arange(length)
+        kind = rng.integers(0, 4)
+        if kind == 0:
+            event = 60 + np.cumsum(rng.normal(0, 0.3, length))
+        elif kind == 1:
+            event = 60 + 0.5 * np.sin(t / rng.uniform(1, 6)) + rng.normal(0, 0.05, length)
+        elif kind == 2:
+            event = 60 + np.linspace(0, rng.uniform(-2, 2), length)
+        else:
+            # plateaus
+            event = np.round(60 + np.cumsum(rng.normal(0, 0.3, length)))
+        events.append(event)
+    return events
+
+
+def ref_rasterize(note_infos, n_frames, hop_length=f0.HOPSIZE, key=None):
+    """The loop of the original `plot_f0_vs_gt` (`librosa.samples_to_frames` is a floor division)"""
+    gt = np.full(n_frames, np.nan)
+    for note in note_infos:
+        onset_fr = int(note["time"]["start"] * f0.SR // hop_length)
+        offset_fr = int((note["time"]["start"] + note["time"]["dur"]) * f0.SR // hop_length)
+        gt[onset_fr:offset_fr] = note["pitch"] if key is None else float(note["effects"][key])
+    return gt
+
+
+def random_annotation(rng, seconds=30):
+    annotation = []
+    start = float(rng.uniform(0, 1))
+    while start < seconds:
+        dur = float(rng.choice([0.004, 0.05, 0.1, 0.25, 0.5]))
+        effects = {effect: bool(rng.random() < 0.2) for effect in EFFECTS}
+        # the other fields of `utils.get_note_info`, for the note tables
+        effects.update(bend_type="bend", bend_value=100, slide_types=None, grace_dur=16, grace_fret=0, grace_trans="none")
+        annotation.append(
+            {
+                "time": {"start": round(start, 4), "dur": dur},
+                "string": 1,
+                "fret": 0,
+                "pitch": int(rng.integers(40, 80)),
+                "type": "normal",
+                "effects": effects,
+            }
+        )
+        start += dur + float(rng.choice([0, 0, 0.03, 0.2]))
+    return annotation
+
+
+def test_ms_to_frames():
+    librosa = pytest.importorskip("librosa")
+    for ms in (0, 1, 30, 60, 80, 800):
+        assert ms_to_frames(ms) == librosa.time_to_frames(ms / 1000, sr=f0.SR, hop_length=f0.HOPSIZE, n_fft=f0.FRAMESIZE)
+
+
+def test_f0_segmentation():
+    rng = np.random.default_rng(0)
+    for _ in range(N_TRIALS):
+        notes = random_f0(rng)
+        for dur_thres in (80, 30, 0):
+            segments = f0.get_continous_f0_segments(notes, dur_thres=dur_thres)
+            expected = ref_continous_f0_segments(notes, dur_thres=dur_thres)
+            if np.isnan(notes).all():
+                # see `test_f0_segmentation_without_f0`
+                expected = [segment for segment in expected if len(segment)]
+            assert [list(segment) for segment in segments] == [list(segment) for segment in expected]
+            for segment in segments:
+                for thres in (0.3, 0.5, 1):
+                    events = f0.get_note_events_from_f0_segment(notes, segment, thres, dur_thres)
+                    assert events == ref_note_events_from_f0_segment(notes, segment, thres, dur_thres)
+            # all segments at once
+            starts, ends = f0.get_continous_f0_segment_bounds(notes, dur_thres)
+            event_starts, event_ends = f0.get_note_event_bounds(notes, starts, ends, 0.5, dur_thres)
+            expected = [
+                event for segment in expected for event in ref_note_events_from_f0_segment(notes, segment, 0.5, dur_thres)
+            ]
+            assert [list(range(start, end)) for start, end in zip(event_starts, event_ends)] == expected
+
+
+def test_f0_segmentation_without_f0():
+    # the one intended difference: with a threshold of at most 0 frames, the original gives one empty
+    # segment for a curve without any F0 (on which `get_note_events_from_f0_segment` then fails),
+    # the vectorized version gives no segment
+    notes = np.full(50, np.nan)
+    assert [len(segment) for segment in ref_continous_f0_segments(notes, dur_thres=0)] == [0]
+    assert f0.get_continous_f0_segments(notes, dur_thres=0) == []
+    assert ref_continous_f0_segments(notes, dur_thres=80) == f0.get_continous_f0_segments(notes, dur_thres=80) == []
+
+
+def test_consecutive_counts():
+    rng = np.random.default_rng(1)
+    for _ in range(N_TRIALS * 10):
+        diff = rng.normal(0, 1, int(rng.integers(0, 30)))
+        diff[rng.random(len(diff)) < 0.2] = 0
+        diff[rng.random(len(diff)) < 0.05] = np.nan
+        assert f0.count_consecutive_rise(diff) == ref_longest_run(diff >= 0)
+        assert f0.count_consecutive_drop(diff) == ref_longest_run(diff <= 0)
+
+
+def test_candidates():
+    pytest.importorskip("scipy")
+    rng = np.random.default_rng(2)
+    for _ in range(N_TRIALS):
+        events = random_note_events(rng)
+        # the note events of one F0 curve, with NaN frames between them
+        notes = np.full(sum(len(event) for event in events) + 3 * len(events), np.nan)
+        starts, ends = [], []
+        position = 0
+        for event in events:
+            position += int(rng.integers(1, 4))
+            notes[position : position + len(event)] = event
+            starts.append(position)
+            position += len(event)
+            ends.append(position)
+        values, offsets = f0.gather_note_events(notes, starts, ends)
+        assert np.array_equal(values, np.concatenate(events))
+        assert np.array_equal(offsets, np.concatenate(([0], np.cumsum([len(event) for event in events]))))
+        candidates = f0.detect_candidates(values, offsets)
+        for k, event in enumerate(events):
+            expected = ref_candidates(event)
+            assert (candidates["bend"][k], candidates["release"][k], candidates["vibrato"][k]) == expected
+            assert (f0.is_bend_candidate(event), f0.is_release_candidate(event), f0.is_vibrato_candidate(event)) == expected
+
+
+def test_rasterization():
+    rng = np.random.default_rng(3)
+    annos = [random_annotation(rng, seconds=float(rng.uniform(0, 20))) for _ in range(N_TRIALS // 4)]
+    n_frames = [int(rng.integers(0, 2000)) for _ in annos]
+    for notes, n in zip(annos, n_frames):
+        for hop_length in (256, 512, 1024):
+            frames = f0.rasterize_notes(notes, n, hop_length=hop_length)
+            assert np.array_equal(frames["pitch"], ref_rasterize(notes, n, hop_length), equal_nan=True)
+            for effect in EFFECTS:
+                expected = np.nan_to_num(ref_rasterize(notes, n, hop_length, effect)) > 0
+                assert np.array_equal(frames[effect], expected)
+        if notes:
+            from_table = f0.rasterize_notes(json_to_note_table(notes), n)
+            from_json = f0.rasterize_notes(notes, n)
+            for key in from_json:
+                assert np.array_equal(from_table[key], from_json[key], equal_nan=True)
+    # all annotations at once
+    frames, offsets = f0.rasterize_annos(annos, n_frames)
+    for k, (notes, n) in enumerate(zip(annos, n_frames)):
+        assert np.array_equal(frames["pitch"][offsets[k] : offsets[k + 1]], ref_rasterize(notes, n), equal_nan=True)
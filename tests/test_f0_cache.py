@@ -0,0 +1,146 @@
+"""Checks of the pYIN cache: its keys, broken entries and eviction"""
+import os
+import time
+
+import numpy as np
+import pytest
+
+import f0_cache
+from f0_cache import cache_key, cached_pyin, evict, load_entry, save_entry
+
+PARAMS = dict(sr=22050, fmin=65.4, fmax=1568.0, frame_length=2048, hop_length=512, center=True)
+
+
+@pytest.fixture(autouse=True)
+def fresh_sizes(monkeypatch):
+    # the size estimates of another test's cache directory
+    monkeypatch.setattr(f0_cache, "_cache_sizes", {})
+
+
+def random_entry(rng, n_frames=200):
+    f0 = np.where(rng.random(n_frames) < 0.2, np.nan, rng.uniform(80, 800, n_frames))
+    return f0, ~np.isnan(f0), rng.random(n_frames)
+
+
+def write_audio(path, seconds=0.5, sr=22050, freq=220.0):
+    soundfile = pytest.importorskip("soundfile")
+    t = np.arange(int(seconds * sr)) / sr
+    soundfile.write(path, 0.5 * np.sin(2 * np.pi * freq * t), sr)
+
+
+def test_round_trip(tmp_path):
+    f0, voiced_flag, voiced_prob = random_entry(np.random.default_rng(0))
+    save_entry("key", f0, voiced_flag, voiced_prob, 22050, cache_dir=tmp_path, max_bytes=1 << 20)
+    loaded = load_entry("key", cache_dir=tmp_path)
+    np.testing.assert_array_equal(loaded[0], f0)
+    np.testing.assert_array_equal(loaded[1], voiced_flag)
+    np.testing.assert_array_equal(loaded[2], voiced_prob.astype(np.float32))
+    assert loaded[3] == 22050
+    assert load_entry("other", cache_dir=tmp_path) is None
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+def test_corrupt_entry_is_a_miss(tmp_path):
+    f0, voiced_flag, voiced_prob = random_entry(np.random.default_rng(1))
+    save_entry("truncated", f0, voiced_flag, voiced_prob, 22050, cache_dir=tmp_path, max_bytes=1 << 20)
+    path = tmp_path / "truncated.npz"
+    path.write_bytes(path.read_bytes()[:100])
+    (tmp_path / "garbage.npz").write_bytes(b"not a zip file")
+    np.savez(tmp_path / "incomplete.npz", f0=f0)
+    for key in ("truncated", "garbage", "incomplete"):
+        assert load_entry(key, cache_dir=tmp_path) is None
+
+
+def test_corrupt_entry_is_recomputed(tmp_path):
+    pytest.importorskip("librosa")
+    audio = str(tmp_path / "tone.wav")
+    write_audio(audio)
+    cache_dir = tmp_path / "cache"
+    f0, _, _, sr = cached_pyin(audio, cache_dir=cache_dir, **PARAMS)
+    (entry,) = os.listdir(cache_dir)
+    (cache_dir / entry).write_bytes(b"broken")
+    f0_again, _, _, sr_again = cached_pyin(audio, cache_dir=cache_dir, **PARAMS)
+    np.testing.assert_array_equal(f0_again, f0)
+    assert sr_again == sr
+    # the entry is written again
+    assert load_entry(entry[: -len(".npz")], cache_dir=cache_dir) is not None
+
+
+def test_cache_key(tmp_path):
+    audio = str(tmp_path / "tone.wav")
+    write_audio(audio)
+    key = cache_key(audio, **PARAMS)
+    changed = [
+        cache_key(audio, **dict(PARAMS, **{name: value}))
+        for name, value in (
+            ("sr", None),
+            ("fmin", 65.41),
+            ("fmax", 1567.98),
+            ("frame_length", 1024),
+            ("hop_length", 256),
+            ("center", False),
+        )
+    ]
+    assert len(set(changed + [key])) == len(changed) + 1
+    # the key follows the content, not the path
+    copy = str(tmp_path / "copy.wav")
+    with open(audio, "rb") as infile, open(copy, "wb") as outfile:
+        outfile.write(infile.read())
+    assert cache_key(copy, **PARAMS) == key
+    write_audio(copy, freq=440.0)
+    assert cache_key(copy, **PARAMS) != key
+
+
+def save_entries(cache_dir, n_entries):
+    """Entries 0 to n_entries - 1, each one last used a minute after the previous one"""
+    rng = np.random.default_rng(2)
+    now = time.time()
+    sizes = []
+    for i in range(n_entries):
+        save_entry(f"entry{i}", *random_entry(rng), 22050, cache_dir=cache_dir, max_bytes=1 << 30)
+        path = os.path.join(cache_dir, f"entry{i}.npz")
+        os.utime(path, (now - 60 * (n_entries - i), now - 60 * (n_entries - i)))
+        sizes.append(os.path.getsize(path))
+    return sizes
+
+
+def test_evict_oldest_first(tmp_path):
+    sizes = save_entries(tmp_path, 10)
+    # room for the newest 4 entries only
+    max_bytes = sum(sizes[-4:]) + sizes[-5] // 2
+    assert evict(tmp_path, max_bytes) == sum(sizes[-4:])
+    assert sorted(os.listdir(tmp_path)) == [f"entry{i}.npz" for i in range(6, 10)]
+
+
+def test_load_refreshes_the_entry(tmp_path):
+    sizes = save_entries(tmp_path, 4)
+    # a hit makes the oldest entry the most recently used one
+    assert load_entry("entry0", cache_dir=tmp_path) is not None
+    evict(tmp_path, sizes[0] + sizes[3])
+    assert sorted(os.listdir(tmp_path)) == ["entry0.npz", "entry3.npz"]
+
+
+def test_save_evicts(tmp_path):
+    sizes = save_entries(tmp_path, 6)
+    rng = np.random.default_rng(3)
+    # the first save of a process scans the cache
+    save_entry("new", *random_entry(rng), 22050, cache_dir=tmp_path, max_bytes=sum(sizes[-2:]) + sizes[0])
+    names = sorted(os.listdir(tmp_path))
+    assert "new.npz" in names and "entry0.npz" not in names
+    assert sum(os.path.getsize(tmp_path / name) for name in names) <= sum(sizes[-2:]) + sizes[0]
+
+
+def test_stale_tmp_files(tmp_path):
+    save_entries(tmp_path, 1)
+    stale = tmp_path / "entry1.npz.123.tmp"
+    fresh = tmp_path / "entry2.npz.456.tmp"
+    stale.write_bytes(b"x" * 1000)
+    fresh.write_bytes(b"x" * 1000)
+    old = time.time() - f0_cache.STALE_TMP_SECONDS - 60
+    os.utime(stale, (old, old))
+    size = os.path.getsize(tmp_path / "entry0.npz")
+    # a temporary file of a live worker is counted, but not deleted
+    assert evict(tmp_path, 1 << 30) == size + 1000
+    assert sorted(os.listdir(tmp_path)) == ["entry0.npz", fresh.name]
+    assert evict(tmp_path, 0) == 1000
+    assert os.listdir(tmp_path) == [fresh.name]
@@ -0,0 +1,129 @@
+"""Checks of the batched note features against the per-note code of the notebooks
+
+`gt_generation.ipynb` computes each feature with its own librosa call, and pools the frames of every
+note and transition with `get_all_stats` of `results_and_eval.ipynb` (scipy's skewness and kurtosis).
+"""
+import numpy as np
+import pytest
+
+from test_f0_analysis_utils import random_annotation
+
+pytest.importorskip("scipy")
+N_TRIALS = 100
+
+
+def ref_stats(features):
+    from scipy.stats import kurtosis, skew
+
+    return np.concatenate(
+        (
+            np.mean(features, axis=1),
+            np.std(features, axis=1),
+            features.max(axis=1),
+            features.min(axis=1),
+            skew(features, axis=1),
+            kurtosis(features, axis=1),
+        )
+    )
+
+
+def ref_annotation_features(features, sr, annotation, hop_size):
+    import librosa
+
+    note_rows, tran_rows = [], []
+    for i, note in enumerate(annotation):
+        onset = note["time"]["start"]
+        offset = onset + note["time"]["dur"]
+        onset_fr = librosa.time_to_frames(onset, sr=sr, hop_length=hop_size)
+        offset_fr = librosa.time_to_frames(offset, sr=sr, hop_length=hop_size)
+        if offset_fr - onset_fr < 1:
+            continue
+        label = 2 if note["effects"]["vibrato"] else 1 if note["effects"]["bend"] else 0
+        note_rows.append(np.append(ref_stats(features[:, onset_fr : offset_fr + 1]), label))
+        if i == len(annotation) - 1:
+            break
+        next_note = annotation[i + 1]
+        if next_note["time"]["start"] - offset > 0.05:
+            continue
+        if note["effects"]["hammer"]:
+            label = 3 if note["pitch"] < next_note["pitch"] else 4 if note["pitch"] > next_note["pitch"] else 0
+        elif note["effects"]["slide"]:
+            label = 5
+        else:
+            label = 0
+        tran_rows.append(np.append(ref_stats(features[:, offset_fr - 2 : offset_fr + 3]), label))
+    return np.array(note_rows), np.array(tran_rows)
+
+
+def test_pool_stats():
+    from note_features import pool_stats
+
+    rng = np.random.default_rng(0)
+    for _ in range(N_TRIALS):
+        features = rng.normal(size=(int(rng.integers(1, 10)), int(rng.integers(3, 300))))
+        n_frames = features.shape[1]
+        starts = rng.integers(0, n_frames - 2, int(rng.integers(0, 20)))
+        # at least 2 frames: scipy gives NaN for the skewness of a constant since 1.9, the pinned 1.8 gives 0
+        ends = np.maximum(np.minimum(starts + rng.integers(2, 50, len(starts)), n_frames), starts + 2)
+        pooled = pool_stats(features, starts, ends)
+        assert pooled.shape == (len(starts), 6 * features.shape[0])
+        for k, (start, end) in enumerate(zip(starts, ends)):
+            np.testing.assert_allclose(pooled[k], ref_stats(features[:, start:end]), rtol=1e-7, atol=1e-9)
+
+
+def test_pool_stats_constant():
+    from note_features import pool_stats
+
+    features = np.array([[1.0, 2.0, 2.0, 2.0, 3.0]])
+    pooled = pool_stats(features, [1, 0], [4, 1])
+    # mean, std, max, min, skewness and kurtosis, as scipy 1.8 for a constant
+    np.testing.assert_array_equal(pooled, [[2, 0, 2, 2, 0, -3], [1, 0, 1, 1, 0, -3]])
+
+
+def test_annotation_features():
+    pytest.importorskip("librosa")
+    from note_features import get_annotation_features
+
+    sr, hop_size = 22050, 512
+    rng = np.random.default_rng(1)
+    for _ in range(N_TRIALS // 10):
+        annotation = random_annotation(rng, seconds=20)
+        # the frames of the notes, and 2 frames after the last one for its transition
+        n_frames = int((annotation[-1]["time"]["start"] + annotation[-1]["time"]["dur"]) * sr) // hop_size + 3
+        features = rng.normal(size=(81, n_frames))
+        X_notes, y_notes, X_trans, y_trans = get_annotation_features(None, sr, annotation, hop_size=hop_size, features=features)
+        ref_notes, ref_trans = ref_annotation_features(features, sr, annotation, hop_size)
+        np.testing.assert_allclose(X_notes, ref_notes[:, :-1], rtol=1e-7, atol=1e-9)
+        np.testing.assert_array_equal(y_notes, ref_notes[:, -1])
+        np.testing.assert_allclose(X_trans, ref_trans[:, :-1], rtol=1e-7, atol=1e-9)
+        np.testing.assert_array_equal(y_trans, ref_trans[:, -1])
+
+
+def test_frame_features():
+    librosa = pytest.importorskip("librosa")
+    from note_features import extract_frame_features
+
+    sr, frame_size, hop_size = 22050, 2048, 512
+    rng = np.random.default_rng(2)
+    t = np.arange(2 * sr) / sr
+    y = (0.5 * np.sin(2 * np.pi * 220 * t * (1 + 0.01 * np.sin(2 * np.pi * 5 * t))) + 0.01 * rng.normal(size=len(t))).astype(np.float32)
+    # a made-up pitch curve, so that the check does not run pYIN
+    n_frames = 1 + len(y) // hop_size
+    pitch = np.where(rng.random(n_frames) < 0.1, np.nan, 220 + rng.normal(size=n_frames))
+
+    # `extract_features` of `gt_generation.ipynb`, one librosa call per feature
+    mfcc = librosa.feature.mfcc(y=y, sr=sr, n_fft=frame_size, hop_length=hop_size)
+    centroid = librosa.feature.spectral_centroid(y=y, sr=sr, n_fft=frame_size, hop_length=hop_size)[0]
+    bandwidth = librosa.feature.spectral_bandwidth(y=y, sr=sr, n_fft=frame_size, hop_length=hop_size)[0]
+    flatness = librosa.feature.spectral_flatness(y=y, n_fft=frame_size, hop_length=hop_size)[0]
+    rolloff = librosa.feature.spectral_rolloff(y=y, sr=sr, n_fft=frame_size, hop_length=hop_size)[0]
+    zero_crossing = librosa.feature.zero_crossing_rate(y, frame_length=frame_size, hop_length=hop_size)[0]
+    flux = librosa.onset.onset_strength(y=y, sr=sr, n_fft=frame_size, hop_length=hop_size)
+    features = np.concatenate((mfcc, [pitch, centroid, bandwidth, flatness, rolloff, zero_crossing, flux]))
+    expected = np.concatenate(
+        (features, librosa.feature.delta(features, order=1), librosa.feature.delta(features, order=2))
+    )
+
+    result = extract_frame_features(y, sr, frame_size, hop_size, pitch=pitch)
+    assert result.shape == expected.shape == (81, n_frames)
+    np.testing.assert_allclose(result, expected, rtol=1e-4, atol=1e-4)
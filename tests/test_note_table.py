@@ -0,0 +1,33 @@
+"""Checks of the note tables against the note-info dicts of `operations.gen_anno`"""
+import guitarpro
+import numpy as np
+import pytest
+
+from benchmark import make_song
+from note_table import NOTE_DTYPE, get_note_table, json_to_note_table, note_table_to_annos, note_table_to_json
+from operations import get_track_annos, process_song
+from unroll import get_timing
+from utils import get_guitar_tracks
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_note_table(tmp_path, seed):
+    song_file = str(tmp_path / "song.gp5")
+    make_song(song_file, n_tracks=2, n_measures=24, max_notes=2, tempo_changes=True, seed=seed)
+    song = guitarpro.parse(song_file)
+    tempo_map, order = get_timing(song)
+    for track in get_guitar_tracks(song):
+        annos = get_track_annos(track, tempo_map, order)
+        notes, offsets = get_note_table(track, tempo_map, order)
+        assert notes.dtype == NOTE_DTYPE
+        assert len(offsets) == len(annos) + 1 and offsets[-1] == len(notes)
+        assert note_table_to_annos(notes, offsets) == annos
+        for segment, note_infos in enumerate(annos):
+            table = json_to_note_table(note_infos, segment)
+            assert np.array_equal(table, notes[offsets[segment] : offsets[segment + 1]])
+            assert note_table_to_json(table) == note_infos
+
+    # with a note table only, `process_song` does not build the note-info dicts
+    for result, expected in zip(process_song(song_file, note_table=True), process_song(song_file)):
+        assert "annos" not in result
+        assert note_table_to_annos(result["notes"], result["offsets"]) == expected["annos"]
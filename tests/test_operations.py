@@ -0,0 +1,160 @@
+"""Checks of the single-parse pipeline against the file-by-file steps it replaces"""
+import glob
+import os
+
+import guitarpro
+import pytest
+
+from benchmark import make_song
+from operations import gen_anno, get_single_tracks, poly_vs_mono, process_song
+
+
+def split_and_annotate(song_file, single_dir, anno_dir, **options):
+    """`get_single_tracks`, then `poly_vs_mono` and `gen_anno` on every one-track file, as before `process_song`"""
+    os.makedirs(single_dir)
+    os.makedirs(anno_dir)
+    get_single_tracks(song_file, single_dir, verbose=False, **options)
+    segments = {}
+    for single_file in sorted(glob.glob(os.path.join(single_dir, "*.gp5"))):
+        gen_anno(single_file, anno_dir)
+        name, _ = os.path.splitext(os.path.basename(single_file))
+        segments[name] = list(poly_vs_mono(guitarpro.parse(single_file)))
+    return segments
+
+
+def assert_same_files(directory, expected_directory, mode="rb"):
+    assert sorted(os.listdir(directory)) == sorted(os.listdir(expected_directory))
+    for name in os.listdir(expected_directory):
+        with open(os.path.join(directory, name), mode) as result, open(os.path.join(expected_directory, name), mode) as expected:
+            assert result.read() == expected.read(), name
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_process_song(tmp_path, seed):
+    song_file = str(tmp_path / "song.gp5")
+    make_song(song_file, n_tracks=3, n_measures=24, tempo_changes=True, seed=seed)
+    expected_segments = split_and_annotate(song_file, str(tmp_path / "ref_single"), str(tmp_path / "ref_anno"))
+    os.makedirs(tmp_path / "single")
+    os.makedirs(tmp_path / "anno")
+
+    results = process_song(song_file, output_dir=str(tmp_path / "single"), anno_dir=str(tmp_path / "anno"))
+    assert_same_files(tmp_path / "single", tmp_path / "ref_single")
+    assert_same_files(tmp_path / "anno", tmp_path / "ref_anno", mode="r")
+    assert sorted(result["name"] for result in results) == sorted(expected_segments)
+    for result in results:
+        assert [result["poly"], result["mono"]] == expected_segments[result["name"]]
+        assert len(result["anno_files"]) == len(result["annos"])
+
+    # without writing anything
+    for result, in_memory in zip(results, process_song(song_file)):
+        assert in_memory["file"] is None and in_memory["anno_files"] == []
+        assert [in_memory["poly"], in_memory["mono"], in_memory["annos"]] == [result["poly"], result["mono"], result["annos"]]
+
+
+def make_tempo_song(path, busy_second_voice=False, seed=0):
+    """A 2-guitar song with all the tempo changes on Guitar 1, some of them where Guitar 2 has no beat"""
+    make_song(path, n_tracks=2, n_measures=16, tempo_changes=True, tempo_track=0, seed=seed)
+    song = guitarpro.parse(path)
+    guitar_1, guitar_2 = song.tracks
+
+    def set_tempo(measure_index, beat_index, tempo):
+        beat = guitar_1.measures[measure_index].voices[0].beats[beat_index]
+        beat.effect.mixTableChange = guitarpro.MixTableChange(tempo=guitarpro.MixTableItem(tempo, 0, True))
+
+    def hold(measure_index, voice_index):
+        # one whole note on Guitar 2
+        voice = guitar_2.measures[measure_index].voices[voice_index]
+        beat = guitarpro.Beat(voice, duration=guitarpro.Duration(value=1), status=guitarpro.BeatStatus.normal)
+        beat.notes.append(guitarpro.Note(beat, value=5, string=3, type=guitarpro.NoteType.normal))
+        voice.beats = [beat]
+
+    # on the 4th eighth of a whole note
+    hold(5, 0)
+    set_tempo(5, 3, 60)
+    # two changes in one whole note
+    hold(9, 0)
+    set_tempo(9, 1, 180)
+    set_tempo(9, 6, 90)
+    if busy_second_voice:
+        hold(13, 0)
+        hold(13, 1)
+        set_tempo(13, 2, 150)
+    guitarpro.write(song, path)
+
+
+def tempo_events(tempo_map):
+    return dict(zip(tempo_map.ticks.tolist(), tempo_map.tempos.tolist()))
+
+
+def test_tempo_changes_on_another_track(tmp_path):
+    from operations import get_track_segments
+    from tempo_map import TempoMap
+    from unroll import get_timing
+
+    song_file = str(tmp_path / "song.gp5")
+    make_tempo_song(song_file)
+    song = guitarpro.parse(song_file)
+    song_map, _ = get_timing(song)
+    assert len(song_map.ticks) > 4
+    assert TempoMap.from_track(song.tracks[1], song.tempo).is_constant
+
+    expected_segments = split_and_annotate(song_file, str(tmp_path / "ref_single"), str(tmp_path / "ref_anno"))
+    results = process_song(song_file)
+    assert sorted(result["name"] for result in results) == sorted(expected_segments) == ["song_Guitar 1", "song_Guitar 2"]
+    for track, result in zip(song.tracks, results):
+        # every one-track file has all the tempo changes of the song, on their ticks
+        single_track = guitarpro.parse(str(tmp_path / "ref_single" / f"{result['name']}.gp5"))
+        assert tempo_events(TempoMap.from_song(single_track)) == tempo_events(song_map)
+        # and both ways of annotating it follow the tempo of the song
+        assert [result["poly"], result["mono"]] == expected_segments[result["name"]]
+        assert [result["poly"], result["mono"]] == list(get_track_segments(track, song_map))
+    # the held measures of Guitar 2 got the tempo changes on rests of the second voice
+    guitar_2 = guitarpro.parse(str(tmp_path / "ref_single" / "song_Guitar 2.gp5")).tracks[0]
+    for index in (5, 9):
+        voice = guitar_2.measures[index].voices[1]
+        assert all(beat.status == guitarpro.BeatStatus.rest and not beat.notes for beat in voice.beats)
+        assert sum(beat.duration.time for beat in voice.beats) == guitar_2.measures[index].length
+
+
+def test_tempo_change_moved(tmp_path):
+    from tempo_map import TempoMap
+    from unroll import get_timing
+
+    song_file = str(tmp_path / "song.gp5")
+    make_tempo_song(song_file, busy_second_voice=True)
+    song_map, _ = get_timing(guitarpro.parse(song_file))
+    expected_segments = split_and_annotate(song_file, str(tmp_path / "ref_single"), str(tmp_path / "ref_anno"))
+    for result in process_song(song_file):
+        single_track = guitarpro.parse(str(tmp_path / "ref_single" / f"{result['name']}.gp5"))
+        expected_events = tempo_events(song_map)
+        if result["name"] == "song_Guitar 2":
+            # no beat and no free voice on the tick: the change moves to the start of the held note
+            start = single_track.tracks[0].measures[13].start
+            expected_events[start] = expected_events.pop(start + 2 * 480)
+        assert tempo_events(TempoMap.from_song(single_track)) == expected_events
+        # the annotations follow the written file
+        assert [result["poly"], result["mono"]] == expected_segments[result["name"]]
+
+
+def test_strip_tempo(tmp_path):
+    from tempo_map import TempoMap
+
+    song_file = str(tmp_path / "song.gp5")
+    make_tempo_song(song_file)
+    expected_segments = split_and_annotate(
+        song_file, str(tmp_path / "ref_single"), str(tmp_path / "ref_anno"), keep_tempo=False
+    )
+    for name in expected_segments:
+        assert TempoMap.from_song(guitarpro.parse(str(tmp_path / "ref_single" / f"{name}.gp5"))).is_constant
+    for result in process_song(song_file, keep_tempo=False):
+        assert [result["poly"], result["mono"]] == expected_segments[result["name"]]
+
+
+def test_split_duration():
+    from operations import _split_duration
+
+    for ticks in (0, 60, 480, 1440, 3840, 3840 + 1920 + 60, 320, 640, 960 + 160, 3840 - 320):
+        durations = _split_duration(ticks)
+        assert sum(duration.time for duration in durations) == ticks
+    # a quintuplet rest
+    assert _split_duration(96) is None
@@ -0,0 +1,108 @@
+"""Checks of the MIDI export against the annotations of the same track"""
+import guitarpro
+
+from benchmark import make_song
+from operations import get_track_annos
+from render import (
+    _BEND,
+    _BEND_RESET,
+    _NOTE_OFF,
+    _NOTE_ON,
+    _SETUP,
+    DEAD_NOTE_TIME,
+    MUTED_GUITAR_PROGRAM,
+    get_midi_events,
+)
+from unroll import get_timing
+
+BEND = guitarpro.BendEffect(
+    type=guitarpro.BendType.bend,
+    value=100,
+    points=[guitarpro.BendPoint(0, 0), guitarpro.BendPoint(6, 4), guitarpro.BendPoint(12, 4)],
+)
+
+
+def make_track(tmp_path, measures):
+    """A one-track song, `measures` lists the beats of each measure as (duration value, [(string, fret, type, bent)])"""
+    path = str(tmp_path / "song.gp5")
+    make_song(path, n_tracks=1, n_measures=len(measures), seed=0)
+    song = guitarpro.parse(path)
+    for measure, beats in zip(song.tracks[0].measures, measures):
+        voice = measure.voices[0]
+        voice.beats = []
+        for value, notes in beats:
+            beat = guitarpro.Beat(voice, duration=guitarpro.Duration(value=value), status=guitarpro.BeatStatus.normal)
+            for string, fret, note_type, bent in notes:
+                effect = guitarpro.NoteEffect(bend=BEND if bent else None)
+                beat.notes.append(guitarpro.Note(beat, value=fret, string=string, type=note_type, effect=effect))
+            voice.beats.append(beat)
+    guitarpro.write(song, path)
+    song = guitarpro.parse(path)
+    tempo_map, order = get_timing(song)
+    return song.tracks[0], get_midi_events(song.tracks[0], tempo_map, order)
+
+
+def note_ons(events):
+    """(tick, channel, pitch) of every note-on, in time order"""
+    return sorted((tick, message[0] & 0x0F, message[1]) for tick, kind, message in events if kind == _NOTE_ON)
+
+
+def test_dead_notes(tmp_path):
+    normal, dead = guitarpro.NoteType.normal, guitarpro.NoteType.dead
+    track, events = make_track(
+        tmp_path, [[(4, [(1, 0, normal, False)]), (4, [(1, 3, dead, False)]), (2, [(2, 5, normal, False)])]]
+    )
+    channel = track.channel.channel
+    # the same notes as the annotations, dead notes included
+    annotated = [note for segment in get_track_annos(track, get_timing(track.song)[0]) for note in segment]
+    assert [note["type"] for note in annotated] == ["normal", "dead", "normal"]
+    ons = note_ons(events)
+    assert [pitch for _, _, pitch in ons] == [note["pitch"] for note in annotated]
+    assert [tick for tick, _, _ in ons] == [0, 960, 1920]
+    # played short, on a muted guitar channel
+    dead_channel = ons[1][1]
+    assert dead_channel != channel and {ons[0][1], ons[2][1]} == {channel}
+    assert (0, _SETUP, bytes([0xC0 | dead_channel, MUTED_GUITAR_PROGRAM])) in events
+    assert (960 + DEAD_NOTE_TIME, _NOTE_OFF, bytes([0x80 | dead_channel, ons[1][2], 0])) in events
+
+
+def test_no_dead_note_channel(tmp_path):
+    track, events = make_track(tmp_path, [[(1, [(1, 0, guitarpro.NoteType.normal, False)])]])
+    programs = [message for _, kind, message in events if kind == _SETUP and message[0] & 0xF0 == 0xC0]
+    assert programs == [bytes([0xC0 | track.channel.channel, track.channel.instrument])]
+
+
+def test_bends_on_their_own_channels(tmp_path):
+    normal, tie = guitarpro.NoteType.normal, guitarpro.NoteType.tie
+    track, events = make_track(
+        tmp_path,
+        [
+            # a bent note in a chord, held through a tie
+            [(2, [(3, 5, normal, True), (1, 0, normal, False)]), (2, [(3, 5, tie, True)])],
+            # two bent notes at once, then one after them
+            [(2, [(3, 5, normal, True), (2, 5, normal, True)]), (2, [(3, 7, normal, True)])],
+        ],
+    )
+    channel = track.channel.channel
+    ons = note_ons(events)
+    bends = [(tick, message[0] & 0x0F, kind) for tick, kind, message in events if kind in (_BEND, _BEND_RESET)]
+    assert not [bend for bend in bends if bend[1] == channel]
+
+    # the unbent note of the chord keeps its pitch on the track channel
+    (first_bent,) = [on for on in ons if on[0] == 0 and on[1] != channel]
+    assert (0, channel, 64) in ons
+    first_channel = first_bent[1]
+    # the bend of the tie is on the same channel, and reset at its end
+    first_bends = [tick for tick, c, kind in bends if c == first_channel and kind == _BEND and tick < 3840]
+    assert first_bends == [0, 960, 1920, 1920, 2880]
+    assert (3840, first_channel, _BEND_RESET) in bends
+
+    second = [on for on in ons if on[0] == 3840]
+    assert len({c for _, c, _ in second} | {channel}) == 3
+    # a channel is used again once it is free
+    (third,) = [on for on in ons if on[0] == 3840 + 1920]
+    assert third[1] in {c for _, c, _ in second}
+    for _, c, _ in ons:
+        if c != channel:
+            # every channel is set up for the bend range
+            assert (0, _SETUP, bytes([0xB0 | c, 6, 12])) in events
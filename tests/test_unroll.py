@@ -0,0 +1,133 @@
+"""Checks of the playback order against hand-unrolled repeats"""
+import guitarpro
+import numpy as np
+import pytest
+
+from benchmark import make_song
+from operations import process_song
+from tempo_map import START_TICK
+from unroll import get_playback_order, get_timing, has_repeats, iter_unrolled_beats
+
+MEASURE_TIME = 3840
+
+
+def make_headers(n_measures, opens=(), closes=None, alternatives=None):
+    """4/4 measure headers with repeat opens, closes ({measure: jumps back}) and alternate endings ({measure: bitmask})"""
+    headers = []
+    for i in range(n_measures):
+        header = guitarpro.MeasureHeader(number=i + 1, start=START_TICK + i * MEASURE_TIME)
+        header.isRepeatOpen = i in opens
+        header.repeatClose = (closes or {}).get(i, -1)
+        header.repeatAlternative = (alternatives or {}).get(i, 0)
+        headers.append(header)
+    return headers
+
+
+@pytest.mark.parametrize(
+    "n_measures, repeats, expected",
+    [
+        (4, {}, [0, 1, 2, 3]),
+        (4, dict(opens=[1], closes={2: 1}), [0, 1, 2, 1, 2, 3]),
+        (4, dict(opens=[1], closes={2: 2}), [0, 1, 2, 1, 2, 1, 2, 3]),
+        (3, dict(opens=[1], closes={1: 2}), [0, 1, 1, 1, 2]),
+        # no repeat open: back to the start of the song, then to the measure after the previous repeat
+        (4, dict(closes={1: 1}), [0, 1, 0, 1, 2, 3]),
+        (6, dict(opens=[1], closes={2: 1, 4: 1}), [0, 1, 2, 1, 2, 3, 4, 3, 4, 5]),
+        # Guitar Pro does not nest repeats: a close goes back to the latest open, and a close after
+        # a finished repeat goes back to the measure after it, as pyguitarpro groups the measures
+        (7, dict(opens=[0, 2], closes={3: 1, 5: 1}), [0, 1, 2, 3, 2, 3, 4, 5, 4, 5, 6]),
+        (5, dict(opens=[0, 1], closes={2: 1, 3: 1}), [0, 1, 2, 1, 2, 3, 3, 4]),
+        # alternate endings: bit k of the bitmask plays the ending on pass k + 1
+        (4, dict(opens=[0], closes={1: 1}, alternatives={1: 0b1, 2: 0b10}), [0, 1, 0, 2, 3]),
+        (
+            5,
+            dict(opens=[0], closes={1: 1, 2: 1}, alternatives={1: 0b1, 2: 0b10, 3: 0b100}),
+            [0, 1, 0, 2, 0, 3, 4],
+        ),
+        (4, dict(opens=[0], closes={1: 2}, alternatives={1: 0b11, 2: 0b100}), [0, 1, 0, 1, 0, 2, 3]),
+        # a repeat after the alternate endings of another one
+        (
+            6,
+            dict(opens=[0, 3], closes={1: 1, 4: 1}, alternatives={1: 0b1, 2: 0b10}),
+            [0, 1, 0, 2, 3, 4, 3, 4, 5],
+        ),
+    ],
+)
+def test_playback_order(n_measures, repeats, expected):
+    headers = make_headers(n_measures, **repeats)
+    assert has_repeats(headers) == bool(repeats)
+    order = get_playback_order(headers)
+    assert order.dtype == np.int32
+    assert order.tolist() == expected
+
+
+@pytest.mark.parametrize("extension", ["gp3", "gp5"])
+def test_playback_order_from_file(tmp_path, extension):
+    # GP5 stores the number of plays and pyguitarpro reads it decremented, GP3 the number of jumps back:
+    # both read as the number of jumps back
+    path = str(tmp_path / f"song.{extension}")
+    make_song(path, n_tracks=1, n_measures=6, seed=0)
+    song = guitarpro.parse(path)
+    song.measureHeaders[1].isRepeatOpen = True
+    song.measureHeaders[2].repeatClose = 2
+    song.measureHeaders[3].isRepeatOpen = True
+    song.measureHeaders[4].repeatClose = 1
+    guitarpro.write(song, path)
+    song = guitarpro.parse(path)
+    assert [header.repeatClose for header in song.measureHeaders] == [-1, -1, 2, -1, 1, -1]
+    assert get_playback_order(song.measureHeaders).tolist() == [0, 1, 2, 1, 2, 1, 2, 3, 4, 3, 4, 5]
+
+
+def test_unrolled_beats(tmp_path):
+    path = str(tmp_path / "song.gp5")
+    make_song(path, n_tracks=1, n_measures=4, beats_per_measure=4, seed=0)
+    song = guitarpro.parse(path)
+    song.measureHeaders[1].isRepeatOpen = True
+    song.measureHeaders[2].repeatClose = 1
+    track = song.tracks[0]
+    order = get_playback_order(song.measureHeaders)
+    beats = list(iter_unrolled_beats(track, order))
+    expected = [beat for i in order for beat in track.measures[i].voices[0].beats]
+    assert [beat.beat for beat in beats] == expected
+    assert [beat.start for beat in beats] == [START_TICK + 960 * k for k in range(len(expected))]
+    # everything but the start is the original beat
+    assert [beat.notes for beat in beats] == [beat.notes for beat in expected]
+    assert [beat.beat.start for beat in beats[12:16]] == [beat.start for beat in track.measures[1].voices[0].beats]
+
+
+def make_repeat_song(path):
+    """One whole note per measure at 120 BPM, 60 BPM in measure 1, and measures 0 - 1 repeated without an opening"""
+    make_song(path, n_tracks=1, n_measures=3, seed=0)
+    song = guitarpro.parse(path)
+    song.tempo = 120
+    for i, measure in enumerate(song.tracks[0].measures):
+        voice = measure.voices[0]
+        beat = guitarpro.Beat(voice, duration=guitarpro.Duration(value=1), status=guitarpro.BeatStatus.normal)
+        beat.notes.append(guitarpro.Note(beat, value=i, string=1, type=guitarpro.NoteType.normal))
+        if i < 2:
+            tempo = [120, 60][i]
+            beat.effect.mixTableChange = guitarpro.MixTableChange(tempo=guitarpro.MixTableItem(tempo, 0, True))
+        voice.beats = [beat]
+    song.measureHeaders[1].repeatClose = 1
+    guitarpro.write(song, path)
+
+
+def test_process_song_repeats(tmp_path):
+    path = str(tmp_path / "song.gp5")
+    make_repeat_song(path)
+    song = guitarpro.parse(path)
+    _, order = get_timing(song)
+    assert order.tolist() == [0, 1, 0, 1, 2]
+
+    # 2 s per measure at 120 BPM, 4 s at 60: the tempo of measure 0 is set again on the second pass
+    (unrolled,) = process_song(path, disable_repeats=False)
+    assert unrolled["mono"] == [[0.0, 16.0]] and unrolled["poly"] == []
+    (notes,) = unrolled["annos"]
+    assert [note["fret"] for note in notes] == [0, 1, 0, 1, 2]
+    assert [(note["time"]["start"], note["time"]["dur"]) for note in notes] == [(0, 2), (2, 4), (6, 2), (8, 4), (12, 4)]
+
+    # as written
+    (written,) = process_song(path)
+    assert written["mono"] == [[0.0, 10.0]]
+    (notes,) = written["annos"]
+    assert [(note["time"]["start"], note["time"]["dur"]) for note in notes] == [(0, 2), (2, 4), (6, 4)]
@@ -0,0 +1,151 @@
+"""Playback order of a song, with its repeats and alternate endings unrolled
+
+So far the repeats were disabled in every measure (see `operations.clean_track`), which changes the
+music. Instead, the playback order can be computed once per song as an array of measure indices,
+and the beats walked in that order with their unrolled ticks:
+
+    order = get_playback_order(song.measureHeaders)
+    for beat in iter_unrolled_beats(track, order):
+        beat.start  # the tick in the unrolled song, everything else is the original beat
+
+The measures and beats are never copied, so a heavily repeated song costs one index per played
+measure and one small proxy per beat being walked.
+
+The header fields are those of pyguitarpro: `isRepeatOpen`, `repeatClose` (the number of jumps back,
+-1 for no repeat) and `repeatAlternative` (a bitmask, bit k set means the measure is played on pass k + 1).
+"""
+import numpy as np
+
+from tempo_map import START_TICK, TempoMap
+
+
+def has_repeats(headers):
+    """Whether any of the measure headers has a repeat sign or an alternate ending"""
+    return any(
+        header.isRepeatOpen or header.repeatClose > 0 or header.repeatAlternative
+        for header in headers
+    )
+
+
+def get_playback_order(headers):
+    """Return the indices of the measures in the order they are played
+
+    A repeat close jumps back to the last repeat open (or to the measure after the previous repeat
+    group, or to the start of the song) `repeatClose` times. A measure with `repeatAlternative` is only
+    played on the passes in its bitmask. The walk is linear in the length of the unrolled song.
+
+    Args:
+        headers (list): The MeasureHeader objects of the song, i.e., `song.measureHeaders`
+
+    Returns:
+        np.ndarray: The measure indices (int32) in playback order
+    """
+    order = []
+    # the first measure of the current repeat group, and the pass through it (1-based)
+    start = 0
+    repeat_pass = 1
+    # the number of jumps already taken at each repeat close of the current group
+    jumps = {}
+    in_alternatives = False
+    i = 0
+    while i < len(headers):
+        header = headers[i]
+        if header.isRepeatOpen and i != start:
+            # a new repeat group, reached by walking forward
+            start, repeat_pass, jumps = i, 1, {}
+        alternative = header.repeatAlternative
+        if alternative:
+            in_alternatives = True
+            if not (alternative >> (repeat_pass - 1)) & 1:
+                # this ending is not played on this pass
+                i += 1
+                continue
+        elif in_alternatives:
+            # walked past the last alternate ending, the repeat group is over
+            start, repeat_pass, jumps = i, 1, {}
+            in_alternatives = False
+        order.append(i)
+        if header.repeatClose > 0:
+            if jumps.get(i, 0) < header.repeatClose:
+                jumps[i] = jumps.get(i, 0) + 1
+                repeat_pass += 1
+                in_alternatives = False
+                i = start
+                continue
+            if not in_alternatives:
+                # all jumps taken, a repeat close without an open repeats from here on
+                start, repeat_pass, jumps = i + 1, 1, {}
+        i += 1
+    return np.asarray(order, dtype=np.int32)
+
+
+def get_measure_starts(headers, order):
+    """Return the unrolled start tick of each played measure, aligned with `order`"""
+    lengths = np.asarray([header.length for header in headers], dtype=np.int64)
+    starts = np.empty(len(order), dtype=np.int64)
+    starts[:1] = START_TICK
+    np.cumsum(lengths[order][:-1], out=starts[1:])
+    starts[1:] += START_TICK
+    return starts
+
+
+class UnrolledBeat:
+    """A beat seen at its unrolled position: `start` is the unrolled tick, every other attribute is the beat's"""
+
+    __slots__ = ("beat", "start")
+
+    def __init__(self, beat, start):
+        self.beat = beat
+        self.start = start
+
+    def __getattr__(self, name):
+        return getattr(self.beat, name)
+
+    def __repr__(self):
+        return f"UnrolledBeat(start={self.start}, beat={self.beat!r})"
+
+
+def iter_unrolled_beats(track, order, voice=0):
+    """Yield the beats of one voice of one track in playback order, as UnrolledBeat objects
+
+    Args:
+        track (Track): A pyguitarpro Track object
+        order (np.ndarray): The playback order, obtained from `get_playback_order`
+        voice (int, optional): The voice to walk. Defaults to 0.
+    """
+    headers = [measure.header for measure in track.measures]
+    measure_starts = get_measure_starts(headers, order)
+    for measure_start, measure_idx in zip(measure_starts.tolist(), order.tolist()):
+        measure = track.measures[measure_idx]
+        offset = measure_start - measure.header.start
+        for beat in measure.voices[voice].beats:
+            yield UnrolledBeat(beat, beat.start + offset)
+
+
+def get_unrolled_tempo_map(tracks, order, bpm):
+    """Build the tempo map of the unrolled song, see `tempo_map.TempoMap.from_tracks`"""
+
+    def iter_beats():
+        for track in tracks:
+            for voice in range(len(track.measures[0].voices) if track.measures else 0):
+                yield from iter_unrolled_beats(track, order, voice)
+
+    return TempoMap.from_beats(iter_beats(), bpm)
+
+
+def get_timing(song, tracks=None):
+    """Return the tempo map and the playback order for annotating (some tracks of) a song
+
+    Args:
+        song (Song): A pyguitarpro Song object
+        tracks (list, optional): The tracks to take the tempo changes from. Defaults to None (all tracks).
+
+    Returns:
+        TempoMap, np.ndarray: The tempo map in unrolled ticks, and the playback order,
+        which is None for a song without repeats (the measures are played as written)
+    """
+    tracks = song.tracks if tracks is None else tracks
+    if not has_repeats(song.measureHeaders):
+        return TempoMap.from_tracks(tracks, song.tempo), None
+    order = get_playback_order(song.measureHeaders)
+    return get_unrolled_tempo_map(tracks, order, song.tempo), order
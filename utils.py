@@ -1,5 +1,8 @@
 import numpy as np
 
+from tempo_map import TempoMap
+from unroll import iter_unrolled_beats
+
 
 def get_metadata(song):
     metadata = {
@@ -104,16 +107,92 @@ def get_measure_notes(measure):
             return notes
 
 
-def get_note_info(note, bpm, margin=None):
+def get_measure_note_count(measure):
+    """The number of notes `get_measure_notes` would return, without building the list (0 for a measure without beats)"""
+    for voice in measure.voices:
+        if not voice.isEmpty:
+            return sum(len(beat.notes) for beat in voice.beats)
+    return 0
+
+
+def iter_beats(track, order=None):
+    """Yield the beats of the first voice of one track, measure by measure
+
+    With a playback `order` (see `unroll.get_playback_order`), the measures are walked in that order,
+    and the beats come with their unrolled `start` ticks.
+    """
+    if order is not None:
+        yield from iter_unrolled_beats(track, order)
+        return
+    for measure in track.measures:
+        yield from measure.voices[0].beats
+
+
+def get_beat_time(beat, bpm):
+    """Return the (start, duration) of one beat in seconds, rounded to 0.1 ms
+
+    Args:
+        beat (Beat): A pyguitarpro Beat object
+        bpm (int or TempoMap): The tempo of the song, or its tempo map
+    """
+    if isinstance(bpm, TempoMap):
+        return bpm.beat_time(beat)
+    onset_sec = round(((beat.start - 960) / 960) / (bpm / 60), 4)
+    dur_sec = round((beat.duration.time / 960) / (bpm / 60), 4)
+    return onset_sec, dur_sec
+
+
+def iter_beat_segments(track, bpm, order=None):
+    """Walk the beats of one track and yield its poly / mono segments one by one
+
+    A segment is a maximal run of beats of the same kind: "poly" for beats with more than one note,
+    "mono" for beats with one note or silence. Each segment is yielded as soon as the first beat of
+    the next segment is reached, so only the beats of the current segment are held in memory.
+
+    Args:
+        track (Track): A pyguitarpro Track object
+        bpm (int or TempoMap): The tempo of the song, or its tempo map
+        order (np.ndarray, optional): The playback order, see `iter_beats`. Defaults to None (as written).
+
+    Yields:
+        tuple: (start_sec, end_sec, kind, beats) for each segment
+    """
+    kind = None
+    beats = []
+    for beat in iter_beats(track, order):
+        onset_sec, dur_sec = get_beat_time(beat, bpm)
+        beat_kind = "poly" if len(beat.notes) > 1 else "mono"
+        if beat_kind != kind:
+            if beats:
+                yield start_sec, end_sec, kind, beats
+            kind = beat_kind
+            beats = []
+            start_sec = onset_sec
+        beats.append(beat)
+        end_sec = onset_sec + dur_sec
+    if beats:
+        yield start_sec, end_sec, kind, beats
+
+
+def iter_mono_beat_segments(track, bpm, order=None):
+    """Yield the (start_sec, beats) of the mono segments of one track, see `iter_beat_segments`"""
+    for start_sec, _, kind, beats in iter_beat_segments(track, bpm, order):
+        if kind == "mono":
+            yield start_sec, beats
+
+
+def get_note_info(note, bpm, margin=None, beat=None):
     """
     This is the comprehensive function for generating note-level annotation
 
     It calls `get_note_time` and `get_effect_info`
 
     `margin` is for passing in the global onset of the segment and calculate the note start time in the segment
+
+    `beat` is for passing in the beat of the note as walked, e.g., an `unroll.UnrolledBeat`
     """
     note_info = {
-        "time": get_note_time(note, bpm, margin=margin),
+        "time": get_note_time(note, bpm, margin=margin, beat=beat),
         "string": note.string,
         "fret": note.value,  # fret number
         # "dur_percent": note.durationPercent,
@@ -166,15 +245,14 @@ def get_effect_info(effect):
     return effect_info
 
 
-def get_note_time(note, bpm, margin=None):
-    start = note.beat.start
-    start_sec = round(((start - 960) / 960) / (bpm / 60), 4)
+def get_note_time(note, bpm, margin=None, beat=None):
+    # `bpm` is the tempo of the song, or a TempoMap for songs with tempo changes
+    # `beat` overrides `note.beat`, e.g., with the unrolled beat of a repeated measure
+    start_sec, dur_sec = get_beat_time(beat or note.beat, bpm)
     # the note timing info encoded in a GP file is global, i.e., the start time in the song
     # I want the start time in the segment, `margin` is the start time of the segment
     if margin:
         start_sec = start_sec - margin
-    dur = note.beat.duration.time
-    dur_sec = round((dur / 960) / (bpm / 60), 4)
     time = {"start": start_sec, "dur": dur_sec}
     return time
 